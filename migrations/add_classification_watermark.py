@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the classify-on-ingest watermark table.
+Adds the classification_watermark table.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_watermark_table():
+    """Create the classification watermark table"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS classification_watermark (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                model_version INTEGER NOT NULL,
+                first_email_id INTEGER DEFAULT 0,
+                last_email_id INTEGER DEFAULT 0,
+                emails_classified INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customer(id),
+                UNIQUE(customer_id, model_version)
+            )
+        ''')
+        
+        conn.commit()
+        print("✓ Classification watermark table created successfully")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating classification watermark table: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting classification watermark migration...")
+    
+    try:
+        create_watermark_table()
+        print("\n✓ Classification watermark migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
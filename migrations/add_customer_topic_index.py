@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Migration script to index customer_topic by customer.
+Classification, hierarchy and topic count queries look up a customer's topics by customer_id.
+Topics that topic extraction generated from a customer's emails without associating them are
+linked to the customers whose emails they were assigned to, so they stop counting as global.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_customer_topic_index():
+    """Create the customer_topic customer index"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_customer_topic_customer
+            ON customer_topic (customer_id)
+        ''')
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO customer_topic (customer_id, topic_id, created_at)
+            SELECT DISTINCT e.customer_id, t.id, CURRENT_TIMESTAMP
+            FROM topic t
+            JOIN email_topic et ON et.topic_id = t.id
+            JOIN email_thread e ON e.id = et.email_id
+            WHERE t.created_by = 'embeddings_system'
+            AND NOT EXISTS (SELECT 1 FROM customer_topic ct WHERE ct.topic_id = t.id)
+        ''')
+        linked = cursor.rowcount
+        
+        conn.commit()
+        print(f"✓ Customer topic index created successfully ({linked} generated topic links added)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating customer topic index: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting customer topic index migration...")
+    
+    try:
+        create_customer_topic_index()
+        print("\n✓ Customer topic index migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
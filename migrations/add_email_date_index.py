@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the (customer_id, date) index on email_thread.
+Date-range filters and keyset pagination of email ids scan this index.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_email_date_index():
+    """Create the customer/date index"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_thread_customer_date ON email_thread(customer_id, date)')
+        cursor.execute('ANALYZE email_thread')
+        
+        conn.commit()
+        print("✓ Email date index created successfully")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating email date index: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting email date index migration...")
+    
+    try:
+        create_email_date_index()
+        print("\n✓ Email date index migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
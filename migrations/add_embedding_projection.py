@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration script to add embedding dimensionality reduction storage.
+Adds the embedding_projection table and reduced embedding columns on email_thread.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to a table unless it already exists"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    if column not in existing_columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def create_projection_tables():
+    """Create the projection table and reduced embedding columns"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_projection (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                method VARCHAR(20) NOT NULL,
+                embedding_model VARCHAR(100),
+                input_dim INTEGER NOT NULL,
+                output_dim INTEGER NOT NULL,
+                components BLOB NOT NULL,
+                mean BLOB,
+                explained_variance REAL,
+                sample_size INTEGER,
+                is_active BOOLEAN DEFAULT TRUE,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customer(id),
+                UNIQUE(customer_id, version)
+            )
+        ''')
+        
+        add_column_if_missing(cursor, 'email_thread', 'reduced_embedding', 'TEXT')
+        add_column_if_missing(cursor, 'email_thread', 'reduced_embedding_version', 'INTEGER')
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_embedding_projection_customer ON embedding_projection(customer_id, is_active)')
+        
+        conn.commit()
+        print("✓ Embedding projection tables created successfully")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating embedding projection tables: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting embedding projection migration...")
+    
+    try:
+        create_projection_tables()
+        print("\n✓ Embedding projection migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the processing_job table.
+Background embedding jobs are persisted here so they survive restarts and are visible to every worker.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to a table unless it already exists"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    if column not in existing_columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def create_processing_job_table():
+    """Create the processing_job table"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS processing_job (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id VARCHAR(100) NOT NULL UNIQUE,
+                job_type VARCHAR(50) NOT NULL,
+                customer_id INTEGER,
+                params TEXT,
+                status VARCHAR(20) DEFAULT 'pending',
+                progress INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                skipped INTEGER DEFAULT 0,
+                errors INTEGER DEFAULT 0,
+                cursor INTEGER,
+                throughput REAL,
+                eta_seconds REAL,
+                event_seq INTEGER DEFAULT 0,
+                error_message TEXT,
+                cancel_requested BOOLEAN DEFAULT FALSE,
+                worker_id VARCHAR(100),
+                heartbeat_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                started_at DATETIME,
+                finished_at DATETIME,
+                FOREIGN KEY (customer_id) REFERENCES customer(id)
+            )
+        ''')
+        
+        # Progress streaming columns (for tables created before they existed)
+        add_column_if_missing(cursor, 'processing_job', 'throughput', 'REAL')
+        add_column_if_missing(cursor, 'processing_job', 'eta_seconds', 'REAL')
+        add_column_if_missing(cursor, 'processing_job', 'event_seq', 'INTEGER DEFAULT 0')
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_processing_job_status ON processing_job(job_type, status)')
+        
+        conn.commit()
+        print("✓ Processing job table created successfully")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating processing job table: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting processing job migration...")
+    
+    try:
+        create_processing_job_table()
+        print("\n✓ Processing job migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Migration script to add per-customer topic aggregates.
+Adds the sender_topic_affinity and topic_daily_frequency tables and fills them from the
+existing topic assignments.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_aggregate_tables():
+    """Create and populate the topic aggregate tables"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sender_topic_affinity (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                sender_email VARCHAR(100) NOT NULL,
+                topic_id INTEGER NOT NULL,
+                assignment_count INTEGER DEFAULT 0,
+                confidence_sum REAL DEFAULT 0.0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customer(id),
+                FOREIGN KEY (topic_id) REFERENCES topic(id),
+                UNIQUE(customer_id, sender_email, topic_id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS topic_daily_frequency (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL,
+                day DATE NOT NULL,
+                assignment_count INTEGER DEFAULT 0,
+                FOREIGN KEY (customer_id) REFERENCES customer(id),
+                FOREIGN KEY (topic_id) REFERENCES topic(id),
+                UNIQUE(customer_id, topic_id, day)
+            )
+        ''')
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_topic_daily_frequency_customer_day ON topic_daily_frequency(customer_id, day)')
+        
+        # Populate from the current assignments
+        cursor.execute('DELETE FROM sender_topic_affinity')
+        cursor.execute('''
+            INSERT INTO sender_topic_affinity (customer_id, sender_email, topic_id, assignment_count, confidence_sum)
+            SELECT e.customer_id, e.sender_email, et.topic_id, COUNT(et.id), COALESCE(SUM(et.confidence_score), 0)
+            FROM email_topic et
+            JOIN email_thread e ON e.id = et.email_id
+            WHERE e.sender_email IS NOT NULL
+            GROUP BY e.customer_id, e.sender_email, et.topic_id
+        ''')
+        affinity_count = cursor.rowcount
+        
+        cursor.execute('DELETE FROM topic_daily_frequency')
+        cursor.execute('''
+            INSERT INTO topic_daily_frequency (customer_id, topic_id, day, assignment_count)
+            SELECT e.customer_id, et.topic_id, date(e.date), COUNT(et.id)
+            FROM email_topic et
+            JOIN email_thread e ON e.id = et.email_id
+            WHERE e.date IS NOT NULL
+            GROUP BY e.customer_id, et.topic_id, date(e.date)
+        ''')
+        frequency_count = cursor.rowcount
+        
+        conn.commit()
+        print(f"✓ Topic aggregate tables created ({affinity_count} sender affinities, {frequency_count} daily counts)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating topic aggregate tables: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting topic aggregates migration...")
+    
+    try:
+        create_aggregate_tables()
+        print("\n✓ Topic aggregates migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Migration script to add topic centroid vectors.
+Adds the topic_centroid table and builds centroids from the existing topic assignments.
+"""
+
+import json
+import sqlite3
+import os
+from datetime import datetime
+
+import numpy as np
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_centroid_table():
+    """Create the topic centroid table and populate it"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS topic_centroid (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic_id INTEGER NOT NULL,
+                embedding_dim INTEGER NOT NULL,
+                vector_sum BLOB NOT NULL,
+                weight_sum REAL DEFAULT 0.0,
+                member_count INTEGER DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (topic_id) REFERENCES topic(id),
+                UNIQUE(topic_id, embedding_dim)
+            )
+        ''')
+        
+        # Build centroids from the current assignments
+        cursor.execute('''
+            SELECT et.topic_id, et.confidence_score, e.embedding
+            FROM email_topic et
+            JOIN email_thread e ON e.id = et.email_id
+            WHERE e.has_embedding = 1 AND e.embedding IS NOT NULL
+        ''')
+        
+        sums = {}
+        for topic_id, confidence, embedding in cursor.fetchall():
+            try:
+                vector = np.asarray(json.loads(embedding), dtype=np.float64)
+            except (ValueError, TypeError):
+                continue
+            key = (topic_id, len(vector))
+            if key not in sums:
+                sums[key] = [np.zeros(len(vector)), 0.0, 0]
+            sums[key][0] += vector * (confidence or 0.0)
+            sums[key][1] += confidence or 0.0
+            sums[key][2] += 1
+        
+        cursor.execute('DELETE FROM topic_centroid')
+        now = datetime.utcnow().isoformat(sep=' ')
+        for (topic_id, width), (vector_sum, weight_sum, member_count) in sums.items():
+            cursor.execute('''
+                INSERT INTO topic_centroid (topic_id, embedding_dim, vector_sum, weight_sum, member_count, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (topic_id, width, vector_sum.astype(np.float32).tobytes(), weight_sum, member_count, now))
+        
+        conn.commit()
+        print(f"✓ Topic centroid table created with {len(sums)} centroids")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating topic centroid table: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting topic centroid migration...")
+    
+    try:
+        create_centroid_table()
+        print("\n✓ Topic centroid migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the topic hierarchy closure table.
+Creates topic_closure and fills it from the existing topic.parent_id links.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def create_topic_closure_table():
+    """Create and backfill the topic closure table"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS topic_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (ancestor_id, descendant_id),
+                FOREIGN KEY (ancestor_id) REFERENCES topic (id),
+                FOREIGN KEY (descendant_id) REFERENCES topic (id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_topic_closure_descendant
+            ON topic_closure (descendant_id, depth)
+        ''')
+        
+        # Walk every topic up its parent chain (depth guard against cycles)
+        cursor.execute('''
+            INSERT OR IGNORE INTO topic_closure (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE chain(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM topic
+                UNION ALL
+                SELECT topic.parent_id, chain.descendant_id, chain.depth + 1
+                FROM chain JOIN topic ON topic.id = chain.ancestor_id
+                WHERE topic.parent_id IS NOT NULL AND chain.depth < 32
+            )
+            SELECT ancestor_id, descendant_id, MIN(depth) FROM chain
+            GROUP BY ancestor_id, descendant_id
+        ''')
+        
+        conn.commit()
+        print(f"✓ Topic closure table created ({cursor.rowcount} rows added)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating topic closure table: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting topic closure migration...")
+    
+    try:
+        create_topic_closure_table()
+        print("\n✓ Topic closure migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Migration script to add topic model versioning.
+Adds the single-row topic_model_state table and the model_version column on email_topic.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to a table unless it already exists"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    if column not in existing_columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def create_model_version_tables():
+    """Create the topic model state table and assignment version column"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS topic_model_state (
+                id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 1,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO topic_model_state (id, version) VALUES (1, 1)')
+        
+        add_column_if_missing(cursor, 'email_topic', 'model_version', 'INTEGER')
+        
+        conn.commit()
+        print("✓ Topic model version tables created successfully")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating topic model version tables: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting topic model version migration...")
+    
+    try:
+        create_model_version_tables()
+        print("\n✓ Topic model version migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
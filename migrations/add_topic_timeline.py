@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the topic timeline rollup.
+Adds the topic_timeline_rollup table and backfills the day, week and month rollups from the
+existing topic assignments.
+"""
+
+import sqlite3
+import os
+
+def get_db_path():
+    """Get the database path"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database.db')
+
+# granularity -> SQLite expression of the period start of an email date
+PERIOD_STARTS = {
+    'day': "date(e.date)",
+    'week': "date(e.date, 'weekday 0', '-6 days')",
+    'month': "date(e.date, 'start of month')"
+}
+
+def create_timeline_table():
+    """Create and populate the topic timeline rollup table"""
+    
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS topic_timeline_rollup (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                topic_id INTEGER NOT NULL,
+                granularity VARCHAR(10) NOT NULL,
+                period_start DATE NOT NULL,
+                email_count INTEGER DEFAULT 0,
+                confidence_sum REAL DEFAULT 0.0,
+                FOREIGN KEY (customer_id) REFERENCES customer(id),
+                FOREIGN KEY (topic_id) REFERENCES topic(id),
+                UNIQUE(customer_id, topic_id, granularity, period_start)
+            )
+        ''')
+        
+        # Populate from the current assignments
+        cursor.execute('DELETE FROM topic_timeline_rollup')
+        rollup_count = 0
+        for granularity, period in PERIOD_STARTS.items():
+            cursor.execute(f'''
+                INSERT INTO topic_timeline_rollup (customer_id, topic_id, granularity, period_start, email_count, confidence_sum)
+                SELECT e.customer_id, et.topic_id, ?, {period}, COUNT(et.id), COALESCE(SUM(et.confidence_score), 0)
+                FROM email_topic et
+                JOIN email_thread e ON e.id = et.email_id
+                WHERE e.date IS NOT NULL
+                GROUP BY e.customer_id, et.topic_id, {period}
+            ''', (granularity,))
+            rollup_count += cursor.rowcount
+        
+        conn.commit()
+        print(f"✓ Topic timeline rollup table created ({rollup_count} rollups)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error creating topic timeline rollup table: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Run the migration"""
+    print("Starting topic timeline migration...")
+    
+    try:
+        create_timeline_table()
+        print("\n✓ Topic timeline migration completed successfully!")
+    except Exception as e:
+        print(f"\n✗ Migration failed: {e}")
+        return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
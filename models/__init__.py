@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timezone
 
 db = SQLAlchemy()
 
@@ -50,12 +50,19 @@ class EmailThread(db.Model):
     embedding_processed_at = db.Column(db.DateTime)
     embedding_error = db.Column(db.Text)
     
+    # Reduced-width embedding produced by the customer's active EmbeddingProjection
+    reduced_embedding = db.Column(db.Text)  # JSON array of floats
+    reduced_embedding_version = db.Column(db.Integer)  # EmbeddingProjection.version used
+    
     # Topics extracted from embeddings
     main_topics = db.Column(db.Text)  # JSON array of main topics
     sub_topics = db.Column(db.Text)  # JSON array of sub topics
     topics_extracted_at = db.Column(db.DateTime)
     topics_extraction_error = db.Column(db.Text)
     
+    # Date-range filters and keyset pagination scan this index
+    __table_args__ = (db.Index('idx_email_thread_customer_date', 'customer_id', 'date'),)
+    
     def __repr__(self):
         return f'<EmailThread {self.subject[:50]}...>'
     
@@ -76,6 +83,112 @@ class EmailThread(db.Model):
         recipient_domain = self.recipient_email.split('@')[-1].lower() if self.recipient_email else ''
         return sender_domain in our_domains or recipient_domain in our_domains
 
+class EmbeddingProjection(db.Model):
+    """Fitted dimensionality reduction (PCA or random projection) for a customer's embeddings"""
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)  # Increments on every refit
+    method = db.Column(db.String(20), nullable=False)  # 'pca' or 'random'
+    embedding_model = db.Column(db.String(100))  # Model of the embeddings it was fitted on
+    input_dim = db.Column(db.Integer, nullable=False)
+    output_dim = db.Column(db.Integer, nullable=False)
+    components = db.Column(db.LargeBinary, nullable=False)  # float32 matrix (output_dim x input_dim)
+    mean = db.Column(db.LargeBinary)  # float32 vector (input_dim), None for random projection
+    explained_variance = db.Column(db.Float)  # Fraction of sample variance kept (PCA only)
+    sample_size = db.Column(db.Integer)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('customer_id', 'version', name='unique_customer_projection_version'),)
+    
+    def __repr__(self):
+        return f'<EmbeddingProjection customer:{self.customer_id} v{self.version} {self.input_dim}->{self.output_dim}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'customer_id': self.customer_id,
+            'version': self.version,
+            'method': self.method,
+            'embedding_model': self.embedding_model,
+            'input_dim': self.input_dim,
+            'output_dim': self.output_dim,
+            'explained_variance': self.explained_variance,
+            'sample_size': self.sample_size,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+def _utc_epoch(value):
+    """Epoch seconds of a naive UTC datetime (None stays None)"""
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else None
+
+class ProcessingJob(db.Model):
+    """Persistent record of a long-running background job, readable from every worker process"""
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String(100), unique=True, nullable=False)
+    job_type = db.Column(db.String(50), nullable=False)  # 'embeddings', 'classification'
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
+    params = db.Column(db.Text)  # JSON job parameters (filters, method, ...)
+    
+    # Status and progress
+    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, error, cancelled
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    cursor = db.Column(db.Integer)  # Last email id of the last committed batch (resume point)
+    throughput = db.Column(db.Float)  # Emails per second in the current run
+    eta_seconds = db.Column(db.Float)
+    event_seq = db.Column(db.Integer, default=0)  # Incremented on every progress event (SSE event id)
+    error_message = db.Column(db.Text)
+    
+    # Coordination between worker processes
+    cancel_requested = db.Column(db.Boolean, default=False)
+    worker_id = db.Column(db.String(100))  # host:pid currently running the job
+    heartbeat_at = db.Column(db.DateTime)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ProcessingJob {self.task_id} ({self.status})>'
+    
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'error', 'cancelled')
+    
+    def to_dict(self):
+        # Stored datetimes are naive UTC; epochs must not be read as local time
+        start_time = _utc_epoch(self.started_at)
+        end_time = _utc_epoch(self.finished_at)
+        duration = None
+        if start_time:
+            duration = (end_time or _utc_epoch(datetime.utcnow())) - start_time
+        
+        return {
+            'task_id': self.task_id,
+            'job_type': self.job_type,
+            'customer_id': self.customer_id,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'throughput': self.throughput,
+            'eta_seconds': self.eta_seconds,
+            'error': self.error_message,
+            'cancel_requested': self.cancel_requested,
+            'worker_id': self.worker_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': duration,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None
+        }
+
 class FileReference(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
@@ -208,12 +321,10 @@ class Topic(db.Model):
     @property
     def full_path(self):
         """Get full hierarchical path (e.g., 'Real Estate > Residential > Pricing')"""
-        path = []
-        current = self
-        while current:
-            path.append(current.name)
-            current = current.parent
-        return ' > '.join(reversed(path))
+        names = db.session.query(Topic.name).join(
+            TopicClosure, TopicClosure.ancestor_id == Topic.id
+        ).filter(TopicClosure.descendant_id == self.id).order_by(TopicClosure.depth.desc()).all()
+        return ' > '.join(name for (name,) in names) or self.name
     
     @property
     def is_main_topic(self):
@@ -232,20 +343,15 @@ class Topic(db.Model):
     
     def get_descendants(self):
         """Get all descendant topics (children, grandchildren, etc.)"""
-        descendants = []
-        for child in self.children:
-            descendants.append(child)
-            descendants.extend(child.get_descendants())
-        return descendants
+        return Topic.query.join(TopicClosure, TopicClosure.descendant_id == Topic.id).filter(
+            TopicClosure.ancestor_id == self.id, TopicClosure.depth > 0
+        ).order_by(TopicClosure.depth, Topic.name).all()
     
     def get_ancestors(self):
         """Get all ancestor topics (parent, grandparent, etc.)"""
-        ancestors = []
-        current = self.parent
-        while current:
-            ancestors.append(current)
-            current = current.parent
-        return ancestors
+        return Topic.query.join(TopicClosure, TopicClosure.ancestor_id == Topic.id).filter(
+            TopicClosure.descendant_id == self.id, TopicClosure.depth > 0
+        ).order_by(TopicClosure.depth).all()
     
     def to_dict(self, include_hierarchy=True):
         """Convert topic to dictionary for JSON serialization"""
@@ -270,6 +376,23 @@ class Topic(db.Model):
         
         return result
 
+class TopicClosure(db.Model):
+    """Transitive closure of the topic hierarchy: one row per (ancestor, descendant) pair.
+    
+    Every topic is its own ancestor at depth 0, so ancestors, descendants and subtrees are
+    each a single query instead of a walk over parent/children one lazy load at a time.
+    """
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('topic.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('topic.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('idx_topic_closure_descendant', 'descendant_id', 'depth'),
+    )
+    
+    def __repr__(self):
+        return f'<TopicClosure {self.ancestor_id} -> {self.descendant_id} ({self.depth})>'
+
 class EmailTopic(db.Model):
     """Many-to-many relationship between emails and topics with confidence scoring"""
     id = db.Column(db.Integer, primary_key=True)
@@ -279,6 +402,7 @@ class EmailTopic(db.Model):
     # Classification metadata
     confidence_score = db.Column(db.Float, default=0.0)  # 0.0-1.0 confidence in classification
     classification_method = db.Column(db.String(50))  # 'manual', 'embedding', 'keyword', 'ml'
+    model_version = db.Column(db.Integer)  # Topic model version the assignment was made with
     
     # Assignment metadata
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -306,6 +430,7 @@ class EmailTopic(db.Model):
             'topic_id': self.topic_id,
             'confidence_score': self.confidence_score,
             'classification_method': self.classification_method,
+            'model_version': self.model_version,
             'assigned_at': self.assigned_at.isoformat() if self.assigned_at else None,
             'assigned_by': self.assigned_by,
             'is_verified': self.is_verified,
@@ -359,9 +484,128 @@ class TopicSimilarity(db.Model):
     def __repr__(self):
         return f'<TopicSimilarity {self.topic1_id}↔{self.topic2_id} ({self.similarity_score:.2f})>'
 
+class TopicCentroid(db.Model):
+    """Confidence-weighted sum of a topic's member email embeddings, kept per embedding width"""
+    id = db.Column(db.Integer, primary_key=True)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
+    embedding_dim = db.Column(db.Integer, nullable=False)
+    vector_sum = db.Column(db.LargeBinary, nullable=False)  # float32 vector, sum of confidence * embedding
+    weight_sum = db.Column(db.Float, default=0.0)  # Sum of member confidences
+    member_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('topic_id', 'embedding_dim', name='unique_topic_centroid_dim'),)
+    
+    def __repr__(self):
+        return f'<TopicCentroid topic:{self.topic_id} dim:{self.embedding_dim} members:{self.member_count}>'
+
+class SenderTopicAffinity(db.Model):
+    """Running totals of a sender's topic assignments within a customer"""
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    sender_email = db.Column(db.String(100), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
+    assignment_count = db.Column(db.Integer, default=0)
+    confidence_sum = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'sender_email', 'topic_id', name='unique_sender_topic_affinity'),
+    )
+    
+    def __repr__(self):
+        return f'<SenderTopicAffinity {self.sender_email} topic:{self.topic_id} ({self.assignment_count})>'
+
+class TopicDailyFrequency(db.Model):
+    """Number of topic assignments per customer, topic and email date"""
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    assignment_count = db.Column(db.Integer, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'topic_id', 'day', name='unique_topic_daily_frequency'),
+        db.Index('idx_topic_daily_frequency_customer_day', 'customer_id', 'day'),
+    )
+    
+    def __repr__(self):
+        return f'<TopicDailyFrequency customer:{self.customer_id} topic:{self.topic_id} {self.day}: {self.assignment_count}>'
+
+class TopicTimelineRollup(db.Model):
+    """Topic assignments per customer, topic and day, week or month of the email date"""
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # day, week or month
+    period_start = db.Column(db.Date, nullable=False)  # The day, Monday of the week or first of the month
+    email_count = db.Column(db.Integer, default=0)
+    confidence_sum = db.Column(db.Float, default=0.0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'topic_id', 'granularity', 'period_start',
+                            name='unique_topic_timeline_rollup'),
+    )
+    
+    @property
+    def avg_confidence(self):
+        return (self.confidence_sum or 0.0) / self.email_count if self.email_count else 0.0
+    
+    def __repr__(self):
+        return f'<TopicTimelineRollup customer:{self.customer_id} topic:{self.topic_id} {self.granularity} {self.period_start}: {self.email_count}>'
+    
+    def to_dict(self):
+        return {
+            'period_start': self.period_start.isoformat() if self.period_start else None,
+            'email_count': self.email_count or 0,
+            'avg_confidence': self.avg_confidence
+        }
+
+class ClassificationWatermark(db.Model):
+    """Range of a customer's email ids classified on ingest with one classification model version.
+    
+    Emails with first_email_id < id <= last_email_id were classified with model_version; the
+    row of the current version is the watermark new imports are classified from.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    model_version = db.Column(db.Integer, nullable=False)
+    first_email_id = db.Column(db.Integer, default=0)
+    last_email_id = db.Column(db.Integer, default=0)
+    emails_classified = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'model_version', name='unique_customer_watermark_version'),
+    )
+    
+    def __repr__(self):
+        return f'<ClassificationWatermark customer:{self.customer_id} v{self.model_version} <= {self.last_email_id}>'
+    
+    def to_dict(self):
+        return {
+            'customer_id': self.customer_id,
+            'model_version': self.model_version,
+            'first_email_id': self.first_email_id,
+            'last_email_id': self.last_email_id,
+            'emails_classified': self.emails_classified,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class TopicModelState(db.Model):
+    """Single-row version counter of the topic model (topics, keywords, hierarchy)"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TopicModelState v{self.version}>'
+
 # Association table for customer-topic many-to-many relationship
 customer_topic = db.Table('customer_topic',
     db.Column('customer_id', db.Integer, db.ForeignKey('customer.id'), primary_key=True),
     db.Column('topic_id', db.Integer, db.ForeignKey('topic.id'), primary_key=True),
-    db.Column('created_at', db.DateTime, default=datetime.utcnow)
+    db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    db.Index('idx_customer_topic_customer', 'customer_id')
 )
\ No newline at end of file
@@ -95,4 +95,25 @@ def test_topic_service():
         return jsonify({
             'status': 'error',
             'message': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@bp.route('/benchmark-classifier')
+def benchmark_classifier():
+    """Benchmark classifier speed and quality against verified topic assignments"""
+    try:
+        from services.classifier_benchmark import run_benchmark
+        
+        report = run_benchmark(
+            customer_id=request.args.get('customer_id', type=int),
+            limit=request.args.get('limit', 500, type=int),
+            chunk_size=request.args.get('chunk_size', 200, type=int)
+        )
+        
+        return jsonify(report)
+        
+    except Exception as e:
+        logger.error(f"Classifier benchmark error: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
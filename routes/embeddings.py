@@ -1,14 +1,11 @@
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
 from services.embeddings_service import get_embeddings_service
+from services.embedding_jobs import get_embedding_job_service
 from models import Customer, db
-import threading
-import time
+import json
 
 bp = Blueprint('embeddings', __name__, url_prefix='/embeddings')
 
-# Global storage for background tasks
-processing_tasks = {}
-
 @bp.route('/customer/<int:customer_id>')
 def customer_embeddings(customer_id):
     """Main customer embeddings interface"""
@@ -40,147 +37,115 @@ def process_embeddings(customer_id):
     """Start processing embeddings for selected emails"""
     data = request.get_json()
     
-    year = data.get('year')
-    month = data.get('month')
-    sender_filter = data.get('senders')
-    recipient_filter = data.get('recipients')
+    filters = {
+        'year': data.get('year'),
+        'month': data.get('month'),
+        'sender_filter': data.get('senders'),
+        'recipient_filter': data.get('recipients')
+    }
     embedding_method = data.get('embedding_method', 'openai')  # 'openai' or 'tfidf'
     
-    # Get email IDs matching the filters
-    email_ids = get_embeddings_service().get_filtered_email_ids(
+    # Count matching emails; the job streams the ids itself
+    total_emails = get_embeddings_service().count_filtered_emails(
         customer_id=customer_id,
-        year=year,
-        month=month,
-        sender_filter=sender_filter,
-        recipient_filter=recipient_filter
+        **filters
     )
     
-    if not email_ids:
+    if not total_emails:
         return jsonify({'error': 'No emails found matching the selected criteria'}), 400
     
-    # Create a unique task ID
-    task_id = "customer_{}_{}" .format(customer_id, int(time.time()))
-    
-    # Initialize task status
-    processing_tasks[task_id] = {
-        'status': 'starting',
-        'progress': 0,
-        'total': len(email_ids),
-        'processed': 0,
-        'errors': 0,
-        'skipped': 0,
-        'start_time': time.time()
-    }
+    # Persist the job so every worker can report on it and it survives restarts
+    job_service = get_embedding_job_service()
+    job = job_service.create_job(
+        customer_id=customer_id,
+        filters=filters,
+        embedding_method=embedding_method,
+        total=total_emails
+    )
     
     # Get reference to current app before starting thread
     from flask import current_app
-    app_instance = current_app._get_current_object()
-    
-    # Start background processing
-    def background_process():
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        try:
-            logger.info("Background process started for task {}".format(task_id))
-            
-            def progress_callback(current, total):
-                progress = int((current / total) * 100)
-                processing_tasks[task_id]['progress'] = progress
-                processing_tasks[task_id]['processed'] = current
-                logger.info("Progress for {}: {}/{}".format(task_id, current, total))
-            
-            processing_tasks[task_id]['status'] = 'processing'
-            
-            # Run within application context using the captured app instance
-            with app_instance.app_context():
-                logger.info("Entering app context for task {}".format(task_id))
-                
-                # Create service instance with the requested method
-                from services.embeddings_service import EmbeddingsService
-                service = EmbeddingsService(force_simple=(embedding_method == 'tfidf'))
-                logger.info("EmbeddingsService created for task {}".format(task_id))
-                
-                results = service.process_email_embeddings(
-                    email_ids=email_ids,
-                    progress_callback=progress_callback
-                )
-                logger.info("Processing completed for task {}: {}".format(task_id, results))
-                
-                processing_tasks[task_id].update({
-                    'status': 'completed',
-                    'progress': 100,
-                    'processed': results['processed'],
-                    'errors': results['errors'],
-                    'skipped': results['skipped'],
-                    'end_time': time.time()
-                })
-                
-        except Exception as e:
-            logger.error("Error in background process for task {}: {}".format(task_id, str(e)))
-            import traceback
-            logger.error("Traceback: {}".format(traceback.format_exc()))
-            processing_tasks[task_id].update({
-                'status': 'error',
-                'error': str(e),
-                'end_time': time.time()
-            })
-    
-    # Start the background thread
-    thread = threading.Thread(target=background_process)
-    thread.daemon = True
-    thread.start()
+    job_service.start_job(current_app._get_current_object(), job.task_id)
     
     return jsonify({
-        'task_id': task_id,
-        'message': 'Started processing {} emails'.format(len(email_ids)),
-        'total_emails': len(email_ids)
+        'task_id': job.task_id,
+        'message': 'Started processing {} emails'.format(total_emails),
+        'total_emails': total_emails
     })
 
 @bp.route('/api/task/<task_id>/status')
 def get_task_status(task_id):
     """Get the status of a processing task"""
-    if task_id not in processing_tasks:
+    job_service = get_embedding_job_service()
+    job = job_service.get_job(task_id)
+    if job is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    task = processing_tasks[task_id]
+    task = job.to_dict()
+    task['stale'] = job_service.is_stale(job)
+    return jsonify(task)
+
+@bp.route('/api/task/<task_id>/events')
+def stream_task_events(task_id):
+    """Stream task progress as server-sent events"""
+    job_service = get_embedding_job_service()
+    if job_service.get_job(task_id) is None:
+        return jsonify({'error': 'Task not found'}), 404
     
-    # Calculate duration if available
-    if 'start_time' in task:
-        if 'end_time' in task:
-            task['duration'] = task['end_time'] - task['start_time']
-        else:
-            task['duration'] = time.time() - task['start_time']
+    # EventSource sends Last-Event-ID automatically when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', 0)
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_event_id = 0
+    
+    def generate():
+        yield 'retry: 3000\n\n'
+        for event in job_service.iter_progress_events(task_id, last_event_id=last_event_id):
+            if event is None:
+                yield ': heartbeat\n\n'
+            else:
+                yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+                    event['id'], event['event'], json.dumps(event['data'])
+                )
     
-    return jsonify(task)
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+        }
+    )
 
 @bp.route('/api/task/<task_id>/cancel', methods=['POST'])
 def cancel_task(task_id):
     """Cancel a processing task"""
-    if task_id not in processing_tasks:
+    job = get_embedding_job_service().request_cancel(task_id)
+    if job is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    # In a real implementation, you'd need a way to signal the background thread to stop
-    # For now, we'll just mark it as cancelled
-    processing_tasks[task_id]['status'] = 'cancelled'
+    # The running worker checks this flag between batches
+    return jsonify({'message': 'Task cancelled', 'status': job.status})
+
+@bp.route('/api/task/<task_id>/resume', methods=['POST'])
+def resume_task(task_id):
+    """Resume an interrupted, failed or cancelled task from its last committed batch"""
+    from flask import current_app
+    job_service = get_embedding_job_service()
+    job = job_service.resume_job(current_app._get_current_object(), task_id)
+    if job is None:
+        return jsonify({'error': 'Task not found or not resumable'}), 400
     
-    return jsonify({'message': 'Task cancelled'})
+    return jsonify({'task_id': job.task_id, 'message': 'Task resumed'})
 
 @bp.route('/api/cleanup-tasks', methods=['POST'])
 def cleanup_tasks():
     """Clean up old completed tasks"""
-    current_time = time.time()
-    tasks_to_remove = []
-    
-    for task_id, task in processing_tasks.items():
-        # Remove tasks older than 1 hour
-        if 'end_time' in task and (current_time - task['end_time']) > 3600:
-            tasks_to_remove.append(task_id)
+    # Remove tasks finished more than 1 hour ago
+    removed = get_embedding_job_service().cleanup_jobs(max_age_seconds=3600)
     
-    for task_id in tasks_to_remove:
-        del processing_tasks[task_id]
-    
-    return jsonify({'message': 'Cleaned up {} old tasks'.format(len(tasks_to_remove))})
+    return jsonify({'message': 'Cleaned up {} old tasks'.format(removed)})
 
 @bp.route('/api/customer/<int:customer_id>/topics')
 def get_customer_topics(customer_id):
@@ -201,13 +166,46 @@ def extract_topics(customer_id):
     try:
         max_main_topics = request.json.get('max_main_topics', 10)
         max_sub_topics = request.json.get('max_sub_topics', 20)
+        use_reduced = request.json.get('use_reduced', True)
         
         topics = get_embeddings_service().extract_topics_from_embeddings(
             customer_id=customer_id,
             max_main_topics=max_main_topics,
-            max_sub_topics=max_sub_topics
+            max_sub_topics=max_sub_topics,
+            use_reduced=use_reduced
         )
         
         return jsonify(topics)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/customer/<int:customer_id>/projection')
+def get_projection(customer_id):
+    """Get the active embedding projection for a customer"""
+    from models import EmbeddingProjection
+    projection = EmbeddingProjection.query.filter_by(
+        customer_id=customer_id, is_active=True
+    ).order_by(EmbeddingProjection.version.desc()).first()
+    
+    if not projection:
+        return jsonify({'error': 'No projection fitted for this customer'}), 404
+    
+    return jsonify(projection.to_dict())
+
+@bp.route('/api/customer/<int:customer_id>/projection', methods=['POST'])
+def fit_projection(customer_id):
+    """Fit a new dimensionality reduction projection and apply it to stored embeddings"""
+    data = request.get_json() or {}
+    
+    try:
+        projection = get_embeddings_service().fit_projection(
+            customer_id=customer_id,
+            output_dim=data.get('output_dim', 128),
+            method=data.get('method', 'pca'),
+            sample_size=data.get('sample_size')
+        )
+        return jsonify(projection.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,7 +1,17 @@
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, request, jsonify, render_template, current_app
 from services.topic_service import get_topic_service
 from services.topic_classifier import get_topic_classifier
+from services.topic_model import bump_model_version
+from services.topic_centroids import rebuild_centroids
+from services.topic_aggregates import get_topic_trend, rebuild_topic_aggregates, rebuild_topic_timeline
+from services.topic_closure import get_subtree_email_counts, rebuild_topic_closure
+from services.topic_similarity import rebuild_topic_similarities
+from services.classification_jobs import get_classification_job_service
+from services.background_tasks import get_background_processor
+from services import ingest_classification
+from services.classification_analytics import invalidate_classification_analytics
 from models import db, Customer, Topic, EmailTopic, EmailThread
+from datetime import datetime
 import logging
 
 bp = Blueprint('topics', __name__, url_prefix='/topics')
@@ -62,6 +72,7 @@ def get_topic_details(topic_id):
         
         return jsonify({
             'topic': topic.to_dict(),
+            'subtree_email_count': get_subtree_email_counts([topic_id]).get(topic_id, 0),
             'emails': emails,
             'similar_topics': similar_topics
         })
@@ -83,18 +94,9 @@ def create_topic(customer_id):
             level=data.get('level'),
             color=data.get('color'),
             created_by=data.get('created_by', 'user'),
-            keywords=data.get('keywords', [])
-        )
-        
-        # Associate topic with customer
-        from models import customer_topic
-        db.session.execute(
-            customer_topic.insert().values(
-                customer_id=customer_id,
-                topic_id=topic.id
-            )
+            keywords=data.get('keywords', []),
+            customer_id=customer_id
         )
-        db.session.commit()
         
         return jsonify({
             'topic': topic.to_dict(),
@@ -136,6 +138,9 @@ def update_topic(topic_id):
         data = request.get_json()
         topic = Topic.query.get_or_404(topic_id)
         
+        if 'parent_id' in data and data['parent_id'] != topic.parent_id:
+            get_topic_service().move_topic(topic_id, data['parent_id'])
+        
         # Update fields
         if 'name' in data:
             topic.name = data['name']
@@ -147,12 +152,19 @@ def update_topic(topic_id):
             topic.is_active = data['is_active']
         
         topic.updated_at = db.func.current_timestamp()
+        bump_model_version()
         db.session.commit()
-        
+        # Topic usage in the analytics is keyed by name
+        invalidate_classification_analytics()
+
         return jsonify({
             'topic': topic.to_dict(),
             'message': 'Topic updated successfully'
         })
+    except ValueError as e:
+        # Invalid parent: missing, a descendant of the topic, or a full level
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error updating topic {topic_id}: {e}")
         return jsonify({'error': str(e)}), 500
@@ -193,24 +205,156 @@ def merge_topics(source_id, target_id):
         logger.error(f"Error merging topics {source_id} -> {target_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/centroids/rebuild', methods=['POST'])
+def rebuild_topic_centroids():
+    """Recompute topic centroid vectors from the current assignments"""
+    try:
+        data = request.get_json(silent=True) or {}
+        topic_ids = data.get('topic_ids')
+        
+        rebuilt = rebuild_centroids(topic_ids)
+        
+        return jsonify({
+            'rebuilt': rebuilt,
+            'message': 'Topic centroids rebuilt successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error rebuilding topic centroids: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/closure/rebuild', methods=['POST'])
+def rebuild_topic_hierarchy_closure():
+    """Recompute the topic closure table from the parent links"""
+    try:
+        rows = rebuild_topic_closure()
+        
+        return jsonify({
+            'rows': rows,
+            'message': 'Topic closure rebuilt successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error rebuilding topic closure: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/customer/<int:customer_id>/aggregates/rebuild', methods=['POST'])
+def rebuild_customer_topic_aggregates(customer_id):
+    """Recompute sender topic affinities and daily topic frequencies for a customer"""
+    try:
+        counts = rebuild_topic_aggregates(customer_id=customer_id)
+        
+        return jsonify({
+            **counts,
+            'message': 'Topic aggregates rebuilt successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error rebuilding topic aggregates for customer {customer_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/customer/<int:customer_id>/topic/<int:topic_id>/trend')
+def get_topic_trend_series(customer_id, topic_id):
+    """Get a topic's email count and average confidence per day, week or month"""
+    try:
+        granularity = request.args.get('granularity', 'week')
+        start = request.args.get('start')
+        end = request.args.get('end')
+        fill_gaps = request.args.get('fill_gaps', 'true').lower() != 'false'
+        
+        try:
+            start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+            end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+            series = get_topic_trend(customer_id, topic_id, granularity=granularity,
+                                     start=start, end=end, fill_gaps=fill_gaps)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'customer_id': customer_id,
+            'topic_id': topic_id,
+            'granularity': granularity,
+            'series': series
+        })
+    except Exception as e:
+        logger.error(f"Error getting trend of topic {topic_id} for customer {customer_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/timeline/rebuild', methods=['POST'])
+def rebuild_timeline():
+    """Backfill the topic timeline rollup from the current assignments"""
+    try:
+        data = request.get_json(silent=True) or {}
+        options = {'customer_id': data.get('customer_id')}
+        if data.get('topic_ids'):
+            options['topic_ids'] = data['topic_ids']
+        
+        if data.get('background', True) and get_background_processor():
+            get_background_processor().add_task('rebuild_topic_timeline', **options)
+            return jsonify({'message': 'Topic timeline rebuild queued'}), 202
+        
+        rows = rebuild_topic_timeline(**options)
+        
+        return jsonify({
+            'rows': rows,
+            'message': 'Topic timeline rebuilt successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error rebuilding topic timeline: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/similarity/rebuild', methods=['POST'])
+def rebuild_similarities():
+    """Recompute similarities between all active topics"""
+    try:
+        data = request.get_json(silent=True) or {}
+        options = {
+            'top_k': data.get('top_k', 10),
+            'min_score': data.get('min_score', 0.1)
+        }
+        if data.get('methods'):
+            options['methods'] = data['methods']
+        
+        if data.get('background', True) and get_background_processor():
+            get_background_processor().add_task('rebuild_topic_similarities', **options)
+            return jsonify({'message': 'Topic similarity rebuild queued'}), 202
+        
+        pairs = rebuild_topic_similarities(**options)
+        
+        return jsonify({
+            'pairs': pairs,
+            'message': 'Topic similarities rebuilt successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error rebuilding topic similarities: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/statistics/reconcile', methods=['POST'])
+def reconcile_topic_statistics():
+    """Repair cached topic email counts and last used dates"""
+    try:
+        data = request.get_json(silent=True) or {}
+        topic_id = data.get('topic_id')
+        
+        if data.get('background', True) and get_background_processor():
+            get_background_processor().add_task('reconcile_topic_statistics', topic_id=topic_id)
+            return jsonify({'message': 'Topic statistics reconciliation queued'}), 202
+        
+        repaired = get_topic_service().update_topic_statistics(topic_id)
+        
+        return jsonify({
+            'repaired': repaired,
+            'message': 'Topic statistics reconciled successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error reconciling topic statistics: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # Classification endpoints
 
 @bp.route('/api/customer/<int:customer_id>/classify', methods=['POST'])
 def auto_classify_emails(customer_id):
     """Automatically classify emails for a customer"""
     try:
-        data = request.get_json()
-        limit = data.get('limit', 50)
-        force_reclassify = data.get('force_reclassify', False)
-        
-        classifier = get_topic_classifier()
-        results = classifier.auto_classify_emails(
-            customer_id=customer_id,
-            limit=limit,
-            force_reclassify=force_reclassify
-        )
-        
-        return jsonify(results)
+        data = request.get_json() or {}
+        return _run_auto_classification(customer_id, data)
     except Exception as e:
         logger.error(f"Error auto-classifying emails for customer {customer_id}: {e}")
         return jsonify({'error': str(e)}), 500
@@ -220,23 +364,108 @@ def auto_classify_emails_alias(customer_id):
     """Automatically classify emails for a customer (alias endpoint)"""
     try:
         data = request.get_json() or {}
-        limit = data.get('limit', 50)
-        force_reclassify = data.get('force_reclassify', False)
-        algorithms = data.get('algorithms', ['keyword', 'embedding', 'context', 'frequency'])
-        
-        classifier = get_topic_classifier()
+        data.setdefault('algorithms', ['keyword', 'embedding', 'context', 'frequency'])
+        return _run_auto_classification(customer_id, data)
+    except Exception as e:
+        logger.error(f"Error auto-classifying emails for customer {customer_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def _run_auto_classification(customer_id, data):
+    """Classify inline, or as a background job when more than one worker is requested"""
+    limit = data.get('limit', 50)
+    force_reclassify = data.get('force_reclassify', False)
+    algorithms = data.get('algorithms')
+    workers = max(int(data.get('workers', 1) or 1), 1)
+    hierarchical = bool(data.get('hierarchical', False))
+    level_thresholds = data.get('level_thresholds')
+    
+    classifier = get_topic_classifier()
+    
+    if workers == 1:
         results = classifier.auto_classify_emails(
             customer_id=customer_id,
             limit=limit,
             force_reclassify=force_reclassify,
-            algorithms=algorithms
+            algorithms=algorithms,
+            hierarchical=hierarchical,
+            level_thresholds=level_thresholds
         )
-        
         return jsonify(results)
+    
+    total = classifier.count_emails_to_classify(customer_id, limit=limit, force_reclassify=force_reclassify)
+    if not total:
+        return jsonify({'error': 'No emails found to classify'}), 400
+    
+    job_service = get_classification_job_service()
+    job = job_service.create_job(
+        customer_id=customer_id,
+        limit=limit,
+        force_reclassify=force_reclassify,
+        algorithms=algorithms,
+        workers=workers,
+        total=total,
+        hierarchical=hierarchical,
+        level_thresholds=level_thresholds
+    )
+    
+    processor = get_background_processor()
+    if processor:
+        processor.add_task('classify_emails', task_id=job.task_id)
+    else:
+        job_service.start_job(current_app._get_current_object(), job.task_id)
+    
+    return jsonify({
+        'task_id': job.task_id,
+        'message': f'Started classifying {total} emails with {workers} workers',
+        'total_emails': total
+    }), 202
+
+@bp.route('/api/customer/<int:customer_id>/classify-new', methods=['POST'])
+def classify_new_emails(customer_id):
+    """Classify emails imported since the customer's ingest watermark"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if data.get('background', True) and get_background_processor():
+            get_background_processor().add_task('classify_new_emails', customer_id=customer_id)
+            return jsonify({'message': 'Ingest classification queued'}), 202
+        
+        classified = ingest_classification.classify_new_emails(
+            customer_id, max_emails=data.get('max_emails')
+        )
+        watermark = ingest_classification.get_watermark(
+            customer_id, get_topic_classifier().model_version
+        )
+        
+        return jsonify({
+            'classified': classified,
+            'watermark': watermark.to_dict()
+        })
     except Exception as e:
-        logger.error(f"Error auto-classifying emails for customer {customer_id}: {e}")
+        logger.error(f"Error classifying new emails for customer {customer_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/task/<task_id>/status')
+def get_classification_task_status(task_id):
+    """Get the status of a classification job"""
+    job_service = get_classification_job_service()
+    job = job_service.get_job(task_id)
+    if job is None:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    task = job.to_dict()
+    task['stale'] = job_service.is_stale(job)
+    return jsonify(task)
+
+@bp.route('/api/task/<task_id>/cancel', methods=['POST'])
+def cancel_classification_task(task_id):
+    """Cancel a classification job; chunks already being scored are still saved"""
+    job = get_classification_job_service().request_cancel(task_id)
+    if job is None:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    return jsonify({'message': 'Task cancelled', 'status': job.status})
+
 @bp.route('/api/email/<int:email_id>/classify', methods=['POST'])
 def classify_single_email(email_id):
     """Classify a single email"""
@@ -317,6 +546,7 @@ def verify_topic_assignment(email_id):
         assignment.verified_by = verified_by
         
         db.session.commit()
+        invalidate_classification_analytics([assignment.email.customer_id])
         
         return jsonify({
             'assignment': assignment.to_dict(),
@@ -445,10 +675,7 @@ def get_customer_statistics(customer_id):
         ).distinct().count()
         
         # Get topic counts
-        service = get_topic_service()
-        main_topics = service.get_topics_by_level(level=0, customer_id=customer_id)
-        sub_topics = service.get_topics_by_level(level=1, customer_id=customer_id)
-        micro_topics = service.get_topics_by_level(level=2, customer_id=customer_id)
+        level_counts = get_topic_service().get_topic_level_counts(customer_id)
         
         return jsonify({
             'total_emails': total_emails,
@@ -456,10 +683,10 @@ def get_customer_statistics(customer_id):
             'unclassified_emails': total_emails - classified_emails,
             'classification_rate': classified_emails / total_emails if total_emails > 0 else 0,
             'topic_counts': {
-                'main_topics': len(main_topics),
-                'sub_topics': len(sub_topics),
-                'micro_topics': len(micro_topics),
-                'total_topics': len(main_topics) + len(sub_topics) + len(micro_topics)
+                'main_topics': level_counts[0],
+                'sub_topics': level_counts[1],
+                'micro_topics': level_counts[2],
+                'total_topics': sum(level_counts.values())
             }
         })
     except Exception as e:
@@ -498,13 +725,10 @@ def get_customer_stats(customer_id):
         ).distinct().count()
         
         # Get topic counts
-        service = get_topic_service()
-        main_topics = service.get_topics_by_level(level=0, customer_id=customer_id)
-        sub_topics = service.get_topics_by_level(level=1, customer_id=customer_id)
-        micro_topics = service.get_topics_by_level(level=2, customer_id=customer_id)
+        level_counts = get_topic_service().get_topic_level_counts(customer_id)
         
         return jsonify({
-            'total_topics': len(main_topics) + len(sub_topics) + len(micro_topics),
+            'total_topics': sum(level_counts.values()),
             'classified_emails': classified_emails,
             'avg_confidence': round(avg_confidence * 100, 1) if avg_confidence else 0,
             'auto_classified': auto_classified,
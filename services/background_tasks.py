@@ -23,11 +23,24 @@ class BackgroundTaskProcessor:
         self.app = app
     
     def start(self):
-        """Start the background processor"""
+        """Start the background processor and reclaim jobs orphaned by a restart"""
         if not self.running:
             self.running = True
             self.worker_thread = threading.Thread(target=self._process_tasks, daemon=True)
             self.worker_thread.start()
+            if self.app is not None:
+                self._resume_stale_jobs()
+    
+    def _resume_stale_jobs(self):
+        """Resume persisted embedding and classification jobs whose worker stopped heartbeating"""
+        from services.embedding_jobs import get_embedding_job_service
+        from services.classification_jobs import get_classification_job_service
+        
+        for job_service in (get_embedding_job_service(), get_classification_job_service()):
+            try:
+                job_service.resume_stale_jobs(self.app)
+            except Exception as e:
+                logger.error(f"Error resuming stale {job_service.job_type} jobs: {e}", exc_info=True)
     
     def stop(self):
         """Stop the background processor"""
@@ -68,6 +81,21 @@ class BackgroundTaskProcessor:
                 elif task['type'] == 'recalculate_importance':
                     self._recalculate_importance(task['kwargs'])
                 
+                elif task['type'] == 'classify_emails':
+                    self._classify_emails(task['kwargs'])
+                
+                elif task['type'] == 'classify_new_emails':
+                    self._classify_new_emails(task['kwargs'])
+                
+                elif task['type'] == 'reconcile_topic_statistics':
+                    self._reconcile_topic_statistics(task['kwargs'])
+                
+                elif task['type'] == 'rebuild_topic_similarities':
+                    self._rebuild_topic_similarities(task['kwargs'])
+                
+                elif task['type'] == 'rebuild_topic_timeline':
+                    self._rebuild_topic_timeline(task['kwargs'])
+                
             except queue.Empty:
                 # No tasks, continue
                 continue
@@ -298,6 +326,61 @@ class BackgroundTaskProcessor:
             from services.correlation_engine import correlation_engine
             correlation_engine.recalculate_importance_scores(customer_id)
 
+    def _classify_emails(self, kwargs):
+        """Run a persisted auto-classification job"""
+        task_id = kwargs.get('task_id')
+        
+        if task_id:
+            from services.classification_jobs import get_classification_job_service
+            get_classification_job_service().run_in_context(self.app, task_id)
+
+    def _classify_new_emails(self, kwargs):
+        """Classify newly imported emails above the watermark (of every customer if none given)"""
+        customer_id = kwargs.get('customer_id')
+        
+        from services.ingest_classification import classify_new_emails, catch_up_all
+        with self.app.app_context():
+            try:
+                if customer_id:
+                    classify_new_emails(customer_id)
+                else:
+                    catch_up_all()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _reconcile_topic_statistics(self, kwargs):
+        """Repair cached topic email counts and last used dates that drifted"""
+        topic_id = kwargs.get('topic_id')
+        
+        from services.topic_service import get_topic_service
+        with self.app.app_context():
+            try:
+                get_topic_service().update_topic_statistics(topic_id)
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _rebuild_topic_similarities(self, kwargs):
+        """Recompute the top similar topics of every active topic"""
+        from services.topic_similarity import rebuild_topic_similarities
+        with self.app.app_context():
+            try:
+                rebuild_topic_similarities(**kwargs)
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _rebuild_topic_timeline(self, kwargs):
+        """Backfill the topic timeline rollup (of every customer if none given)"""
+        from services.topic_aggregates import rebuild_topic_timeline
+        with self.app.app_context():
+            try:
+                rebuild_topic_timeline(**kwargs)
+            except Exception:
+                db.session.rollback()
+                raise
+
 # Global instance - initialized without app, will be set up in app.py
 background_processor = None
 
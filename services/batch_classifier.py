@@ -0,0 +1,518 @@
+"""
+Batch topic classification.
+Topics, keywords, topic centroids and customer frequencies are loaded once per run,
+emails are scored a chunk at a time with matrix operations, and assignments are written in bulk.
+The scoring core (score_email_rows) works on plain row data so it can also run outside the
+Flask app, e.g. in worker processes.
+"""
+
+import json
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from models import db, EmailThread
+from services.topic_model import get_topic_model_snapshot
+from services.topic_aggregates import (
+    get_sender_affinities, get_email_assignments, get_recent_topic_counts
+)
+from services.topic_centroids import score_against_centroids
+
+logger = logging.getLogger(__name__)
+
+ALL_METHODS = ['keyword', 'embedding', 'context', 'frequency']
+
+# The columns of an email the scoring core needs; embedding is a numpy vector or None
+EmailRow = namedtuple('EmailRow', [
+    'id', 'subject', 'body', 'sender_email', 'recipient_email', 'date', 'embedding'
+])
+
+
+class ClassificationModel:
+    """Everything needed to score emails of one customer, loaded once per batch run"""
+
+    def __init__(self, classifier, topic_names, keyword_index, centroids, frequency_scores,
+                 version=None, hierarchy=None, level_thresholds=None):
+        self.classifier = classifier
+        self.version = version  # Topic model snapshot version
+        self.topic_names = topic_names  # topic_id -> name, the customer's active topics only
+        self.topic_ids = set(topic_names)
+        self.keyword_index = keyword_index
+        self.centroids = centroids  # embedding width -> (topic_ids, centroid matrix)
+        self.frequency_scores = frequency_scores  # topic_id -> frequency score
+
+        # topic_id -> (parent_id, level) of the candidate topics; set for top-down scoring only
+        self.hierarchy = hierarchy
+        self.level_thresholds = level_thresholds or {}  # level -> minimum confidence
+        self.root_ids = set()
+        self.children = {}
+        if hierarchy is not None:
+            # A topic whose parent is not a candidate (inactive, or another customer's)
+            # is scored as a root
+            for topic_id, (parent_id, _) in hierarchy.items():
+                if parent_id in hierarchy:
+                    self.children.setdefault(parent_id, []).append(topic_id)
+                else:
+                    self.root_ids.add(topic_id)
+
+    @property
+    def hierarchical(self):
+        return self.hierarchy is not None
+
+    def threshold_for(self, topic_id):
+        """Minimum confidence of a topic: its level's threshold, else the classifier's"""
+        level = self.hierarchy[topic_id][1] if self.hierarchical else None
+        return self.level_thresholds.get(level, self.classifier.min_confidence_threshold)
+
+
+def parse_level_thresholds(value):
+    """Normalize per-level thresholds given as a list (index = level) or a {level: threshold} dict"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return {int(level): float(threshold) for level, threshold in value.items()}
+    return {level: float(threshold) for level, threshold in enumerate(value)}
+
+
+def _parse_embedding(value):
+    if not value:
+        return None
+    try:
+        return np.asarray(json.loads(value), dtype=np.float32)
+    except (ValueError, TypeError):
+        return None
+
+
+def _email_row(email_id, subject, body_full, body_preview, sender_email, recipient_email, date,
+               embedding):
+    return EmailRow(
+        email_id, subject, body_full or body_preview or '', sender_email, recipient_email, date,
+        _parse_embedding(embedding)
+    )
+
+
+def load_email_rows(email_ids):
+    """Load the scoring columns for a list of email ids, in the given order"""
+    if not email_ids:
+        return []
+
+    rows = db.session.query(
+        EmailThread.id, EmailThread.subject, EmailThread.body_full, EmailThread.body_preview,
+        EmailThread.sender_email, EmailThread.recipient_email, EmailThread.date,
+        EmailThread.embedding
+    ).filter(EmailThread.id.in_(email_ids)).all()
+
+    by_id = {row[0]: _email_row(*row) for row in rows}
+    return [by_id[email_id] for email_id in email_ids if email_id in by_id]
+
+
+def load_classification_model(customer_id, classifier=None, snapshot=None, hierarchical=False,
+                              level_thresholds=None):
+    """Load the topic data a batch run scores against.
+
+    With hierarchical=True emails are scored top-down (see score_email_rows); level_thresholds
+    maps a topic level to the confidence needed to keep it and descend into its children.
+    """
+    if classifier is None:
+        from services.topic_classifier import get_topic_classifier
+        classifier = get_topic_classifier()
+    if snapshot is None:
+        snapshot = get_topic_model_snapshot()
+
+    candidates = snapshot.candidate_topics(customer_id)
+    topic_names = {topic.id: topic.name for topic in candidates}
+    hierarchy = None
+    if hierarchical:
+        hierarchy = {topic.id: (topic.parent_id, topic.level or 0) for topic in candidates}
+
+    return ClassificationModel(
+        classifier=classifier,
+        topic_names=topic_names,
+        keyword_index=snapshot.keyword_index,
+        centroids=snapshot.centroids,
+        frequency_scores=classifier._score_frequency(
+            get_recent_topic_counts(customer_id), set(topic_names)
+        ),
+        version=snapshot.version,
+        hierarchy=hierarchy,
+        level_thresholds=parse_level_thresholds(level_thresholds)
+    )
+
+
+def load_context(customer_id, rows):
+    """Sender affinities and existing assignments for a chunk of emails, in two queries"""
+    return {
+        'sender_affinities': get_sender_affinities(customer_id, [row.sender_email for row in rows]),
+        'assignments': get_email_assignments([row.id for row in rows])
+    }
+
+
+def _score_top_down(model, row, method_scores, methods, sender_affinity, own_assignments):
+    """Score an email level by level, starting from the root topics.
+
+    Keyword and embedding scores are computed once for the email; everything else per topic
+    (context, combining, thresholds) only runs for the children of the topics kept at the
+    level above, so every kept topic comes with its whole ancestor path.
+    Returns (topic_id -> (confidence, scores by method), number of topics scored).
+    """
+    classifier = model.classifier
+    kept = {}
+    considered = 0
+    frontier = model.root_ids
+
+    while frontier:
+        considered += len(frontier)
+        level_scores = {
+            method: {topic_id: scores[topic_id] for topic_id in frontier if topic_id in scores}
+            for method, scores in method_scores.items()
+        }
+        if 'context' in methods:
+            level_scores['context'] = classifier._score_context(
+                row, frontier, sender_affinity, own_assignments
+            )
+
+        combined = classifier._combine_scores(level_scores)
+        passed = [
+            topic_id for topic_id in frontier
+            if combined.get(topic_id, 0.0) >= model.threshold_for(topic_id)
+        ]
+        for topic_id in passed:
+            kept[topic_id] = (combined[topic_id], {
+                method: level_scores[method].get(topic_id, 0.0) for method in level_scores
+            })
+
+        frontier = set(
+            child_id for topic_id in passed for child_id in model.children.get(topic_id, ())
+        )
+
+    return kept, considered
+
+
+def score_email_rows(model, rows, context=None, methods=None):
+    """Score a chunk of emails against every active topic.
+
+    Returns one dict per row with the same 'classifications' payload as
+    TopicClassifier.classify_email. A hierarchical model only descends into the children of
+    topics that reach their level's threshold, and returns whole paths from a root down.
+    """
+    if methods is None:
+        methods = ALL_METHODS
+    context = context or {}
+    sender_affinities = context.get('sender_affinities', {})
+    assignments = context.get('assignments', {})
+    classifier = model.classifier
+
+    embedding_scores = None
+    if 'embedding' in methods:
+        embedding_scores = [
+            {topic_id: score for topic_id, score in topic_scores.items() if topic_id in model.topic_ids}
+            for topic_scores in score_against_centroids([row.embedding for row in rows], model.centroids)
+        ]
+
+    results = []
+    for position, row in enumerate(rows):
+        method_scores = {}
+
+        if 'keyword' in methods:
+            method_scores['keyword'] = classifier._score_keywords(
+                "{} {}".format(row.subject or '', row.body), model.topic_ids, model.keyword_index
+            )
+        if embedding_scores is not None:
+            method_scores['embedding'] = embedding_scores[position]
+        if 'frequency' in methods:
+            method_scores['frequency'] = model.frequency_scores
+
+        if model.hierarchical:
+            kept, considered = _score_top_down(
+                model, row, method_scores, methods, sender_affinities.get(row.sender_email, {}),
+                assignments.get(row.id, {})
+            )
+            confident_topics = [
+                {
+                    'topic_id': topic_id,
+                    'topic_name': model.topic_names.get(topic_id),
+                    'confidence_score': score,
+                    'method_breakdown': breakdown,
+                    'parent_id': model.hierarchy[topic_id][0],
+                    'level': model.hierarchy[topic_id][1]
+                }
+                for topic_id, (score, breakdown) in kept.items()
+            ]
+        else:
+            if 'context' in methods:
+                method_scores['context'] = classifier._score_context(
+                    row, model.topic_ids, sender_affinities.get(row.sender_email, {}),
+                    assignments.get(row.id, {})
+                )
+
+            final_scores = classifier._combine_scores(method_scores)
+            considered = len(model.topic_ids)
+
+            confident_topics = [
+                {
+                    'topic_id': topic_id,
+                    'topic_name': model.topic_names.get(topic_id),
+                    'confidence_score': score,
+                    'method_breakdown': {
+                        method: method_scores[method].get(topic_id, 0.0)
+                        for method in method_scores
+                    }
+                }
+                for topic_id, score in final_scores.items()
+                if score >= classifier.min_confidence_threshold and topic_id in model.topic_ids
+            ]
+        confident_topics.sort(key=lambda x: x['confidence_score'], reverse=True)
+
+        results.append({
+            'email_id': row.id,
+            'classifications': confident_topics,
+            'methods_used': methods,
+            'total_topics_considered': considered,
+            'confident_topics': len(confident_topics),
+            'model_version': model.version
+        })
+
+    return results
+
+
+def write_assignments(assignments, classification_method='auto_classification', assigned_by='system',
+                      embeddings=None, model_version=None):
+    """Upsert (email_id, topic_id, confidence) assignments through TopicService.bulk_assign.
+
+    embeddings (email_id -> vector) saves reloading them for the topic centroid update.
+    """
+    from services.topic_service import get_topic_service
+
+    return get_topic_service().bulk_assign(
+        [(email_id, topic_id, confidence, classification_method)
+         for email_id, topic_id, confidence in assignments],
+        assigned_by=assigned_by,
+        model_version=model_version,
+        embeddings=embeddings
+    )
+
+
+# Model snapshot of a worker process, set once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _score_shard(rows, context, methods):
+    """Process pool entry point: score one shard against the worker's model snapshot"""
+    return score_email_rows(_worker_model, rows, context, methods)
+
+
+class BatchTopicClassifier:
+    """Classifies many emails of one customer per call"""
+
+    def __init__(self, classifier=None, chunk_size=200):
+        self.classifier = classifier
+        self.chunk_size = chunk_size
+
+    def classify_emails(self, customer_id, email_ids, methods=None, model=None, write=True,
+                        progress_callback=None, should_cancel=None, workers=1, hierarchical=False,
+                        level_thresholds=None):
+        """Classify emails chunk by chunk; returns auto_classify_emails style results.
+
+        With workers > 1 the ids are split into contiguous id ranges that a process pool scores
+        against a pickled snapshot of the model, while this process stays the only writer.
+        progress_callback(done, total, results) is called after every saved chunk and
+        should_cancel() is checked between chunks; on cancellation results['cancelled'] is set.
+
+        Every chunk is scored against the state before the run (model, frequencies and sender
+        affinities are read once up front), so the results do not depend on the chunk order or
+        on the number of workers.
+        """
+        if model is None:
+            model = load_classification_model(
+                customer_id, classifier=self.classifier, hierarchical=hierarchical,
+                level_thresholds=level_thresholds
+            )
+
+        results = {
+            'processed': 0,
+            'classified': 0,
+            'skipped': 0,
+            'errors': [],
+            'classifications': []
+        }
+
+        if not model.topic_ids:
+            results['skipped'] = len(email_ids)
+            results['errors'].append('No active topics found')
+            return results
+
+        affinities = self._freeze_affinities(customer_id, email_ids, methods)
+
+        if workers and workers > 1 and len(email_ids) > self.chunk_size:
+            self._classify_parallel(email_ids, methods, model, affinities, write, workers, results,
+                                    progress_callback, should_cancel)
+        else:
+            self._classify_sequential(email_ids, methods, model, affinities, write, results,
+                                      progress_callback, should_cancel)
+        return results
+
+    def _classify_sequential(self, email_ids, methods, model, affinities, write, results,
+                             progress_callback, should_cancel):
+        for start in range(0, len(email_ids), self.chunk_size):
+            if should_cancel and should_cancel():
+                results['cancelled'] = True
+                break
+
+            chunk_ids = email_ids[start:start + self.chunk_size]
+
+            try:
+                rows = load_email_rows(chunk_ids)
+                scored = score_email_rows(model, rows, self._load_context(rows, affinities), methods)
+            except Exception as e:
+                self._chunk_failed(chunk_ids, e, results)
+                continue
+
+            self._save_chunk(model, rows, scored, write, results)
+
+            if progress_callback:
+                progress_callback(min(start + self.chunk_size, len(email_ids)), len(email_ids), results)
+
+    def _classify_parallel(self, email_ids, methods, model, affinities, write, workers, results,
+                           progress_callback, should_cancel):
+        ordered_ids = sorted(email_ids)
+        shards = iter([
+            ordered_ids[start:start + self.chunk_size]
+            for start in range(0, len(ordered_ids), self.chunk_size)
+        ])
+        done = 0
+        cancelled = False
+
+        # spawn, not fork: the caller is usually a thread of a multi-threaded web process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(model,)) as executor:
+            pending = {}
+            while True:
+                # Keep one shard queued per worker so no process waits on the database reads
+                while not cancelled and len(pending) < workers * 2:
+                    shard_ids = next(shards, None)
+                    if shard_ids is None:
+                        break
+                    try:
+                        rows = load_email_rows(shard_ids)
+                        context = self._load_context(rows, affinities)
+                    except Exception as e:
+                        self._chunk_failed(shard_ids, e, results)
+                        continue
+                    pending[executor.submit(_score_shard, rows, context, methods)] = (shard_ids, rows)
+
+                if not pending:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    shard_ids, rows = pending.pop(future)
+                    try:
+                        scored = future.result()
+                    except Exception as e:
+                        self._chunk_failed(shard_ids, e, results)
+                        continue
+
+                    self._save_chunk(model, rows, scored, write, results)
+                    done += len(shard_ids)
+                    if progress_callback:
+                        progress_callback(done, len(email_ids), results)
+
+                if not cancelled and should_cancel and should_cancel():
+                    # Shards already handed to workers are still saved
+                    cancelled = True
+                    results['cancelled'] = True
+
+        # Report emails in the order they were requested
+        position = {email_id: index for index, email_id in enumerate(email_ids)}
+        results['classifications'].sort(key=lambda item: position.get(item['email_id'], 0))
+
+    def _freeze_affinities(self, customer_id, email_ids, methods):
+        """Sender affinities of every sender in the run, read before any chunk is saved.
+
+        Saving a chunk updates the affinities of its senders; reading them per chunk would let
+        later chunks see earlier ones, and which ones depends on the order shards finish in.
+        """
+        if methods is not None and 'context' not in methods:
+            return None
+
+        senders = set()
+        for start in range(0, len(email_ids), self.chunk_size):
+            senders.update(sender for (sender,) in db.session.query(EmailThread.sender_email).filter(
+                EmailThread.id.in_(email_ids[start:start + self.chunk_size])
+            ).distinct())
+
+        senders = sorted(sender for sender in senders if sender)
+        affinities = {}
+        for start in range(0, len(senders), self.chunk_size):
+            affinities.update(get_sender_affinities(customer_id, senders[start:start + self.chunk_size]))
+        return affinities
+
+    def _load_context(self, rows, affinities):
+        """Context for a chunk: the run's frozen sender affinities plus the chunk's own
+        assignments, which only change when the chunk itself is saved"""
+        if affinities is None:
+            return None
+        return {
+            'sender_affinities': {
+                row.sender_email: affinities[row.sender_email]
+                for row in rows if row.sender_email in affinities
+            },
+            'assignments': get_email_assignments([row.id for row in rows])
+        }
+
+    def _chunk_failed(self, chunk_ids, error, results):
+        logger.error(f"Error classifying emails {chunk_ids[0]}..{chunk_ids[-1]}: {error}")
+        db.session.rollback()
+        results['errors'].append(f"Emails {chunk_ids[0]}..{chunk_ids[-1]}: {str(error)}")
+        results['skipped'] += len(chunk_ids)
+
+    def _save_chunk(self, model, rows, scored, write, results):
+        """Add a scored chunk to results and save its confident assignments.
+
+        Classifications are already thresholded by score_email_rows (per level for a
+        hierarchical model), so all of them are saved.
+        """
+        subjects = {row.id: row.subject for row in rows}
+        assignments = []
+
+        for email_result in scored:
+            email_classifications = []
+            for topic_data in email_result['classifications']:
+                assignments.append((
+                    email_result['email_id'], topic_data['topic_id'],
+                    topic_data['confidence_score']
+                ))
+                email_classifications.append({
+                    'topic_name': topic_data['topic_name'],
+                    'confidence': topic_data['confidence_score']
+                })
+
+            results['classifications'].append({
+                'email_id': email_result['email_id'],
+                'subject': subjects.get(email_result['email_id']),
+                'topics': email_classifications
+            })
+
+            if email_classifications:
+                results['classified'] += 1
+            else:
+                results['skipped'] += 1
+            results['processed'] += 1
+
+        if write:
+            try:
+                write_assignments(assignments, model_version=model.version, embeddings={
+                    row.id: row.embedding for row in rows if row.embedding is not None
+                })
+            except Exception as e:
+                logger.error(f"Error saving topic assignments: {e}")
+                db.session.rollback()
+                results['errors'].append(f"Emails {rows[0].id}..{rows[-1].id}: {str(e)}")
@@ -0,0 +1,49 @@
+"""
+Small in-process caches for expensive read paths.
+Each worker process keeps its own copy, so entries carry a short TTL as well as being
+invalidated explicitly when the underlying data changes.
+"""
+
+import time
+from threading import Lock
+
+
+class TTLCache:
+    """Thread-safe dictionary cache with per-entry expiry"""
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self._entries = {}  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        """Get a cached value, or default if missing or expired"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            return entry[1]
+
+    def set(self, key, value):
+        """Store a value, evicting the oldest entry when full"""
+        with self.lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, predicate=None):
+        """Remove entries whose key matches predicate (all entries if predicate is None)"""
+        with self.lock:
+            if predicate is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
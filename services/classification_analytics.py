@@ -0,0 +1,86 @@
+"""
+Topic classification analytics.
+The breakdowns by method, confidence bucket, topic and verification status are each one
+grouped SQL query, and the result is cached per customer for a few seconds.
+"""
+
+import logging
+from collections import defaultdict
+
+from sqlalchemy import Integer, case, cast, func
+
+from models import db, EmailThread, EmailTopic, Topic
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# customer_id (None for all customers) -> analytics dict. Assignment changes only invalidate
+# the copy of the process that committed them, so the TTL bounds how long other worker
+# processes serve stale analytics while dashboard polling still shares one set of queries
+_analytics_cache = TTLCache(ttl=5)
+
+
+def _grouped(column, customer_id, join_topic=False):
+    query = db.session.query(column, func.count(EmailTopic.id)).select_from(EmailTopic)
+    if join_topic:
+        query = query.outerjoin(Topic, Topic.id == EmailTopic.topic_id)
+    if customer_id:
+        query = query.join(EmailThread, EmailThread.id == EmailTopic.email_id).filter(
+            EmailThread.customer_id == customer_id
+        )
+    return query.group_by(column).all()
+
+
+def get_classification_analytics(customer_id=None):
+    """Get assignment counts by method, confidence bucket, topic and verification status"""
+    analytics = _analytics_cache.get(customer_id)
+    if analytics is not None:
+        return analytics
+
+    method_breakdown = {
+        method or 'unknown': count
+        for method, count in _grouped(EmailTopic.classification_method, customer_id)
+    }
+
+    # Buckets of 0.1 floored like int(confidence * 10) / 10 (a bare integer CAST rounds on
+    # PostgreSQL); a confidence of 1.0 joins the top bucket
+    bucket = cast(func.floor(func.coalesce(EmailTopic.confidence_score, 0.0) * 10), Integer)
+    bucket = case((bucket > 9, 9), else_=bucket)
+    confidence_distribution = {
+        bucket_index / 10: count for bucket_index, count in _grouped(bucket, customer_id)
+    }
+
+    topic_usage = defaultdict(int)
+    for topic_name, count in _grouped(Topic.name, customer_id, join_topic=True):
+        topic_usage[topic_name or 'Unknown'] += count
+
+    verified = sum(
+        count for is_verified, count in _grouped(EmailTopic.is_verified, customer_id)
+        if is_verified
+    )
+    total_assignments = sum(method_breakdown.values())
+
+    analytics = {
+        'total_assignments': total_assignments,
+        'method_breakdown': method_breakdown,
+        'confidence_distribution': confidence_distribution,
+        'topic_usage': dict(topic_usage),
+        'verification_stats': {
+            'verified': verified,
+            'unverified': total_assignments - verified,
+            'verification_rate': verified / total_assignments if total_assignments else 0.0
+        }
+    }
+
+    _analytics_cache.set(customer_id, analytics)
+    return analytics
+
+
+def invalidate_classification_analytics(customer_ids=None):
+    """Drop this process's cached analytics of the given customers (and the all-customer totals)"""
+    if customer_ids is None:
+        _analytics_cache.invalidate()
+        return
+
+    customer_ids = set(customer_ids)
+    _analytics_cache.invalidate(lambda key: key is None or key in customer_ids)
@@ -0,0 +1,100 @@
+"""
+Persistent auto-classification jobs.
+Large classification runs (usually sharded across worker processes) are tracked in
+ProcessingJob rows like embedding jobs, so status, progress events and cancellation reuse the
+same machinery.
+"""
+
+import json
+import time
+import uuid
+import logging
+
+from models import db, ProcessingJob
+from services.embedding_jobs import EmbeddingJobService
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationJobService(EmbeddingJobService):
+    """Creates and runs database-backed auto-classification jobs"""
+
+    job_type = 'classification'
+
+    def create_job(self, customer_id, limit=50, force_reclassify=False, algorithms=None, workers=1,
+                   total=0, hierarchical=False, level_thresholds=None):
+        """Create a pending classification job"""
+        job = ProcessingJob(
+            task_id="classify_{}_{}_{}".format(customer_id, int(time.time()), uuid.uuid4().hex[:6]),
+            job_type=self.job_type,
+            customer_id=customer_id,
+            params=json.dumps({
+                'limit': limit,
+                'force_reclassify': force_reclassify,
+                'algorithms': algorithms,
+                'workers': workers,
+                'hierarchical': hierarchical,
+                'level_thresholds': level_thresholds
+            }),
+            status='pending',
+            total=total
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def _resume_counts(self, job, params):
+        """Without force_reclassify a resumed job simply picks up the emails that are still
+        unclassified; with it the run starts over.
+        """
+        if params.get('force_reclassify'):
+            # A forced run cannot tell which emails it already did, so it starts over
+            return 0, {'processed': 0, 'skipped': 0, 'errors': 0}
+        done_before = job.processed + job.skipped
+        return done_before, {'processed': job.processed, 'skipped': job.skipped, 'errors': job.errors}
+
+    def _execute(self, job, params, done_before, report_progress, should_cancel):
+        """Classify the job's remaining emails; returns True if the run was cancelled"""
+        from services.topic_classifier import get_topic_classifier
+
+        limit = params.get('limit')
+        if limit:
+            limit = max(limit - done_before, 0)
+            if limit == 0:
+                return False
+        logger.info("Running classification job {} with {} workers".format(job.task_id, params.get('workers')))
+
+        def progress_callback(current, total, results):
+            report_progress(current, total, {
+                'processed': results['classified'],
+                'skipped': results['skipped'],
+                'errors': len(results['errors'])
+            })
+
+        results = get_topic_classifier().auto_classify_emails(
+            customer_id=job.customer_id,
+            limit=limit,
+            force_reclassify=params.get('force_reclassify', False),
+            algorithms=params.get('algorithms'),
+            workers=params.get('workers') or 1,
+            progress_callback=progress_callback,
+            should_cancel=should_cancel,
+            hierarchical=params.get('hierarchical', False),
+            level_thresholds=params.get('level_thresholds')
+        )
+        logger.info("Classification job {} finished: {} classified, {} skipped".format(
+            job.task_id, results.get('classified'), results.get('skipped')
+        ))
+        return bool(results.get('cancelled'))
+
+
+# Global instance
+_classification_job_service = None
+
+
+def get_classification_job_service():
+    """Get the global classification job service instance"""
+    global _classification_job_service
+    if _classification_job_service is None:
+        _classification_job_service = ClassificationJobService()
+    return _classification_job_service
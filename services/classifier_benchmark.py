@@ -0,0 +1,280 @@
+"""
+Classifier benchmark against human-verified topic assignments.
+Replays TopicClassifier.classify_email and the batch scoring path over a corpus of emails with
+verified labels (EmailTopic.is_verified, or a JSON fixture of email_id -> topic ids). It reports
+throughput, per-email latency and SQL statements per email, and precision/recall for each
+classification method on its own and all methods combined, so weight tuning and performance
+work are measured on the same corpus. Nothing is written to the database.
+The labels are assignments the model itself learns from (centroids, sender affinities and
+frequencies), so quality is scored leave-one-out: each email against the model without its own
+assignments.
+"""
+
+import copy
+import json
+import logging
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import event
+
+from models import db, EmailThread, EmailTopic, TopicCentroid
+from services.batch_classifier import (
+    ALL_METHODS, load_classification_model, load_context, load_email_rows, score_email_rows
+)
+from services.topic_aggregates import (
+    FREQUENCY_WINDOW_DAYS, get_email_assignments, get_recent_topic_counts
+)
+from services.topic_model import get_topic_model_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def load_verified_corpus(customer_id=None, limit=None):
+    """Get email_id -> set of verified topic ids"""
+    query = db.session.query(EmailTopic.email_id, EmailTopic.topic_id).filter(
+        EmailTopic.is_verified == True
+    )
+    if customer_id:
+        query = query.join(EmailThread, EmailThread.id == EmailTopic.email_id).filter(
+            EmailThread.customer_id == customer_id
+        )
+
+    labels = defaultdict(set)
+    for email_id, topic_id in query.order_by(EmailTopic.email_id).all():
+        if limit and len(labels) >= limit and email_id not in labels:
+            break
+        labels[email_id].add(topic_id)
+    return dict(labels)
+
+
+def load_corpus_fixture(path):
+    """Read a JSON fixture of {"email_id": [topic_id, ...]} labels"""
+    with open(path) as fixture:
+        return {int(email_id): set(topic_ids) for email_id, topic_ids in json.load(fixture).items()}
+
+
+class QueryCounter:
+    """Counts SQL statements sent through the database engine"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(math.ceil(percent / 100.0 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def _timing_report(elapsed, latencies, queries, emails):
+    latencies = sorted(latencies)
+    return {
+        'emails': emails,
+        'seconds': round(elapsed, 3),
+        'emails_per_second': round(emails / elapsed, 2) if elapsed > 0 else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'queries_per_email': round(queries / emails, 2) if emails else 0.0
+    }
+
+
+def benchmark_single(labels, methods=None):
+    """Time TopicClassifier.classify_email one email at a time"""
+    from services.topic_classifier import get_topic_classifier
+
+    classifier = get_topic_classifier()
+    get_topic_model_snapshot()  # Built outside the timed loop
+
+    latencies = []
+    started = time.perf_counter()
+    with count_queries() as counter:
+        for email_id in labels:
+            email_started = time.perf_counter()
+            classifier.classify_email(email_id, methods=methods)
+            latencies.append(time.perf_counter() - email_started)
+    return _timing_report(time.perf_counter() - started, latencies, counter.count, len(labels))
+
+
+def _by_customer(email_ids):
+    customers = defaultdict(list)
+    for email_id, customer_id in db.session.query(EmailThread.id, EmailThread.customer_id).filter(
+        EmailThread.id.in_(list(email_ids))
+    ).all():
+        customers[customer_id].append(email_id)
+    return customers
+
+
+def _held_out_model(model, row, own_assignments, weight_sums, recent_counts):
+    """The model as if the email had none of its assignments (leave-one-out).
+
+    Takes the email's embedding back out of its topics' centroids and its assignments out of
+    the recent topic counts; sender affinities are handled by score_email_rows through the
+    email's own assignments in the context.
+    """
+    held_out = copy.copy(model)
+
+    width = len(row.embedding) if row.embedding is not None else None
+    if width in model.centroids:
+        topic_ids, matrix = model.centroids[width]
+        matrix = matrix.copy()
+        keep = np.ones(len(topic_ids), dtype=bool)
+        for index, topic_id in enumerate(topic_ids):
+            confidence = own_assignments.get(topic_id)
+            if not confidence:
+                continue
+            weight_sum = weight_sums.get((topic_id, width), 0.0)
+            if weight_sum - confidence <= 1e-9:
+                # The email is the topic's only member
+                keep[index] = False
+                continue
+            matrix[index] = (matrix[index] * weight_sum - confidence * row.embedding) / (weight_sum - confidence)
+
+        held_out.centroids = dict(model.centroids)
+        held_out.centroids[width] = ([topic_id for topic_id, kept in zip(topic_ids, keep) if kept], matrix[keep])
+
+    since = (datetime.now() - timedelta(days=FREQUENCY_WINDOW_DAYS)).date()
+    if row.date and row.date.date() >= since:
+        counts = dict(recent_counts)
+        for topic_id in own_assignments:
+            if counts.get(topic_id):
+                counts[topic_id] -= 1
+        held_out.frequency_scores = model.classifier._score_frequency(counts, model.topic_ids)
+
+    return held_out
+
+
+def _score_batch(labels, methods, chunk_size, held_out=False):
+    """Score the corpus through the batch path; returns (email_id -> predicted ids, latencies).
+
+    With held_out each email is scored leave-one-out (see _held_out_model), one email at a time.
+    """
+    predictions = {}
+    latencies = []
+    weight_sums = {}
+    if held_out:
+        weight_sums = {
+            (topic_id, width): weight_sum or 0.0
+            for topic_id, width, weight_sum in db.session.query(
+                TopicCentroid.topic_id, TopicCentroid.embedding_dim, TopicCentroid.weight_sum
+            ).all()
+        }
+
+    for customer_id, email_ids in _by_customer(labels).items():
+        model = load_classification_model(customer_id)
+        recent_counts = get_recent_topic_counts(customer_id) if held_out else None
+        for start in range(0, len(email_ids), chunk_size):
+            chunk_started = time.perf_counter()
+            rows = load_email_rows(email_ids[start:start + chunk_size])
+            context = load_context(customer_id, rows) if 'context' in methods else None
+
+            if held_out:
+                assignments = context['assignments'] if context else get_email_assignments(
+                    [row.id for row in rows]
+                )
+                results = [
+                    result
+                    for row in rows
+                    for result in score_email_rows(
+                        _held_out_model(model, row, assignments.get(row.id, {}), weight_sums, recent_counts),
+                        [row], context, methods
+                    )
+                ]
+            else:
+                results = score_email_rows(model, rows, context, methods)
+
+            for result in results:
+                predictions[result['email_id']] = set(
+                    item['topic_id'] for item in result['classifications']
+                )
+            # Emails of a chunk share its latency evenly
+            latencies.extend([(time.perf_counter() - chunk_started) / max(len(rows), 1)] * len(rows))
+    return predictions, latencies
+
+
+def benchmark_batch(labels, methods=None, chunk_size=200):
+    """Time the batch scoring path over the corpus, without writing assignments"""
+    methods = methods or ALL_METHODS
+
+    started = time.perf_counter()
+    with count_queries() as counter:
+        predictions, latencies = _score_batch(labels, methods, chunk_size)
+    return _timing_report(time.perf_counter() - started, latencies, counter.count, len(predictions))
+
+
+def evaluate(labels, predictions):
+    """Micro-averaged precision, recall and F1 of predicted topic sets against the labels"""
+    true_positives = predicted = expected = 0
+    for email_id, gold in labels.items():
+        guessed = predictions.get(email_id, set())
+        true_positives += len(gold & guessed)
+        predicted += len(guessed)
+        expected += len(gold)
+
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(f1, 4),
+        'predicted': predicted,
+        'expected': expected
+    }
+
+
+def evaluate_methods(labels, chunk_size=200):
+    """Leave-one-out precision/recall of each method on its own and of all methods combined"""
+    quality = {}
+    for name, methods in [(method, [method]) for method in ALL_METHODS] + [('combined', ALL_METHODS)]:
+        predictions, _ = _score_batch(labels, methods, chunk_size, held_out=True)
+        quality[name] = evaluate(labels, predictions)
+    return quality
+
+
+def run_benchmark(customer_id=None, limit=500, fixture_path=None, chunk_size=200):
+    """Run the speed and quality benchmarks and return one report"""
+    if fixture_path:
+        labels = load_corpus_fixture(fixture_path)
+    else:
+        labels = load_verified_corpus(customer_id=customer_id, limit=limit)
+
+    if not labels:
+        return {'error': 'No verified topic assignments to benchmark against'}
+
+    report = {
+        'corpus': {
+            'emails': len(labels),
+            'labels': sum(len(topic_ids) for topic_ids in labels.values()),
+            'model_version': get_topic_model_snapshot().version
+        },
+        'single': benchmark_single(labels),
+        'batch': benchmark_batch(labels, chunk_size=chunk_size),
+        'quality': evaluate_methods(labels, chunk_size=chunk_size)
+    }
+
+    logger.info(f"Classifier benchmark over {len(labels)} emails: "
+                f"single {report['single']['emails_per_second']}/s, "
+                f"batch {report['batch']['emails_per_second']}/s, "
+                f"combined F1 {report['quality']['combined']['f1']}")
+    return report
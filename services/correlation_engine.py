@@ -2,12 +2,16 @@ import json
 import re
 from datetime import datetime, timedelta
 from models import db, FileReference, EmailThread, FileEmailCorrelation, Customer
-from services.embeddings_service import embeddings_service
+from services.embeddings_service import get_embeddings_service
 from sqlalchemy import and_, or_
 
 class CorrelationEngine:
     """Engine for correlating files with email threads"""
     
+    def __init__(self, use_reduced_embeddings=True):
+        # Compare files and emails in the customer's projected space when one is fitted
+        self.use_reduced_embeddings = use_reduced_embeddings
+    
     def correlate_customer_files(self, customer_id, specific_file_id=None):
         """Correlate files with emails for a customer"""
         # Get files to correlate
@@ -26,15 +30,48 @@ class CorrelationEngine:
         # Get all emails for the customer
         emails = EmailThread.query.filter_by(customer_id=customer_id).all()
         
+        reduced = self._load_reduced_embeddings(customer_id)
+        
         for file_ref in files:
-            self._correlate_file_with_emails(file_ref, emails)
+            self._correlate_file_with_emails(file_ref, emails, reduced)
+    
+    def _load_reduced_embeddings(self, customer_id):
+        """Load the customer's projection and reduced email matrix, or None to use full vectors"""
+        if not self.use_reduced_embeddings:
+            return None
+        
+        service = get_embeddings_service()
+        result = service.get_reduced_embedding_matrix(customer_id)
+        if result is None or not result[0]:
+            return None
+        
+        email_ids, matrix = result
+        return {
+            'projection': service.get_active_projection(customer_id),
+            'email_ids': email_ids,
+            'matrix': matrix
+        }
+    
+    def _reduced_similarities(self, file_ref, reduced):
+        """Cosine similarity of a file against every reduced email embedding, keyed by email id"""
+        if not reduced or not file_ref.embedding:
+            return {}
+        
+        file_embedding = json.loads(file_ref.embedding) if isinstance(file_ref.embedding, str) else file_ref.embedding
+        projection = reduced['projection']
+        if len(file_embedding) != projection.input_dim:
+            return {}
+        
+        similarities = reduced['matrix'] @ projection.transform(file_embedding)[0]
+        return dict(zip(reduced['email_ids'], similarities.tolist()))
     
-    def _correlate_file_with_emails(self, file_ref, emails):
+    def _correlate_file_with_emails(self, file_ref, emails, reduced=None):
         """Correlate a single file with emails"""
         # Clear existing correlations for this file
         FileEmailCorrelation.query.filter_by(file_id=file_ref.id).delete()
         
         correlations = []
+        reduced_similarities = self._reduced_similarities(file_ref, reduced)
         
         for email in emails:
             correlation_score = 0
@@ -74,13 +111,14 @@ class CorrelationEngine:
                     correlation_types.append('topic_match')
             
             # 5. Embedding similarity (if available)
-            if file_ref.embedding and hasattr(email, 'embedding') and email.embedding:
-                similarity = embeddings_service.calculate_similarity(
+            similarity = reduced_similarities.get(email.id)
+            if similarity is None and file_ref.embedding and hasattr(email, 'embedding') and email.embedding:
+                similarity = get_embeddings_service().calculate_similarity(
                     file_ref.embedding, email.embedding
                 )
-                if similarity > 0.7:
-                    correlation_score += similarity * 0.4
-                    correlation_types.append('semantic_similarity')
+            if similarity and similarity > 0.7:
+                correlation_score += similarity * 0.4
+                correlation_types.append('semantic_similarity')
             
             # Store correlation if significant
             if correlation_score > 0.1:
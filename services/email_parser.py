@@ -7,6 +7,8 @@ from models import db, EmailThread, Customer
 import mimetypes
 import json
 from services.logger import log_event
+from services.embeddings_service import get_embeddings_service
+from services.ingest_classification import queue_ingest_classification, start_watermark
 
 def parse_google_takeout(extract_path, customer_id):
     """Parse Google Takeout export and extract emails"""
@@ -44,6 +46,8 @@ def parse_mbox_file(filepath, customer_id):
     log_event('info', f'Starting to parse MBOX file: {os.path.basename(filepath)} ({file_size_mb:.1f} MB)')
     
     try:
+        start_watermark(customer_id)
+        
         with open(filepath, 'rb') as f:
             # Read the entire file content
             content = f.read()
@@ -97,6 +101,9 @@ def parse_mbox_file(filepath, customer_id):
                 continue
         
         db.session.commit()
+        get_embeddings_service().invalidate_email_stats(customer_id)
+        if email_count:
+            queue_ingest_classification(customer_id)
         log_event('info', f'Successfully imported {email_count} emails from {os.path.basename(filepath)}')
         
     except Exception as e:
@@ -109,6 +116,8 @@ def parse_json_emails(filepath, customer_id):
     email_count = 0
     
     try:
+        start_watermark(customer_id)
+        
         with open(filepath, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
@@ -152,6 +161,9 @@ def parse_json_emails(filepath, customer_id):
                 continue
         
         db.session.commit()
+        get_embeddings_service().invalidate_email_stats(customer_id)
+        if email_count:
+            queue_ingest_classification(customer_id)
         
     except Exception as e:
         print(f"Error reading JSON file: {str(e)}")
@@ -0,0 +1,400 @@
+"""
+Persistent, cancellable embedding jobs.
+Job state lives in ProcessingJob rows, so progress, cancellation and resume work across
+restarts and across every worker process.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import func
+
+from models import db, ProcessingJob
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBroker:
+    """Wakes progress streams in this process as soon as a local job publishes an event"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = {}  # task_id -> latest event
+        self._local_tasks = set()
+
+    def register(self, task_id):
+        with self._condition:
+            self._local_tasks.add(task_id)
+
+    def unregister(self, task_id):
+        with self._condition:
+            self._local_tasks.discard(task_id)
+            self._events.pop(task_id, None)
+            self._condition.notify_all()
+
+    def is_local(self, task_id):
+        with self._condition:
+            return task_id in self._local_tasks
+
+    def publish(self, task_id, event):
+        with self._condition:
+            self._events[task_id] = event
+            self._condition.notify_all()
+
+    def wait_for_event(self, task_id, after_id, timeout):
+        """Wait up to timeout seconds for an event newer than after_id; None on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                event = self._events.get(task_id)
+                if event and event['id'] > after_id:
+                    return event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+
+class EmbeddingJobService:
+    """Creates, runs, cancels and resumes database-backed embedding jobs"""
+
+    job_type = 'embeddings'
+
+    def __init__(self, heartbeat_timeout=120):
+        # A running job whose heartbeat is older than this is treated as orphaned
+        self.heartbeat_timeout = heartbeat_timeout
+        self.worker_id = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.broker = ProgressBroker()
+
+    def create_job(self, customer_id, filters, embedding_method='openai', total=0):
+        """Create a pending job row for the given email filters"""
+        job = ProcessingJob(
+            task_id="customer_{}_{}_{}".format(customer_id, int(time.time()), uuid.uuid4().hex[:6]),
+            job_type=self.job_type,
+            customer_id=customer_id,
+            params=json.dumps({'filters': filters, 'embedding_method': embedding_method}),
+            status='pending',
+            total=total
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def get_job(self, task_id):
+        """Get a job by task id"""
+        return ProcessingJob.query.filter_by(task_id=task_id, job_type=self.job_type).first()
+
+    def start_job(self, app, task_id):
+        """Run a job on a background thread of this worker process"""
+        thread = threading.Thread(target=self.run_in_context, args=(app, task_id), daemon=True)
+        thread.start()
+        return thread
+
+    def run_job(self, task_id):
+        """Claim a job and run it in the current app context until it finishes or is cancelled.
+
+        Only the worker that wins the claim runs the job. A run that finds another worker
+        has taken the job over (because it looked orphaned) stops before its next batch
+        without writing progress or finishing the job.
+        """
+        job = self.get_job(task_id)
+        if job is None or job.is_finished:
+            return
+        if not self._claim(job):
+            logger.info("{} job {} is owned by worker {}, not running it".format(
+                self.job_type, task_id, job.worker_id
+            ))
+            return
+        if job.cancel_requested:
+            self._finish(job, 'cancelled')
+            return
+
+        params = json.loads(job.params or '{}')
+        done_before, base_counts = self._resume_counts(job, params)
+        run_started = time.monotonic()
+        lost = []
+
+        def report_progress(current, total, counts, cursor=None):
+            """Save a committed batch: counts of this run plus the resume cursor, if any"""
+            if not self._owns(job):
+                lost.append(True)
+                return
+
+            elapsed = time.monotonic() - run_started
+            throughput = current / elapsed if elapsed > 0 else None
+
+            if cursor is not None:
+                job.cursor = cursor
+            job.processed = base_counts['processed'] + counts['processed']
+            job.skipped = base_counts['skipped'] + counts['skipped']
+            job.errors = base_counts['errors'] + counts['errors']
+            job.progress = min(int((done_before + current) / job.total * 100), 100) if job.total else 100
+            job.throughput = round(throughput, 2) if throughput else None
+            job.eta_seconds = round((total - current) / throughput, 1) if throughput else None
+            job.heartbeat_at = datetime.utcnow()
+            job.event_seq = (job.event_seq or 0) + 1
+            db.session.commit()
+            self.broker.publish(job.task_id, self.progress_event(job))
+
+        def should_cancel():
+            cancel_requested, worker_id = db.session.query(
+                ProcessingJob.cancel_requested, ProcessingJob.worker_id
+            ).filter_by(id=job.id).one()
+            if worker_id != self.worker_id:
+                lost.append(True)
+            return bool(cancel_requested) or bool(lost)
+
+        cancelled = self._execute(job, params, done_before, report_progress, should_cancel)
+
+        if lost:
+            logger.warning("{} job {} was taken over by another worker; stopped".format(
+                self.job_type, task_id
+            ))
+            return
+        self._finish(job, 'cancelled' if cancelled else 'completed')
+
+    def _resume_counts(self, job, params):
+        """(items done by earlier runs, counts to add this run's progress to)"""
+        done_before = job.processed + job.skipped + job.errors
+        return done_before, {'processed': job.processed, 'skipped': job.skipped, 'errors': job.errors}
+
+    def _execute(self, job, params, done_before, report_progress, should_cancel):
+        """Embed the job's remaining emails; returns True if the run was cancelled"""
+        from services.embeddings_service import EmbeddingsService
+
+        logger.info("Running embedding job {} (cursor: {})".format(job.task_id, job.cursor))
+        service = EmbeddingsService(force_simple=(params.get('embedding_method') == 'tfidf'))
+
+        # Ids stream in keyset order, so the cursor covers every committed batch and
+        # processing starts on the first chunk
+        email_ids = chain.from_iterable(service.iter_filtered_email_ids(
+            customer_id=job.customer_id, after_id=job.cursor, **params.get('filters', {})
+        ))
+
+        def progress_callback(current, total, results):
+            report_progress(current, total, {
+                'processed': results['processed'],
+                'skipped': results['skipped'],
+                'errors': results['errors']
+            }, cursor=results['last_email_id'])
+
+        results = service.process_email_embeddings(
+            email_ids=email_ids,
+            progress_callback=progress_callback,
+            should_cancel=should_cancel,
+            total=max(job.total - done_before, 0)
+        )
+        logger.info("Embedding job {} finished: {}".format(job.task_id, results))
+        return results['cancelled']
+
+    def progress_event(self, job):
+        """Build the progress event for a job's current state"""
+        return {
+            'id': job.event_seq or 0,
+            'event': 'finished' if job.is_finished else 'progress',
+            'data': {
+                'task_id': job.task_id,
+                'status': job.status,
+                'progress': job.progress,
+                'total': job.total,
+                'processed': job.processed,
+                'skipped': job.skipped,
+                'errors': job.errors,
+                'throughput': job.throughput,
+                'eta_seconds': job.eta_seconds,
+                'error': job.error_message
+            }
+        }
+
+    def iter_progress_events(self, task_id, last_event_id=0, heartbeat_interval=15, poll_interval=2.0):
+        """Yield progress events for a job until it finishes; yields None when a heartbeat is due.
+
+        Jobs running in this process are pushed through the broker as soon as they commit a
+        batch. Jobs owned by another worker are read from their ProcessingJob row every
+        poll_interval seconds. Events with an id <= last_event_id are not repeated, so a
+        reconnecting client only receives progress it has not seen.
+        """
+        last_sent = time.monotonic()
+
+        while True:
+            event = self.broker.wait_for_event(task_id, last_event_id, timeout=poll_interval)
+
+            if event is None and not self.broker.is_local(task_id):
+                # End the read transaction so the row is fetched fresh
+                db.session.rollback()
+                job = self.get_job(task_id)
+                if job is None:
+                    return
+                if (job.event_seq or 0) > last_event_id or (job.is_finished and last_event_id == 0):
+                    event = self.progress_event(job)
+                elif job.is_finished:
+                    # The client has already seen the final event
+                    return
+
+            if event is not None:
+                last_event_id = event['id']
+                last_sent = time.monotonic()
+                yield event
+                if event['event'] == 'finished':
+                    return
+            elif time.monotonic() - last_sent >= heartbeat_interval:
+                last_sent = time.monotonic()
+                yield None
+
+    def request_cancel(self, task_id):
+        """Flag a job for cancellation; the running worker stops before its next batch"""
+        job = self.get_job(task_id)
+        if job is None:
+            return None
+
+        if not job.is_finished:
+            job.cancel_requested = True
+            if job.status == 'pending':
+                job.status = 'cancelled'
+                job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+        return job
+
+    def is_stale(self, job):
+        """Check whether an unfinished job has lost its worker"""
+        if job.is_finished:
+            return False
+        last_seen = job.heartbeat_at or job.created_at
+        return last_seen is None or datetime.utcnow() - last_seen > timedelta(seconds=self.heartbeat_timeout)
+
+    def resume_job(self, app, task_id):
+        """Resume an orphaned, failed or cancelled job from its last committed batch.
+
+        The run claims the job itself, so a worker that is still running it keeps it.
+        """
+        job = self.get_job(task_id)
+        if job is None or job.status == 'completed':
+            return None
+
+        if job.is_finished:
+            job.status = 'pending'
+            job.cancel_requested = False
+            job.error_message = None
+            job.finished_at = None
+            job.heartbeat_at = None
+            db.session.commit()
+        elif not self.is_stale(job):
+            # Still running on a live worker
+            return None
+
+        self.start_job(app, task_id)
+        return job
+
+    def resume_stale_jobs(self, app):
+        """Resume every orphaned job; call once at application startup"""
+        resumed = []
+        with app.app_context():
+            jobs = ProcessingJob.query.filter(
+                ProcessingJob.job_type == self.job_type,
+                ProcessingJob.status.in_(['pending', 'processing'])
+            ).all()
+
+            # Each run claims its job, so only one of several starting workers runs it
+            for job in jobs:
+                if self.is_stale(job):
+                    self.start_job(app, job.task_id)
+                    resumed.append(job.task_id)
+
+        if resumed:
+            logger.info("Resuming {} stale {} jobs: {}".format(len(resumed), self.job_type, resumed))
+        return resumed
+
+    def cleanup_jobs(self, max_age_seconds=3600):
+        """Delete finished jobs older than max_age_seconds"""
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+        removed = ProcessingJob.query.filter(
+            ProcessingJob.job_type == self.job_type,
+            ProcessingJob.status.in_(['completed', 'error', 'cancelled']),
+            ProcessingJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def _claim(self, job):
+        """Atomically take ownership of a pending or orphaned job.
+
+        Compare-and-set on the state this worker read: False if the job is running on a live
+        worker or another worker claimed it first.
+        """
+        if job.status != 'pending' and not self.is_stale(job):
+            return False
+
+        now = datetime.utcnow()
+        claimed = ProcessingJob.query.filter(
+            ProcessingJob.id == job.id,
+            ProcessingJob.status == job.status,
+            ProcessingJob.worker_id == job.worker_id,
+            ProcessingJob.heartbeat_at == job.heartbeat_at
+        ).update(
+            {
+                'status': 'processing',
+                'worker_id': self.worker_id,
+                'heartbeat_at': now,
+                'started_at': func.coalesce(ProcessingJob.started_at, now)
+            },
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed != 1:
+            return False
+        db.session.refresh(job)
+        return True
+
+    def _owns(self, job):
+        """Check that this worker still owns a job it is running"""
+        return db.session.query(ProcessingJob.worker_id).filter_by(id=job.id).scalar() == self.worker_id
+
+    def _finish(self, job, status, error_message=None):
+        """Mark a job as finished"""
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.heartbeat_at = job.finished_at
+        if status == 'completed':
+            job.progress = 100
+        if error_message:
+            job.error_message = error_message
+        job.event_seq = (job.event_seq or 0) + 1
+        db.session.commit()
+        self.broker.publish(job.task_id, self.progress_event(job))
+
+    def run_in_context(self, app, task_id):
+        """Thread (or background task) entry point"""
+        self.broker.register(task_id)
+        with app.app_context():
+            try:
+                self.run_job(task_id)
+            except Exception as e:
+                logger.error("Error in {} job {}: {}".format(self.job_type, task_id, e), exc_info=True)
+                db.session.rollback()
+                job = self.get_job(task_id)
+                # A run that lost the job to another worker leaves it to that worker
+                if job and job.worker_id == self.worker_id and not job.is_finished:
+                    self._finish(job, 'error', error_message=str(e))
+            finally:
+                self.broker.unregister(task_id)
+                db.session.remove()
+
+
+# Global instance
+_embedding_job_service = None
+
+
+def get_embedding_job_service():
+    """Get the global embedding job service instance"""
+    global _embedding_job_service
+    if _embedding_job_service is None:
+        _embedding_job_service = EmbeddingJobService()
+    return _embedding_job_service
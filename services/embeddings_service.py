@@ -4,15 +4,53 @@ from datetime import datetime
 # from typing import List, Dict, Optional  # Commenting out for Python 2 compatibility
 import re
 import logging
-from models import db, EmailThread
+from collections import Counter
+from itertools import chain, islice
+import numpy as np
+from models import db, EmailThread, EmbeddingProjection
+from services.cache import TTLCache
+from services.topic_centroids import record_new_embeddings
 from flask import current_app
 
 logger = logging.getLogger(__name__)
 
+# Per-customer email stats shared by every service instance in this process. Commits of
+# embeddings or imports only invalidate the copy of the process that made them, so the TTL
+# is kept to a few seconds: other worker processes serve stale counts at most that long,
+# while bursts of dashboard polling still share one query
+_email_stats_cache = TTLCache(ttl=5)
+
+class LoadedProjection:
+    """In-memory arrays for an EmbeddingProjection row"""
+    
+    def __init__(self, projection):
+        self.id = projection.id
+        self.version = projection.version
+        self.method = projection.method
+        self.input_dim = projection.input_dim
+        self.output_dim = projection.output_dim
+        self.components = np.frombuffer(projection.components, dtype=np.float32).reshape(
+            projection.output_dim, projection.input_dim
+        )
+        self.mean = np.frombuffer(projection.mean, dtype=np.float32) if projection.mean else None
+    
+    def transform(self, vectors):
+        """Project vectors to output_dim and L2-normalise them so dot products stay cosines"""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        if self.mean is not None:
+            matrix = matrix - self.mean
+        reduced = matrix @ self.components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return reduced / norms
+
 class EmbeddingsService:
     """Service for calculating and managing email embeddings"""
     
-    def __init__(self, api_key=None, model="text-embedding-3-small", force_simple=False):
+    def __init__(self, api_key=None, model="text-embedding-3-small", force_simple=False,
+                 projection_dim=128, projection_sample_size=2000):
         self.api_key = api_key
         self.model = model
         self.api_url = "https://api.openai.com/v1/embeddings"
@@ -20,6 +58,11 @@ class EmbeddingsService:
         # Use simple embeddings if forced
         self.use_simple_embeddings = force_simple
         
+        # Dimensionality reduction for clustering/correlation (see fit_projection)
+        self.projection_dim = projection_dim
+        self.projection_sample_size = projection_sample_size
+        self._projections = {}  # customer_id -> LoadedProjection
+        
         # For simple embeddings
         self.stopwords = set([
             'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but',
@@ -126,20 +169,44 @@ class EmbeddingsService:
             logger.error("Failed to parse batch API response: {}".format(e))
             return [self._generate_simple_embedding(text) for text in texts]
     
-    def process_email_embeddings(self, email_ids, progress_callback=None):
-        """Process embeddings for a list of email IDs"""
+    def process_email_embeddings(self, email_ids, progress_callback=None, should_cancel=None,
+                                 total=None):
+        """Process embeddings for a list (or any iterable) of email IDs
+        
+        email_ids may be a lazy iterable such as the chained output of iter_filtered_email_ids,
+        in which case processing starts with the first chunk and total should be passed in.
+        progress_callback(current, total, results) is called after every committed batch, with
+        results['last_email_id'] set to the last id of that batch. should_cancel() is checked
+        before each batch; when it returns True processing stops and results['cancelled'] is set.
+        """
+        if total is None:
+            total = len(email_ids)
+        
         results = {
             'processed': 0,
             'errors': 0,
             'skipped': 0,
-            'total': len(email_ids)
+            'total': total,
+            'last_email_id': None,
+            'cancelled': False
         }
         
         # Get emails in batches
         batch_size = 20 if not self._should_use_simple_embeddings() else 100
-        
-        for i in range(0, len(email_ids), batch_size):
-            batch_ids = email_ids[i:i + batch_size]
+        projections = {}  # customer_id -> LoadedProjection (or None) for this run
+        remaining_ids = iter(email_ids)
+        current = 0
+        
+        while True:
+            if should_cancel and should_cancel():
+                logger.info("Embedding processing cancelled after {} of {} emails".format(current, total))
+                results['cancelled'] = True
+                break
+            
+            batch_ids = list(islice(remaining_ids, batch_size))
+            if not batch_ids:
+                break
+            current += len(batch_ids)
             emails = EmailThread.query.filter(EmailThread.id.in_(batch_ids)).all()
             
             # Check for missing email IDs
@@ -161,8 +228,9 @@ class EmbeddingsService:
                     emails_to_process.append(email)
             
             if not emails_to_process:
+                results['last_email_id'] = batch_ids[-1]
                 if progress_callback:
-                    progress_callback(i + len(batch_ids), len(email_ids))
+                    progress_callback(current, total, results)
                 continue
             
             # Prepare text for embedding
@@ -176,14 +244,17 @@ class EmbeddingsService:
             embeddings = self.get_embeddings_batch(texts)
             
             # Save embeddings to database
+            new_embeddings = {}
             for email, embedding in zip(emails_to_process, embeddings):
                 try:
                     if embedding:
+                        new_embeddings[email.id] = np.asarray(embedding, dtype=np.float32)
                         email.embedding = json.dumps(embedding)
                         email.embedding_model = self.model
                         email.has_embedding = True
                         email.embedding_processed_at = datetime.utcnow()
                         email.embedding_error = None
+                        self._store_reduced_embedding(email, embedding, projections)
                         results['processed'] += 1
                     else:
                         email.embedding_error = "Failed to get embedding"
@@ -196,7 +267,11 @@ class EmbeddingsService:
             
             # Commit batch
             try:
+                # Emails classified before they were embedded join their topics' centroids now
+                record_new_embeddings(new_embeddings)
                 db.session.commit()
+                for customer_id in set(email.customer_id for email in emails_to_process):
+                    self.invalidate_email_stats(customer_id)
             except Exception as e:
                 logger.error("Error committing batch: {}".format(e))
                 db.session.rollback()
@@ -204,23 +279,291 @@ class EmbeddingsService:
                 results['processed'] = max(0, results['processed'] - len(emails_to_process))
             
             # Update progress
+            results['last_email_id'] = batch_ids[-1]
             if progress_callback:
-                progress_callback(i + len(batch_ids), len(email_ids))
+                progress_callback(current, total, results)
         
         return results
     
+    def fit_projection(self, customer_id, output_dim=None, method='pca', sample_size=None,
+                       seed=None, apply=True):
+        """Fit a PCA or random projection on a sample of a customer's embeddings and activate it.
+        
+        PCA uses an SVD of the mean-centred sample. The previous projection is deactivated and
+        the new one gets the next version number; with apply=True every stored embedding is
+        projected straight away.
+        """
+        if method not in ('pca', 'random'):
+            raise ValueError("Unknown projection method: {}".format(method))
+        
+        output_dim = output_dim or self.projection_dim
+        sample_size = sample_size or self.projection_sample_size
+        
+        rows = db.session.query(EmailThread.embedding, EmailThread.embedding_model).filter(
+            EmailThread.customer_id == customer_id,
+            EmailThread.has_embedding == True
+        ).order_by(db.func.random()).limit(sample_size).all()
+        
+        vectors = []
+        for row in rows:
+            if row.embedding:
+                vectors.append((json.loads(row.embedding), row.embedding_model))
+        if not vectors:
+            raise ValueError("No embeddings found for customer {}".format(customer_id))
+        
+        # Simple and API embeddings have different widths; fit on the dominant one
+        input_dim = Counter(len(vector) for vector, _ in vectors).most_common(1)[0][0]
+        sample = np.asarray([vector for vector, _ in vectors if len(vector) == input_dim], dtype=np.float32)
+        embedding_model = Counter(
+            model for vector, model in vectors if len(vector) == input_dim
+        ).most_common(1)[0][0]
+        
+        output_dim = min(output_dim, input_dim)
+        mean = None
+        explained_variance = None
+        
+        if method == 'pca':
+            output_dim = min(output_dim, len(sample))
+            mean = sample.mean(axis=0)
+            _, singular_values, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            components = vt[:output_dim]
+            total_variance = float((singular_values ** 2).sum())
+            if total_variance > 0:
+                explained_variance = float((singular_values[:output_dim] ** 2).sum()) / total_variance
+        else:
+            rng = np.random.default_rng(seed)
+            components = rng.standard_normal((output_dim, input_dim)) / np.sqrt(output_dim)
+        
+        latest_version = db.session.query(db.func.max(EmbeddingProjection.version)).filter(
+            EmbeddingProjection.customer_id == customer_id
+        ).scalar() or 0
+        
+        EmbeddingProjection.query.filter_by(customer_id=customer_id, is_active=True).update(
+            {'is_active': False}
+        )
+        projection = EmbeddingProjection(
+            customer_id=customer_id,
+            version=latest_version + 1,
+            method=method,
+            embedding_model=embedding_model,
+            input_dim=input_dim,
+            output_dim=output_dim,
+            components=np.asarray(components, dtype=np.float32).tobytes(),
+            mean=mean.astype(np.float32).tobytes() if mean is not None else None,
+            explained_variance=explained_variance,
+            sample_size=len(sample),
+            is_active=True
+        )
+        db.session.add(projection)
+        db.session.commit()
+        self._projections.pop(customer_id, None)
+        
+        logger.info("Fitted {} projection v{} for customer {}: {} -> {}".format(
+            method, projection.version, customer_id, input_dim, output_dim
+        ))
+        
+        if apply:
+            self.apply_projection(customer_id)
+        
+        return projection
+    
+    def get_active_projection(self, customer_id):
+        """Get the customer's active projection as arrays, or None if none has been fitted"""
+        version = db.session.query(EmbeddingProjection.version).filter(
+            EmbeddingProjection.customer_id == customer_id,
+            EmbeddingProjection.is_active == True
+        ).order_by(EmbeddingProjection.version.desc()).limit(1).scalar()
+        
+        if version is None:
+            self._projections.pop(customer_id, None)
+            return None
+        
+        cached = self._projections.get(customer_id)
+        if cached and cached.version == version:
+            return cached
+        
+        projection = EmbeddingProjection.query.filter_by(
+            customer_id=customer_id, version=version
+        ).first()
+        loaded = LoadedProjection(projection)
+        self._projections[customer_id] = loaded
+        return loaded
+    
+    def apply_projection(self, customer_id, batch_size=500):
+        """Store reduced embeddings for every email not yet projected with the active version"""
+        projection = self.get_active_projection(customer_id)
+        if projection is None:
+            return 0
+        
+        updated = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(EmailThread.id, EmailThread.embedding).filter(
+                EmailThread.customer_id == customer_id,
+                EmailThread.has_embedding == True,
+                EmailThread.id > last_id,
+                db.or_(
+                    EmailThread.reduced_embedding_version == None,
+                    EmailThread.reduced_embedding_version != projection.version
+                )
+            ).order_by(EmailThread.id).limit(batch_size).all()
+            
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            ids = []
+            vectors = []
+            for row in rows:
+                if not row.embedding:
+                    continue
+                vector = json.loads(row.embedding)
+                if len(vector) == projection.input_dim:
+                    ids.append(row.id)
+                    vectors.append(vector)
+            
+            if vectors:
+                reduced = projection.transform(vectors)
+                db.session.bulk_update_mappings(EmailThread, [
+                    {
+                        'id': email_id,
+                        'reduced_embedding': json.dumps([round(float(x), 6) for x in vector]),
+                        'reduced_embedding_version': projection.version
+                    }
+                    for email_id, vector in zip(ids, reduced)
+                ])
+                db.session.commit()
+                updated += len(ids)
+        
+        logger.info("Stored {} reduced embeddings for customer {} (projection v{})".format(
+            updated, customer_id, projection.version
+        ))
+        return updated
+    
+    def get_reduced_embedding_matrix(self, customer_id, email_ids=None):
+        """Get (email_ids, matrix) of reduced embeddings, or None if the customer has no projection.
+        
+        Emails whose stored reduced embedding is missing or from an older version are projected
+        on the fly from their full embedding.
+        """
+        projection = self.get_active_projection(customer_id)
+        if projection is None:
+            return None
+        
+        query = db.session.query(
+            EmailThread.id, EmailThread.reduced_embedding, EmailThread.reduced_embedding_version
+        ).filter(
+            EmailThread.customer_id == customer_id,
+            EmailThread.has_embedding == True
+        )
+        if email_ids is not None:
+            query = query.filter(EmailThread.id.in_(email_ids))
+        
+        ids = []
+        vectors = []
+        stale_ids = []
+        for row in query.order_by(EmailThread.id):
+            if row.reduced_embedding and row.reduced_embedding_version == projection.version:
+                ids.append(row.id)
+                vectors.append(json.loads(row.reduced_embedding))
+            else:
+                stale_ids.append(row.id)
+        
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), projection.output_dim)
+        
+        if stale_ids:
+            stale_vectors = []
+            for i in range(0, len(stale_ids), 500):
+                for row in db.session.query(EmailThread.id, EmailThread.embedding).filter(
+                    EmailThread.id.in_(stale_ids[i:i + 500])
+                ):
+                    if row.embedding:
+                        vector = json.loads(row.embedding)
+                        if len(vector) == projection.input_dim:
+                            ids.append(row.id)
+                            stale_vectors.append(vector)
+            if stale_vectors:
+                matrix = np.vstack([matrix, projection.transform(stale_vectors)])
+        
+        return ids, matrix
+    
+    def _store_reduced_embedding(self, email, embedding, projections):
+        """Project a freshly computed embedding if the email's customer has an active projection"""
+        if email.customer_id not in projections:
+            projections[email.customer_id] = self.get_active_projection(email.customer_id)
+        projection = projections[email.customer_id]
+        
+        if projection is None or len(embedding) != projection.input_dim:
+            email.reduced_embedding = None
+            email.reduced_embedding_version = None
+            return
+        
+        reduced = projection.transform(embedding)[0]
+        email.reduced_embedding = json.dumps([round(float(x), 6) for x in reduced])
+        email.reduced_embedding_version = projection.version
+    
     def get_email_stats_for_customer(self, customer_id, sender_filter=None, 
                                    recipient_filter=None):
         """Get email statistics by year/month for a customer with filtering"""
         
-        # Base query
-        query = EmailThread.query.filter_by(customer_id=customer_id)
+        cache_key = (
+            customer_id,
+            tuple(sorted(sender_filter or ())),
+            tuple(sorted(recipient_filter or ()))
+        )
+        stats = _email_stats_cache.get(cache_key)
+        if stats is not None:
+            return stats
+        
+        # Count in the database instead of loading every email
+        year = db.extract('year', EmailThread.date).label('year')
+        month = db.extract('month', EmailThread.date).label('month')
+        query = db.session.query(
+            year, month, EmailThread.has_embedding, db.func.count(EmailThread.id)
+        ).filter(EmailThread.customer_id == customer_id)
+        query = self._apply_address_filters(query, sender_filter, recipient_filter)
+        
+        rows = query.group_by(year, month, EmailThread.has_embedding).order_by(year, month).all()
+        
+        # Organize by year/month
+        stats = {}
+        for year_value, month_value, has_embedding, count in rows:
+            year_value = int(year_value)
+            month_value = int(month_value)
+            
+            if year_value not in stats:
+                stats[year_value] = {'total': 0, 'with_embeddings': 0, 'months': {}}
+            
+            if month_value not in stats[year_value]['months']:
+                stats[year_value]['months'][month_value] = {'total': 0, 'with_embeddings': 0}
+            
+            # Count totals
+            stats[year_value]['total'] += count
+            stats[year_value]['months'][month_value]['total'] += count
+            
+            # Count with embeddings
+            if has_embedding:
+                stats[year_value]['with_embeddings'] += count
+                stats[year_value]['months'][month_value]['with_embeddings'] += count
+        
+        _email_stats_cache.set(cache_key, stats)
+        return stats
+    
+    def invalidate_email_stats(self, customer_id=None):
+        """Drop this process's cached email statistics after embeddings or imports commit"""
+        if customer_id is None:
+            _email_stats_cache.invalidate()
+        else:
+            _email_stats_cache.invalidate(lambda key: key[0] == customer_id)
+    
+    def _apply_address_filters(self, query, sender_filter=None, recipient_filter=None):
+        """Apply sender/recipient filters, defaulting to emails that involve our domains"""
         
         # Apply sender filter if provided
         if sender_filter:
             query = query.filter(EmailThread.sender_email.in_(sender_filter))
         
-        # Apply recipient filter if provided  
+        # Apply recipient filter if provided
         if recipient_filter:
             query = query.filter(EmailThread.recipient_email.in_(recipient_filter))
         
@@ -233,30 +576,7 @@ class EmbeddingsService:
                 domain_filters.append(EmailThread.recipient_email.like('%@{}'.format(domain)))
             query = query.filter(db.or_(*domain_filters))
         
-        emails = query.all()
-        
-        # Organize by year/month
-        stats = {}
-        for email in emails:
-            year = email.date.year
-            month = email.date.month
-            
-            if year not in stats:
-                stats[year] = {'total': 0, 'with_embeddings': 0, 'months': {}}
-            
-            if month not in stats[year]['months']:
-                stats[year]['months'][month] = {'total': 0, 'with_embeddings': 0}
-            
-            # Count totals
-            stats[year]['total'] += 1
-            stats[year]['months'][month]['total'] += 1
-            
-            # Count with embeddings
-            if email.has_embedding:
-                stats[year]['with_embeddings'] += 1
-                stats[year]['months'][month]['with_embeddings'] += 1
-        
-        return stats
+        return query
     
     def get_unique_email_addresses(self, customer_id):
         """Get unique sender and recipient email addresses for a customer"""
@@ -279,35 +599,82 @@ class EmbeddingsService:
     def get_filtered_email_ids(self, customer_id, year=None, month=None,
                              sender_filter=None, recipient_filter=None):
         """Get email IDs matching the specified filters"""
+        return list(chain.from_iterable(self.iter_filtered_email_ids(
+            customer_id, year=year, month=month,
+            sender_filter=sender_filter, recipient_filter=recipient_filter
+        )))
+    
+    def iter_filtered_email_ids(self, customer_id, year=None, month=None,
+                                sender_filter=None, recipient_filter=None,
+                                chunk_size=1000, after_id=None):
+        """Yield chunks of matching email IDs in (date, id) order using keyset pagination
+        
+        Only ids are selected and each chunk is a range scan on the (customer_id, date) index,
+        so callers can start working on the first chunk straight away. after_id resumes after
+        a previously returned email.
+        """
+        query = self._filtered_email_id_query(
+            customer_id, year, month, sender_filter, recipient_filter
+        )
+        
+        last_key = None
+        if after_id:
+            after_date = db.session.query(EmailThread.date).filter(EmailThread.id == after_id).scalar()
+            if after_date is not None:
+                last_key = (after_date, after_id)
+        
+        while True:
+            chunk_query = query
+            if last_key:
+                last_date, last_id = last_key
+                chunk_query = chunk_query.filter(
+                    EmailThread.date >= last_date,
+                    db.or_(EmailThread.date > last_date, EmailThread.id > last_id)
+                )
+            
+            rows = chunk_query.order_by(EmailThread.date, EmailThread.id).limit(chunk_size).all()
+            if not rows:
+                return
+            
+            yield [row.id for row in rows]
+            
+            if len(rows) < chunk_size:
+                return
+            last_key = (rows[-1].date, rows[-1].id)
+    
+    def count_filtered_emails(self, customer_id, year=None, month=None,
+                              sender_filter=None, recipient_filter=None):
+        """Count emails matching the specified filters without loading them"""
+        query = self._filtered_email_id_query(
+            customer_id, year, month, sender_filter, recipient_filter
+        )
+        return query.order_by(None).count()
+    
+    def _filtered_email_id_query(self, customer_id, year=None, month=None,
+                                 sender_filter=None, recipient_filter=None):
+        """Build an (id, date) query for the given filters"""
         
         # Base query
-        query = EmailThread.query.filter_by(customer_id=customer_id)
+        query = db.session.query(EmailThread.id, EmailThread.date).filter(
+            EmailThread.customer_id == customer_id
+        )
         
-        # Apply date filters
+        # Apply date filters as a range so the (customer_id, date) index is used
         if year:
-            query = query.filter(db.extract('year', EmailThread.date) == year)
-        if month:
+            year = int(year)
+            if month:
+                month = int(month)
+                start = datetime(year, month, 1)
+                end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+            else:
+                start = datetime(year, 1, 1)
+                end = datetime(year + 1, 1, 1)
+            query = query.filter(EmailThread.date >= start, EmailThread.date < end)
+        elif month:
+            # A month across all years is not a single range
             query = query.filter(db.extract('month', EmailThread.date) == month)
         
-        # Apply sender filter if provided
-        if sender_filter:
-            query = query.filter(EmailThread.sender_email.in_(sender_filter))
-        
-        # Apply recipient filter if provided
-        if recipient_filter:
-            query = query.filter(EmailThread.recipient_email.in_(recipient_filter))
-        
-        # Default filter: only emails involving our domains
-        if not sender_filter and not recipient_filter:
-            our_domains = ['wiredtriangle.com', 'knewvantage.com']
-            domain_filters = []
-            for domain in our_domains:
-                domain_filters.append(EmailThread.sender_email.like('%@{}'.format(domain)))
-                domain_filters.append(EmailThread.recipient_email.like('%@{}'.format(domain)))
-            query = query.filter(db.or_(*domain_filters))
-        
-        emails = query.all()
-        return [email.id for email in emails]
+        return self._apply_address_filters(query, sender_filter, recipient_filter)
     
     def _generate_simple_embedding(self, content):
         """Generate a simple embedding vector as fallback"""
@@ -345,30 +712,43 @@ class EmbeddingsService:
         dot_product = sum(a * b for a, b in zip(embedding1, embedding2))
         return dot_product  # Already normalized
     
-    def extract_topics_from_embeddings(self, customer_id, max_main_topics=10, max_sub_topics=20):
+    def extract_topics_from_embeddings(self, customer_id, max_main_topics=10, max_sub_topics=20,
+                                       use_reduced=True):
         """Extract topics from existing embeddings using clustering and save to hierarchy"""
         try:
-            # Get all emails with embeddings for this customer
-            emails = EmailThread.query.filter_by(customer_id=customer_id).filter(
-                EmailThread.has_embedding == True
-            ).all()
+            # Clustering only needs coarse structure, so prefer the reduced matrix when available
+            reduced = self.get_reduced_embedding_matrix(customer_id) if use_reduced else None
+            
+            if reduced is not None and reduced[0]:
+                email_ids, embeddings = reduced
+                subjects = dict(db.session.query(EmailThread.id, EmailThread.subject).filter(
+                    EmailThread.customer_id == customer_id,
+                    EmailThread.has_embedding == True
+                ).all())
+                emails = list(subjects)
+                texts = [subjects.get(email_id) or '' for email_id in email_ids]
+            else:
+                # Get all emails with embeddings for this customer
+                emails = EmailThread.query.filter_by(customer_id=customer_id).filter(
+                    EmailThread.has_embedding == True
+                ).all()
+                
+                # Extract embeddings and texts
+                embeddings = []
+                texts = []
+                email_ids = []
+                
+                for email in emails:
+                    if email.embedding:
+                        embedding = json.loads(email.embedding)
+                        embeddings.append(embedding)
+                        texts.append(email.subject or '')
+                        email_ids.append(email.id)
             
             if not emails:
                 return {'main_topics': [], 'sub_topics': [], 'error': 'No embeddings found'}
             
-            # Extract embeddings and texts
-            embeddings = []
-            texts = []
-            email_ids = []
-            
-            for email in emails:
-                if email.embedding:
-                    embedding = json.loads(email.embedding)
-                    embeddings.append(embedding)
-                    texts.append(email.subject or '')
-                    email_ids.append(email.id)
-            
-            if not embeddings:
+            if not len(embeddings):
                 return {'main_topics': [], 'sub_topics': [], 'error': 'No valid embeddings found'}
             
             # Simple clustering approach for topic extraction
@@ -376,11 +756,18 @@ class EmbeddingsService:
             
             # Import topic service for hierarchy management
             from services.topic_service import get_topic_service
+            from services.topic_model import get_topic_model_snapshot
+            from models import Topic
             topic_service = get_topic_service()
             
+            # Reuse only topics this customer can see; new ones belong to the customer, so
+            # names derived from its emails never reach other customers' candidate sets
+            visible_topic_ids = get_topic_model_snapshot().customer_topic_ids(customer_id)
+            
             # Create/update topics in hierarchy
             created_main_topics = []
             created_sub_topics = []
+            assignments = []  # (email_id, topic_id, confidence, method), written in bulk below
             
             # Process main topics
             for topic_data in topics.get('main_topics', [])[:max_main_topics]:
@@ -388,8 +775,9 @@ class EmbeddingsService:
                 email_list = topic_data['emails']
                 
                 # Find or create topic
-                from models import Topic
-                existing_topic = Topic.query.filter_by(name=topic_name, level=0).first()
+                existing_topic = Topic.query.filter_by(name=topic_name, level=0).filter(
+                    Topic.id.in_(visible_topic_ids)
+                ).first()
                 
                 if not existing_topic:
                     # Create new main topic
@@ -397,21 +785,17 @@ class EmbeddingsService:
                         name=topic_name,
                         description=f"Auto-generated main topic from embeddings",
                         level=0,
-                        created_by='embeddings_system'
+                        created_by='embeddings_system',
+                        customer_id=customer_id
                     )
                     topic_id = new_topic.id
                 else:
                     topic_id = existing_topic.id
                 
                 # Assign emails to topic
-                for email_id in email_list:
-                    topic_service.assign_topic_to_email(
-                        email_id=email_id,
-                        topic_id=topic_id,
-                        confidence_score=0.8,
-                        classification_method='embedding_clustering',
-                        assigned_by='embeddings_system'
-                    )
+                assignments.extend(
+                    (email_id, topic_id, 0.8, 'embedding_clustering') for email_id in email_list
+                )
                 
                 created_main_topics.append({
                     'name': topic_name,
@@ -426,7 +810,9 @@ class EmbeddingsService:
                 email_list = topic_data['emails']
                 
                 # Find or create topic
-                existing_topic = Topic.query.filter_by(name=topic_name, level=1).first()
+                existing_topic = Topic.query.filter_by(name=topic_name, level=1).filter(
+                    Topic.id.in_(visible_topic_ids)
+                ).first()
                 
                 if not existing_topic:
                     # Create new sub topic
@@ -434,21 +820,17 @@ class EmbeddingsService:
                         name=topic_name,
                         description=f"Auto-generated sub topic from embeddings",
                         level=1,
-                        created_by='embeddings_system'
+                        created_by='embeddings_system',
+                        customer_id=customer_id
                     )
                     topic_id = new_topic.id
                 else:
                     topic_id = existing_topic.id
                 
                 # Assign emails to topic
-                for email_id in email_list:
-                    topic_service.assign_topic_to_email(
-                        email_id=email_id,
-                        topic_id=topic_id,
-                        confidence_score=0.7,
-                        classification_method='embedding_clustering',
-                        assigned_by='embeddings_system'
-                    )
+                assignments.extend(
+                    (email_id, topic_id, 0.7, 'embedding_clustering') for email_id in email_list
+                )
                 
                 created_sub_topics.append({
                     'name': topic_name,
@@ -457,8 +839,9 @@ class EmbeddingsService:
                     'topic_id': topic_id
                 })
             
-            # Update topic statistics
-            topic_service.update_topic_statistics()
+            # Upsert every assignment in chunks instead of one commit per email;
+            # topic email counts and last used dates move with each chunk
+            topic_service.bulk_assign(assignments, assigned_by='embeddings_system')
             
             return {
                 'main_topics': created_main_topics,
@@ -493,9 +876,12 @@ class EmbeddingsService:
     
     def _simple_clustering(self, embeddings, texts, email_ids, num_clusters=15):
         """Simple clustering without external libraries"""
-        if not embeddings:
+        if not len(embeddings):
             return []
         
+        if isinstance(embeddings, np.ndarray):
+            return self._simple_clustering_matrix(embeddings, texts, email_ids, num_clusters)
+        
         # Simple approach: group by similarity threshold
         clusters = []
         used_indices = set()
@@ -531,6 +917,32 @@ class EmbeddingsService:
         clusters.sort(key=lambda x: len(x['texts']), reverse=True)
         return clusters[:num_clusters]
     
+    def _simple_clustering_matrix(self, matrix, texts, email_ids, num_clusters=15):
+        """Same threshold clustering as _simple_clustering over a normalised (n, d) matrix"""
+        clusters = []
+        used = np.zeros(len(matrix), dtype=bool)
+        
+        for i in range(len(matrix)):
+            if used[i]:
+                continue
+            used[i] = True
+            
+            similar = np.nonzero((matrix @ matrix[i] > 0.8) & ~used)[0]
+            used[similar] = True
+            
+            if len(similar):  # Only keep clusters with multiple emails
+                indices = [i] + similar.tolist()
+                clusters.append({
+                    'center': matrix[i].tolist(),
+                    'texts': [texts[j] for j in indices],
+                    'ids': [email_ids[j] for j in indices],
+                    'indices': indices
+                })
+        
+        # Sort by cluster size
+        clusters.sort(key=lambda x: len(x['texts']), reverse=True)
+        return clusters[:num_clusters]
+    
     def _extract_topic_from_cluster(self, cluster):
         """Extract a topic name from a cluster of texts"""
         texts = cluster['texts']
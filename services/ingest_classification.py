@@ -0,0 +1,152 @@
+"""
+Classify-on-ingest pipeline stage.
+Importers queue a 'classify_new_emails' background task for the customer after committing new
+emails. The task classifies every email above the customer's ClassificationWatermark in
+micro-batches and advances the watermark after each one, so a lost queue entry (e.g. on
+restart) only delays classification until the next import or catch-up run.
+A customer's first watermark starts at their newest email: emails from before ingest
+classification started are left to explicit auto-classify jobs.
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import exists, func
+
+from models import db, ClassificationWatermark, EmailThread, EmailTopic
+
+logger = logging.getLogger(__name__)
+
+
+def queue_ingest_classification(customer_id):
+    """Ask the background processor to classify a customer's newly imported emails"""
+    from services.background_tasks import get_background_processor
+
+    processor = get_background_processor()
+    if processor:
+        processor.add_task('classify_new_emails', customer_id=customer_id)
+    else:
+        logger.debug(f"No background processor; new emails of customer {customer_id} wait for catch-up")
+
+
+def get_watermark(customer_id, model_version):
+    """Get (or start) the watermark row of the given model version.
+
+    A new version continues from the highest email id any earlier version reached, so
+    already-classified emails are not reclassified just because the model changed. The first
+    watermark of a customer starts at their highest email id, so the background thread never
+    picks up a customer's whole history.
+    """
+    watermark = ClassificationWatermark.query.filter_by(
+        customer_id=customer_id, model_version=model_version
+    ).first()
+    if watermark:
+        return watermark
+
+    reached = db.session.query(func.max(ClassificationWatermark.last_email_id)).filter(
+        ClassificationWatermark.customer_id == customer_id
+    ).scalar()
+    if reached is None:
+        reached = db.session.query(func.max(EmailThread.id)).filter(
+            EmailThread.customer_id == customer_id
+        ).scalar() or 0
+
+    watermark = ClassificationWatermark(
+        customer_id=customer_id,
+        model_version=model_version,
+        first_email_id=reached,
+        last_email_id=reached,
+        emails_classified=0
+    )
+    db.session.add(watermark)
+    db.session.commit()
+    return watermark
+
+
+def start_watermark(customer_id):
+    """Start the customer's watermark (if they have none) before an import adds emails.
+
+    Importers call this first so the emails of a customer's first import land above the
+    watermark and are classified on ingest.
+    """
+    from services.topic_classifier import get_topic_classifier
+
+    return get_watermark(customer_id, get_topic_classifier().model_version)
+
+
+def classify_new_emails(customer_id, batch_size=100, max_emails=None):
+    """Classify a customer's emails above the watermark in micro-batches.
+
+    Emails that already have topic assignments (e.g. set by hand) are passed over. Returns
+    the number of emails classified.
+    """
+    from services.batch_classifier import BatchTopicClassifier, load_classification_model
+    from services.topic_classifier import get_topic_classifier
+
+    classifier = get_topic_classifier()
+    watermark = get_watermark(customer_id, classifier.model_version)
+    model = None
+    batch_classifier = BatchTopicClassifier(classifier=classifier, chunk_size=batch_size)
+    classified = 0
+
+    while max_emails is None or classified < max_emails:
+        limit = batch_size if max_emails is None else min(batch_size, max_emails - classified)
+
+        batch = db.session.query(
+            EmailThread.id,
+            exists().where(EmailTopic.email_id == EmailThread.id).label('has_topics')
+        ).filter(
+            EmailThread.customer_id == customer_id,
+            EmailThread.id > watermark.last_email_id
+        ).order_by(EmailThread.id).limit(limit).all()
+
+        if not batch:
+            break
+
+        email_ids = [email_id for email_id, has_topics in batch if not has_topics]
+        if email_ids:
+            # Topics, keywords and centroids are loaded once per run
+            if model is None:
+                model = load_classification_model(customer_id, classifier=classifier)
+            results = batch_classifier.classify_emails(customer_id, email_ids, model=model)
+            if results['errors']:
+                logger.warning(f"Ingest classification errors for customer {customer_id}: {results['errors']}")
+
+        watermark.last_email_id = batch[-1][0]
+        watermark.emails_classified = (watermark.emails_classified or 0) + len(email_ids)
+        watermark.updated_at = datetime.utcnow()
+        db.session.commit()
+        classified += len(email_ids)
+
+    if classified:
+        logger.info(f"Classified {classified} new emails for customer {customer_id} "
+                    f"(watermark {watermark.last_email_id}, model v{watermark.model_version})")
+    return classified
+
+
+def catch_up_all(batch_size=100):
+    """Classify new emails of every customer with emails above its watermark"""
+    from services.topic_classifier import get_topic_classifier
+
+    model_version = get_topic_classifier().model_version
+    reached = db.session.query(
+        ClassificationWatermark.customer_id,
+        func.max(ClassificationWatermark.last_email_id).label('last_email_id')
+    ).group_by(ClassificationWatermark.customer_id).subquery()
+
+    customer_ids = [row[0] for row in db.session.query(EmailThread.customer_id).outerjoin(
+        reached, reached.c.customer_id == EmailThread.customer_id
+    ).filter(
+        EmailThread.id > func.coalesce(reached.c.last_email_id, 0)
+    ).distinct().all()]
+
+    totals = {}
+    for customer_id in customer_ids:
+        try:
+            totals[customer_id] = classify_new_emails(customer_id, batch_size=batch_size)
+        except Exception as e:
+            logger.error(f"Error classifying new emails for customer {customer_id}: {e}", exc_info=True)
+            db.session.rollback()
+
+    logger.info(f"Ingest classification catch-up (model v{model_version}): {totals}")
+    return totals
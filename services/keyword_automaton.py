@@ -0,0 +1,170 @@
+"""
+Aho-Corasick keyword matching for topic classification.
+All active topic keywords are compiled into one automaton, so every keyword occurrence in an
+email is found in a single pass over its text instead of one substring scan per keyword.
+"""
+
+from collections import deque, defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a fixed list of lowercase patterns"""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self._lengths = [len(pattern) for pattern in self.patterns]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._build()
+
+    def _build(self):
+        # Trie of all patterns
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state].append(index)
+
+        # Failure links, breadth first
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str, whole_words: bool = True) -> Iterator[Tuple[int, int]]:
+        """Yield (start, pattern_index) for every occurrence of every pattern in text"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for index in output[state]:
+                start = position - self._lengths[index] + 1
+                if whole_words:
+                    if start > 0 and _is_word_char(text[start - 1]):
+                        continue
+                    if position + 1 < len(text) and _is_word_char(text[position + 1]):
+                        continue
+                yield start, index
+
+    def count_matches(self, text: str, whole_words: bool = True) -> Dict[int, int]:
+        """Count occurrences per pattern index"""
+        counts = defaultdict(int)
+        for _, index in self.iter_matches(text, whole_words=whole_words):
+            counts[index] += 1
+        return counts
+
+
+class KeywordEntry:
+    """A TopicKeyword as seen by the keyword index"""
+
+    __slots__ = ('keyword_id', 'topic_id', 'keyword', 'weight', 'pattern', 'parts')
+
+    def __init__(self, keyword_id, topic_id, keyword, weight, pattern, parts):
+        self.keyword_id = keyword_id
+        self.topic_id = topic_id
+        self.keyword = keyword
+        self.weight = weight
+        self.pattern = pattern  # Pattern index of the whole keyword
+        self.parts = parts  # Pattern indexes of the words of a compound keyword
+
+
+class KeywordHit:
+    """Occurrences of one keyword in one text"""
+
+    __slots__ = ('entry', 'occurrences', 'all_parts_present')
+
+    def __init__(self, entry, occurrences, all_parts_present):
+        self.entry = entry
+        self.occurrences = occurrences
+        self.all_parts_present = all_parts_present
+
+
+class TopicKeywordIndex:
+    """Compiled keyword automaton for a set of topic keywords"""
+
+    def __init__(self, rows):
+        """rows: iterable of (keyword_id, topic_id, keyword, weight)"""
+        pattern_ids = {}
+        self.entries = []
+
+        def pattern_id(text):
+            if text not in pattern_ids:
+                pattern_ids[text] = len(pattern_ids)
+            return pattern_ids[text]
+
+        for keyword_id, topic_id, keyword, weight in rows:
+            normalized = ' '.join((keyword or '').lower().split())
+            if not normalized:
+                continue
+            words = normalized.split(' ')
+            parts = [pattern_id(word) for word in words] if len(words) > 1 else []
+            self.entries.append(KeywordEntry(
+                keyword_id, topic_id, keyword, weight if weight is not None else 1.0,
+                pattern_id(normalized), parts
+            ))
+
+        self.automaton = KeywordAutomaton(sorted(pattern_ids, key=pattern_ids.get))
+        self.topic_ids = set(entry.topic_id for entry in self.entries)
+
+        # Pattern index -> positions of the entries it is the whole keyword or a part of
+        self._entries_by_pattern = defaultdict(list)
+        for position, entry in enumerate(self.entries):
+            for pattern in set([entry.pattern] + entry.parts):
+                self._entries_by_pattern[pattern].append(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find_hits(self, text: str) -> List[KeywordHit]:
+        """Find every keyword that occurs in text (already lowercased), in one pass"""
+        if not self.entries or not text:
+            return []
+
+        counts = self.automaton.count_matches(text)
+        if not counts:
+            return []
+
+        # Only the entries of patterns that occur can be hit
+        candidates = set()
+        for pattern in counts:
+            candidates.update(self._entries_by_pattern.get(pattern, ()))
+
+        hits = []
+        for position in sorted(candidates):
+            entry = self.entries[position]
+            occurrences = counts.get(entry.pattern, 0)
+            all_parts_present = bool(entry.parts) and all(counts.get(part) for part in entry.parts)
+            if occurrences or all_parts_present:
+                hits.append(KeywordHit(entry, occurrences, all_parts_present))
+        return hits
+
+
+def get_keyword_index() -> TopicKeywordIndex:
+    """Get the compiled keyword index of the current topic model snapshot"""
+    from services.topic_model import get_topic_model_snapshot
+    return get_topic_model_snapshot().keyword_index
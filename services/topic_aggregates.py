@@ -0,0 +1,447 @@
+"""
+Per-customer topic aggregates for context and frequency classification and topic trends.
+SenderTopicAffinity keeps running assignment counts and confidence sums per sender and topic,
+TopicDailyFrequency keeps assignment counts per topic and email date, and TopicTimelineRollup
+keeps counts and confidence sums per topic and day, week or month of the email date. All are
+updated in the same transaction as the assignments, so classifying an email or charting a
+topic's trend reads a handful of pre-aggregated rows instead of walking the customer's emails.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Date, DateTime, cast, func, literal
+
+from models import (
+    db, EmailTopic, EmailThread, SenderTopicAffinity, TopicDailyFrequency, TopicTimelineRollup
+)
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Days of assignments that count towards a topic's recent frequency
+FREQUENCY_WINDOW_DAYS = 30
+
+# Periods an email's date is rolled up into for topic trends
+TIMELINE_GRANULARITIES = ('day', 'week', 'month')
+
+# customer_id -> {topic_id: assignment count} over the frequency window
+_frequency_cache = TTLCache(ttl=60)
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def period_start(day, granularity):
+    """First day of the day, week (Monday) or month period containing day"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def record_assignment_changes(changes, emails=None):
+    """Fold assignment changes into the sender, frequency and timeline aggregates; the caller commits.
+
+    changes: iterable of (email_id, topic_id, old_confidence, new_confidence), where
+    old_confidence is None for a new assignment and new_confidence is None for a removed one.
+    emails: optional email_id -> (customer_id, sender_email, date), loaded when omitted.
+    Returns the ids of the customers whose emails changed.
+    """
+    changes = list(changes)
+    if not changes:
+        return set()
+
+    if emails is None:
+        emails = load_email_context(set(email_id for email_id, _, _, _ in changes))
+
+    affinity_deltas = defaultdict(lambda: [0, 0.0])
+    frequency_deltas = defaultdict(int)
+    timeline_deltas = defaultdict(lambda: [0, 0.0])
+    for email_id, topic_id, old_confidence, new_confidence in changes:
+        if email_id not in emails:
+            continue
+        customer_id, sender_email, email_date = emails[email_id]
+        member_delta = (new_confidence is not None) - (old_confidence is not None)
+        confidence_delta = (new_confidence or 0.0) - (old_confidence or 0.0)
+
+        if sender_email:
+            affinity = affinity_deltas[(customer_id, sender_email, topic_id)]
+            affinity[0] += member_delta
+            affinity[1] += confidence_delta
+
+        if email_date is None:
+            continue
+        day = _as_date(email_date)
+        if member_delta:
+            frequency_deltas[(customer_id, topic_id, day)] += member_delta
+        for granularity in TIMELINE_GRANULARITIES:
+            rollup = timeline_deltas[(customer_id, topic_id, granularity, period_start(day, granularity))]
+            rollup[0] += member_delta
+            rollup[1] += confidence_delta
+
+    _apply_affinity_deltas(affinity_deltas)
+    _apply_frequency_deltas(frequency_deltas)
+    _apply_timeline_deltas(timeline_deltas)
+
+    customer_ids = set(key[0] for key in frequency_deltas)
+    _frequency_cache.invalidate(lambda key: key in customer_ids)
+
+    return set(customer_id for customer_id, _, _ in emails.values())
+
+
+def load_email_context(email_ids):
+    """Get email_id -> (customer_id, sender_email, date) for the given emails"""
+    if not email_ids:
+        return {}
+
+    rows = db.session.query(
+        EmailThread.id, EmailThread.customer_id, EmailThread.sender_email, EmailThread.date
+    ).filter(EmailThread.id.in_(list(email_ids))).all()
+    return {email_id: (customer_id, sender, email_date) for email_id, customer_id, sender, email_date in rows}
+
+
+def _apply_affinity_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    existing = {
+        (row.customer_id, row.sender_email, row.topic_id): row
+        for row in SenderTopicAffinity.query.filter(
+            SenderTopicAffinity.customer_id.in_(set(key[0] for key in deltas)),
+            SenderTopicAffinity.sender_email.in_(set(key[1] for key in deltas)),
+            SenderTopicAffinity.topic_id.in_(set(key[2] for key in deltas))
+        ).all()
+    }
+
+    now = datetime.utcnow()
+    for key, (count_delta, confidence_delta) in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            if count_delta > 0:
+                db.session.add(SenderTopicAffinity(
+                    customer_id=key[0], sender_email=key[1], topic_id=key[2],
+                    assignment_count=count_delta, confidence_sum=confidence_delta, updated_at=now
+                ))
+            continue
+
+        row.assignment_count = (row.assignment_count or 0) + count_delta
+        if row.assignment_count <= 0:
+            db.session.delete(row)
+            continue
+        row.confidence_sum = (row.confidence_sum or 0.0) + confidence_delta
+        row.updated_at = now
+
+
+def _apply_frequency_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    existing = {
+        (row.customer_id, row.topic_id, row.day): row
+        for row in TopicDailyFrequency.query.filter(
+            TopicDailyFrequency.customer_id.in_(set(key[0] for key in deltas)),
+            TopicDailyFrequency.topic_id.in_(set(key[1] for key in deltas)),
+            TopicDailyFrequency.day.in_(set(key[2] for key in deltas))
+        ).all()
+    }
+
+    for key, count_delta in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            if count_delta > 0:
+                db.session.add(TopicDailyFrequency(
+                    customer_id=key[0], topic_id=key[1], day=key[2], assignment_count=count_delta
+                ))
+            continue
+
+        row.assignment_count = (row.assignment_count or 0) + count_delta
+        if row.assignment_count <= 0:
+            db.session.delete(row)
+
+
+def _apply_timeline_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    existing = {
+        (row.customer_id, row.topic_id, row.granularity, row.period_start): row
+        for row in TopicTimelineRollup.query.filter(
+            TopicTimelineRollup.customer_id.in_(set(key[0] for key in deltas)),
+            TopicTimelineRollup.topic_id.in_(set(key[1] for key in deltas)),
+            TopicTimelineRollup.period_start.in_(set(key[3] for key in deltas))
+        ).all()
+    }
+
+    for key, (count_delta, confidence_delta) in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            if count_delta > 0:
+                db.session.add(TopicTimelineRollup(
+                    customer_id=key[0], topic_id=key[1], granularity=key[2], period_start=key[3],
+                    email_count=count_delta, confidence_sum=confidence_delta
+                ))
+            continue
+
+        row.email_count = (row.email_count or 0) + count_delta
+        if row.email_count <= 0:
+            db.session.delete(row)
+            continue
+        row.confidence_sum = (row.confidence_sum or 0.0) + confidence_delta
+
+
+def get_sender_affinities(customer_id, senders):
+    """Get sender -> {topic_id: (assignment_count, confidence_sum)} for the given senders"""
+    senders = set(sender for sender in senders if sender)
+    if not senders:
+        return {}
+
+    affinities = defaultdict(dict)
+    for sender, topic_id, count, confidence_sum in db.session.query(
+        SenderTopicAffinity.sender_email, SenderTopicAffinity.topic_id,
+        SenderTopicAffinity.assignment_count, SenderTopicAffinity.confidence_sum
+    ).filter(
+        SenderTopicAffinity.customer_id == customer_id,
+        SenderTopicAffinity.sender_email.in_(senders)
+    ).all():
+        affinities[sender][topic_id] = (count or 0, confidence_sum or 0.0)
+    return dict(affinities)
+
+
+def get_email_assignments(email_ids):
+    """Get email_id -> {topic_id: confidence} for the given emails"""
+    if not email_ids:
+        return {}
+
+    assignments = defaultdict(dict)
+    for email_id, topic_id, confidence in db.session.query(
+        EmailTopic.email_id, EmailTopic.topic_id, EmailTopic.confidence_score
+    ).filter(EmailTopic.email_id.in_(list(email_ids))).all():
+        assignments[email_id][topic_id] = confidence or 0.0
+    return dict(assignments)
+
+
+def get_recent_topic_counts(customer_id, days=FREQUENCY_WINDOW_DAYS):
+    """Get {topic_id: assignment count} for emails dated in the last days days"""
+    counts = _frequency_cache.get(customer_id)
+    if counts is not None and days == FREQUENCY_WINDOW_DAYS:
+        return counts
+
+    since = (datetime.now() - timedelta(days=days)).date()
+    counts = dict(db.session.query(
+        TopicDailyFrequency.topic_id, func.sum(TopicDailyFrequency.assignment_count)
+    ).filter(
+        TopicDailyFrequency.customer_id == customer_id,
+        TopicDailyFrequency.day >= since
+    ).group_by(TopicDailyFrequency.topic_id).all())
+
+    if days == FREQUENCY_WINDOW_DAYS:
+        _frequency_cache.set(customer_id, counts)
+    return counts
+
+
+def get_topic_trend(customer_id, topic_id, granularity='week', start=None, end=None, fill_gaps=True):
+    """Get a topic's email count and average confidence per period, oldest first.
+
+    Reads the timeline rollup only. start and end (dates) bound the series; with fill_gaps
+    periods without emails are included with zero counts.
+    """
+    if granularity not in TIMELINE_GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {', '.join(TIMELINE_GRANULARITIES)}")
+
+    query = TopicTimelineRollup.query.filter(
+        TopicTimelineRollup.customer_id == customer_id,
+        TopicTimelineRollup.topic_id == topic_id,
+        TopicTimelineRollup.granularity == granularity
+    )
+    if start is not None:
+        start = period_start(start, granularity)
+        query = query.filter(TopicTimelineRollup.period_start >= start)
+    if end is not None:
+        query = query.filter(TopicTimelineRollup.period_start <= end)
+
+    rows = query.order_by(TopicTimelineRollup.period_start).all()
+    if not fill_gaps or not rows and (start is None or end is None):
+        return [row.to_dict() for row in rows]
+
+    by_period = {row.period_start: row for row in rows}
+    current = start if start is not None else rows[0].period_start
+    last = period_start(end, granularity) if end is not None else rows[-1].period_start
+
+    series = []
+    while current <= last:
+        row = by_period.get(current)
+        series.append(row.to_dict() if row else {
+            'period_start': current.isoformat(), 'email_count': 0, 'avg_confidence': 0.0
+        })
+        current = _next_period(current, granularity)
+    return series
+
+
+def delete_topic_aggregates(topic_ids):
+    """Remove the aggregates of deleted topics; the caller commits"""
+    topic_ids = list(topic_ids)
+    SenderTopicAffinity.query.filter(SenderTopicAffinity.topic_id.in_(topic_ids)).delete(
+        synchronize_session=False
+    )
+    TopicDailyFrequency.query.filter(TopicDailyFrequency.topic_id.in_(topic_ids)).delete(
+        synchronize_session=False
+    )
+    TopicTimelineRollup.query.filter(TopicTimelineRollup.topic_id.in_(topic_ids)).delete(
+        synchronize_session=False
+    )
+    _frequency_cache.invalidate()
+
+
+def merge_topic_aggregates(source_topic_id, target_topic_id):
+    """Replace a merged topic's aggregates after its assignments moved; the caller commits.
+
+    The source's rows are dropped and the target's are recomputed from its assignments with
+    grouped INSERT ... SELECT statements, so the work stays in the database however many
+    emails the topics share.
+    """
+    delete_topic_aggregates([source_topic_id])
+    _replace_aggregates(topic_ids=[target_topic_id])
+
+
+def _period_start_column(column, granularity):
+    """SQL expression of the day, week (Monday) or month period start of a datetime column"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        modifiers = {
+            'day': (),
+            'week': ('weekday 0', '-6 days'),
+            'month': ('start of month',)
+        }[granularity]
+        return func.date(column, *modifiers)
+    if granularity == 'day':
+        return func.date(column)
+    return cast(func.date_trunc(granularity, column), Date)
+
+
+def _assignment_rows(topic_ids, customer_id, *columns):
+    """Assignments joined to their emails, restricted to the given topics and customer"""
+    query = db.session.query(*columns).select_from(EmailTopic).join(
+        EmailThread, EmailThread.id == EmailTopic.email_id
+    )
+    if topic_ids is not None:
+        query = query.filter(EmailTopic.topic_id.in_(topic_ids))
+    if customer_id is not None:
+        query = query.filter(EmailThread.customer_id == customer_id)
+    return query
+
+
+def _stale_rows(model, topic_ids, customer_id):
+    query = model.query
+    if topic_ids is not None:
+        query = query.filter(model.topic_id.in_(topic_ids))
+    if customer_id is not None:
+        query = query.filter(model.customer_id == customer_id)
+    return query
+
+
+def _insert_grouped(model, columns, query):
+    return db.session.execute(model.__table__.insert().from_select(columns, query)).rowcount
+
+
+def _replace_timeline(topic_ids=None, customer_id=None):
+    """Recompute the timeline rollup with one grouped INSERT ... SELECT per granularity"""
+    _stale_rows(TopicTimelineRollup, topic_ids, customer_id).delete(synchronize_session=False)
+
+    rows = 0
+    for granularity in TIMELINE_GRANULARITIES:
+        emails = _assignment_rows(
+            topic_ids, customer_id,
+            EmailThread.customer_id, EmailTopic.topic_id,
+            _period_start_column(EmailThread.date, granularity).label('period_start'),
+            EmailTopic.confidence_score
+        ).filter(EmailThread.date.isnot(None)).subquery()
+
+        rows += _insert_grouped(
+            TopicTimelineRollup,
+            ['customer_id', 'topic_id', 'granularity', 'period_start', 'email_count', 'confidence_sum'],
+            db.session.query(
+                emails.c.customer_id, emails.c.topic_id, literal(granularity), emails.c.period_start,
+                func.count(), func.coalesce(func.sum(emails.c.confidence_score), 0.0)
+            ).group_by(emails.c.customer_id, emails.c.topic_id, emails.c.period_start)
+        )
+    return rows
+
+
+def _replace_aggregates(topic_ids=None, customer_id=None):
+    """Recompute all aggregates from EmailTopic in the database; the caller commits"""
+    if topic_ids is not None:
+        topic_ids = list(topic_ids)
+
+    _stale_rows(SenderTopicAffinity, topic_ids, customer_id).delete(synchronize_session=False)
+    affinities = _insert_grouped(
+        SenderTopicAffinity,
+        ['customer_id', 'sender_email', 'topic_id', 'assignment_count', 'confidence_sum', 'updated_at'],
+        _assignment_rows(
+            topic_ids, customer_id,
+            EmailThread.customer_id, EmailThread.sender_email, EmailTopic.topic_id,
+            func.count(EmailTopic.id), func.coalesce(func.sum(EmailTopic.confidence_score), 0.0),
+            literal(datetime.utcnow(), DateTime)
+        ).filter(EmailThread.sender_email.isnot(None)).group_by(
+            EmailThread.customer_id, EmailThread.sender_email, EmailTopic.topic_id
+        )
+    )
+
+    _stale_rows(TopicDailyFrequency, topic_ids, customer_id).delete(synchronize_session=False)
+    days = _assignment_rows(
+        topic_ids, customer_id,
+        EmailThread.customer_id, EmailTopic.topic_id,
+        _period_start_column(EmailThread.date, 'day').label('day')
+    ).filter(EmailThread.date.isnot(None)).subquery()
+    frequencies = _insert_grouped(
+        TopicDailyFrequency,
+        ['customer_id', 'topic_id', 'day', 'assignment_count'],
+        db.session.query(days.c.customer_id, days.c.topic_id, days.c.day, func.count()).group_by(
+            days.c.customer_id, days.c.topic_id, days.c.day
+        )
+    )
+
+    timeline_rollups = _replace_timeline(topic_ids=topic_ids, customer_id=customer_id)
+
+    _frequency_cache.invalidate()
+    return {
+        'sender_affinities': affinities,
+        'daily_frequencies': frequencies,
+        'timeline_rollups': timeline_rollups
+    }
+
+
+def rebuild_topic_timeline(topic_ids=None, customer_id=None):
+    """Backfill the timeline rollup from EmailTopic and commit; returns the rows written"""
+    rows = _replace_timeline(topic_ids=list(topic_ids) if topic_ids is not None else None,
+                             customer_id=customer_id)
+    db.session.commit()
+    logger.info(f"Rebuilt {rows} topic timeline rollups")
+    return rows
+
+
+def rebuild_topic_aggregates(topic_ids=None, customer_id=None):
+    """Recompute the aggregates from EmailTopic with grouped INSERT ... SELECT and commit"""
+    counts = _replace_aggregates(topic_ids=topic_ids, customer_id=customer_id)
+    db.session.commit()
+    logger.info(f"Rebuilt {counts['sender_affinities']} sender affinities, "
+                f"{counts['daily_frequencies']} daily topic counts and "
+                f"{counts['timeline_rollups']} timeline rollups")
+    return counts
@@ -0,0 +1,336 @@
+"""
+Per-topic centroid vectors for embedding-based classification.
+Each TopicCentroid row stores the confidence-weighted sum of its member email embeddings, so
+membership changes are folded in incrementally and the centroid (the weighted mean) is
+vector_sum / weight_sum. Scoring an email against every topic is then one matrix product.
+"""
+
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+from models import db, EmailTopic, EmailThread, TopicCentroid
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Centroid matrices are read on every classification; changes invalidate this process's copy
+# and the TTL bounds how stale other worker processes can be
+_centroid_cache = TTLCache(ttl=60, max_entries=1)
+
+
+def _parse_embedding(value):
+    if not value:
+        return None
+    try:
+        return np.asarray(json.loads(value), dtype=np.float32)
+    except (ValueError, TypeError):
+        return None
+
+
+def load_email_embeddings(email_ids):
+    """Get email_id -> embedding vector for the embedded emails among email_ids"""
+    if not email_ids:
+        return {}
+
+    rows = db.session.query(EmailThread.id, EmailThread.embedding).filter(
+        EmailThread.id.in_(list(email_ids)),
+        EmailThread.has_embedding == True
+    ).all()
+
+    embeddings = {}
+    for email_id, embedding in rows:
+        vector = _parse_embedding(embedding)
+        if vector is not None:
+            embeddings[email_id] = vector
+    return embeddings
+
+
+def _apply_deltas(deltas):
+    """Add (vector, weight, members) deltas keyed by (topic_id, width) to the stored centroids"""
+    if not deltas:
+        return
+
+    topic_ids = list(set(topic_id for topic_id, _ in deltas))
+    centroids = {
+        (centroid.topic_id, centroid.embedding_dim): centroid
+        for centroid in TopicCentroid.query.filter(TopicCentroid.topic_id.in_(topic_ids)).all()
+    }
+
+    now = datetime.utcnow()
+    for (topic_id, width), (vector_delta, weight_delta, member_delta) in deltas.items():
+        centroid = centroids.get((topic_id, width))
+
+        if centroid is None:
+            if member_delta <= 0:
+                continue
+            centroid = TopicCentroid(
+                topic_id=topic_id,
+                embedding_dim=width,
+                vector_sum=vector_delta.astype(np.float32).tobytes(),
+                weight_sum=weight_delta,
+                member_count=member_delta,
+                updated_at=now
+            )
+            db.session.add(centroid)
+            continue
+
+        member_count = (centroid.member_count or 0) + member_delta
+        if member_count <= 0:
+            # Drop empty centroids rather than keep float residue around
+            db.session.delete(centroid)
+            continue
+
+        vector_sum = np.frombuffer(centroid.vector_sum, dtype=np.float32) + vector_delta
+        centroid.vector_sum = vector_sum.astype(np.float32).tobytes()
+        centroid.weight_sum = (centroid.weight_sum or 0.0) + weight_delta
+        centroid.member_count = member_count
+        centroid.updated_at = now
+
+    _centroid_cache.invalidate()
+
+
+def _add_delta(deltas, key, vector, weight_delta, member_delta):
+    if key not in deltas:
+        deltas[key] = [np.zeros(len(vector), dtype=np.float64), 0.0, 0]
+    deltas[key][0] += vector * weight_delta
+    deltas[key][1] += weight_delta
+    deltas[key][2] += member_delta
+
+
+def record_assignment_changes(changes, embeddings=None):
+    """Fold assignment changes into the topic centroids; the caller commits.
+
+    changes: iterable of (email_id, topic_id, old_confidence, new_confidence), where
+    old_confidence is None for a new assignment and new_confidence is None for a removed one.
+    embeddings: optional email_id -> vector, loaded from the database when omitted.
+    """
+    changes = list(changes)
+    if not changes:
+        return
+
+    if embeddings is None:
+        embeddings = load_email_embeddings(set(email_id for email_id, _, _, _ in changes))
+
+    deltas = {}
+    for email_id, topic_id, old_confidence, new_confidence in changes:
+        vector = embeddings.get(email_id)
+        if vector is None:
+            continue
+
+        weight_delta = (new_confidence or 0.0) - (old_confidence or 0.0)
+        member_delta = (new_confidence is not None) - (old_confidence is not None)
+        if weight_delta == 0 and member_delta == 0:
+            continue
+
+        _add_delta(deltas, (topic_id, len(vector)), vector, weight_delta, member_delta)
+
+    _apply_deltas(deltas)
+
+
+def record_new_embeddings(embeddings):
+    """Add freshly embedded emails to the centroids of topics they are already assigned to.
+
+    embeddings: email_id -> vector. The caller commits.
+    """
+    if not embeddings:
+        return
+
+    assignments = db.session.query(
+        EmailTopic.email_id, EmailTopic.topic_id, EmailTopic.confidence_score
+    ).filter(EmailTopic.email_id.in_(list(embeddings))).all()
+
+    record_assignment_changes(
+        [(email_id, topic_id, None, confidence or 0.0) for email_id, topic_id, confidence in assignments],
+        embeddings=embeddings
+    )
+
+
+def delete_centroids(topic_ids):
+    """Remove the centroids of deleted topics; the caller commits"""
+    TopicCentroid.query.filter(TopicCentroid.topic_id.in_(list(topic_ids))).delete(
+        synchronize_session=False
+    )
+    _centroid_cache.invalidate()
+
+
+def _merge_conflict_deltas(source_topic_id, target_topic_id, batch_size):
+    """Centroid deltas of the emails assigned to both topics of a merge.
+
+    Streamed in batches from one join, so no id lists are built however many emails the
+    topics share. Each shared email leaves the source, and raises the target's weight when
+    the source was more confident.
+    """
+    source_rows = aliased(EmailTopic)
+    target_rows = aliased(EmailTopic)
+    rows = db.session.query(
+        source_rows.confidence_score, target_rows.confidence_score, EmailThread.embedding
+    ).select_from(target_rows).join(
+        source_rows, and_(
+            source_rows.email_id == target_rows.email_id,
+            source_rows.topic_id == source_topic_id
+        )
+    ).join(EmailThread, EmailThread.id == target_rows.email_id).filter(
+        target_rows.topic_id == target_topic_id,
+        EmailThread.has_embedding == True
+    ).yield_per(batch_size)
+
+    deltas = {}
+    for source_confidence, target_confidence, embedding in rows:
+        vector = _parse_embedding(embedding)
+        if vector is None:
+            continue
+        source_confidence = source_confidence or 0.0
+        target_confidence = target_confidence or 0.0
+
+        _add_delta(deltas, (source_topic_id, len(vector)), vector, -source_confidence, -1)
+        if source_confidence > target_confidence:
+            _add_delta(deltas, (target_topic_id, len(vector)), vector,
+                       source_confidence - target_confidence, 0)
+    return deltas
+
+
+def merge_centroids(source_topic_id, target_topic_id, batch_size=500):
+    """Fold a merged topic's centroids into the target's; the caller commits.
+
+    Must run before the assignments are merged: emails assigned to both topics are read from
+    EmailTopic and taken out of the source sums first, so the sums that move to the target
+    cover exactly the assignments that move with them.
+    """
+    _apply_deltas(_merge_conflict_deltas(source_topic_id, target_topic_id, batch_size))
+
+    centroids = {
+        (centroid.topic_id, centroid.embedding_dim): centroid
+        for centroid in TopicCentroid.query.filter(
+            TopicCentroid.topic_id.in_([source_topic_id, target_topic_id])
+        ).all()
+    }
+
+    now = datetime.utcnow()
+    for (topic_id, width), source in centroids.items():
+        if topic_id != source_topic_id:
+            continue
+
+        target = centroids.get((target_topic_id, width))
+        if target is None:
+            source.topic_id = target_topic_id
+            source.updated_at = now
+            continue
+
+        vector_sum = np.frombuffer(target.vector_sum, dtype=np.float32) + np.frombuffer(
+            source.vector_sum, dtype=np.float32
+        )
+        target.vector_sum = vector_sum.astype(np.float32).tobytes()
+        target.weight_sum = (target.weight_sum or 0.0) + (source.weight_sum or 0.0)
+        target.member_count = (target.member_count or 0) + (source.member_count or 0)
+        target.updated_at = now
+        db.session.delete(source)
+
+    _centroid_cache.invalidate()
+
+
+def rebuild_centroids(topic_ids=None, batch_size=500):
+    """Recompute centroids from scratch for the given topics (all topics when None) and commit"""
+    query = db.session.query(
+        EmailTopic.topic_id, EmailTopic.confidence_score, EmailThread.embedding
+    ).join(EmailThread, EmailThread.id == EmailTopic.email_id).filter(
+        EmailThread.has_embedding == True
+    )
+    if topic_ids is not None:
+        query = query.filter(EmailTopic.topic_id.in_(list(topic_ids)))
+
+    sums = {}
+    for topic_id, confidence, embedding in query.yield_per(batch_size):
+        vector = _parse_embedding(embedding)
+        if vector is None:
+            continue
+        key = (topic_id, len(vector))
+        if key not in sums:
+            sums[key] = [np.zeros(len(vector), dtype=np.float64), 0.0, 0]
+        sums[key][0] += vector * (confidence or 0.0)
+        sums[key][1] += confidence or 0.0
+        sums[key][2] += 1
+
+    stale = TopicCentroid.query
+    if topic_ids is not None:
+        stale = stale.filter(TopicCentroid.topic_id.in_(list(topic_ids)))
+    stale.delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    for (topic_id, width), (vector_sum, weight_sum, member_count) in sums.items():
+        db.session.add(TopicCentroid(
+            topic_id=topic_id,
+            embedding_dim=width,
+            vector_sum=vector_sum.astype(np.float32).tobytes(),
+            weight_sum=weight_sum,
+            member_count=member_count,
+            updated_at=now
+        ))
+
+    db.session.commit()
+    _centroid_cache.invalidate()
+    logger.info(f"Rebuilt {len(sums)} topic centroids")
+    return len(sums)
+
+
+def get_centroid_matrices():
+    """Get width -> (topic_ids, matrix) with one weighted-mean centroid row per topic"""
+    matrices = _centroid_cache.get('all')
+    if matrices is not None:
+        return matrices
+
+    rows = db.session.query(
+        TopicCentroid.topic_id, TopicCentroid.embedding_dim, TopicCentroid.vector_sum,
+        TopicCentroid.weight_sum
+    ).filter(TopicCentroid.weight_sum > 0).all()
+
+    by_width = defaultdict(list)
+    for topic_id, width, vector_sum, weight_sum in rows:
+        by_width[width].append((topic_id, np.frombuffer(vector_sum, dtype=np.float32) / weight_sum))
+
+    matrices = {}
+    for width, members in by_width.items():
+        members.sort(key=lambda member: member[0])
+        matrices[width] = (
+            [topic_id for topic_id, _ in members],
+            np.vstack([centroid for _, centroid in members]).astype(np.float32)
+        )
+
+    _centroid_cache.set('all', matrices)
+    return matrices
+
+
+def score_against_centroids(vectors, matrices=None):
+    """Similarity of each vector to every topic centroid of the same width.
+
+    vectors: list of numpy vectors (None entries are skipped). Returns one
+    {topic_id: score} dict per vector, scores clipped to [0, 1].
+    """
+    if matrices is None:
+        matrices = get_centroid_matrices()
+
+    scores = [{} for _ in vectors]
+    by_width = defaultdict(list)
+    for position, vector in enumerate(vectors):
+        if vector is not None:
+            by_width[len(vector)].append(position)
+
+    for width, positions in by_width.items():
+        if width not in matrices:
+            continue
+        topic_ids, matrix = matrices[width]
+
+        # Embeddings are normalized, so the dot product with the weighted mean equals the
+        # confidence-weighted mean similarity to the topic's members
+        similarities = np.clip(np.vstack([vectors[position] for position in positions]) @ matrix.T, 0.0, 1.0)
+
+        for index, position in enumerate(positions):
+            scores[position] = dict(zip(topic_ids, similarities[index].tolist()))
+
+    return scores
@@ -6,19 +6,34 @@ import json
 import re
 import math
 import logging
+import numpy as np
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
-from collections import defaultdict, Counter
-from sqlalchemy import and_, or_, func, desc
+from collections import defaultdict
+from sqlalchemy import and_, or_, func, desc, exists
 
 from models import (
-    db, Topic, EmailTopic, TopicKeyword, TopicSimilarity, 
+    db, Topic, EmailTopic, TopicSimilarity, 
     EmailThread, Customer
 )
-from services.embeddings_service import get_embeddings_service
+from services.keyword_automaton import get_keyword_index
+from services.topic_model import get_topic_model_snapshot
+from services.topic_centroids import score_against_centroids
+from services.topic_aggregates import (
+    get_sender_affinities, get_email_assignments, get_recent_topic_counts
+)
 
 logger = logging.getLogger(__name__)
 
+# Common words ignored when measuring keyword density
+KEYWORD_STOP_WORDS = {
+    'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but',
+    'in', 'with', 'to', 'for', 'of', 'as', 'by', 'that', 'this',
+    'it', 'from', 'be', 'are', 'been', 'was', 'were', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would',
+    'should', 'could', 'can', 'may', 'might', 'must', 'shall'
+}
+
 class TopicClassifier:
     """Advanced topic classification with multiple algorithms"""
     
@@ -29,6 +44,11 @@ class TopicClassifier:
         self.context_weight = 0.3
         self.frequency_weight = 0.2
         
+    @property
+    def model_version(self) -> int:
+        """Version of the topic model classifications are currently made with"""
+        return get_topic_model_snapshot().version
+    
     def classify_email(self, email_id: int, methods: List[str] = None) -> Dict:
         """
         Classify an email using multiple methods and return confidence scores.
@@ -47,8 +67,9 @@ class TopicClassifier:
         if not email:
             return {'error': 'Email not found'}
         
-        # Get all active topics
-        topics = Topic.query.filter_by(is_active=True).all()
+        # The customer's active topics, keywords and centroids of the shared model snapshot
+        snapshot = get_topic_model_snapshot()
+        topics = list(snapshot.candidate_topics(email.customer_id))
         if not topics:
             return {'error': 'No active topics found'}
         
@@ -59,7 +80,7 @@ class TopicClassifier:
             method_scores['keyword'] = self._classify_by_keywords(email, topics)
         
         if 'embedding' in methods:
-            method_scores['embedding'] = self._classify_by_embeddings(email, topics)
+            method_scores['embedding'] = self._classify_by_embeddings(email, topics, snapshot.centroids)
         
         if 'context' in methods:
             method_scores['context'] = self._classify_by_context(email, topics)
@@ -74,7 +95,7 @@ class TopicClassifier:
         confident_topics = [
             {
                 'topic_id': topic_id,
-                'topic_name': Topic.query.get(topic_id).name,
+                'topic_name': snapshot.topic_name(topic_id),
                 'confidence_score': score,
                 'method_breakdown': {
                     method: method_scores[method].get(topic_id, 0.0)
@@ -93,128 +114,100 @@ class TopicClassifier:
             'classifications': confident_topics,
             'methods_used': methods,
             'total_topics_considered': len(topics),
-            'confident_topics': len(confident_topics)
+            'confident_topics': len(confident_topics),
+            'model_version': snapshot.version
         }
     
     def _classify_by_keywords(self, email: EmailThread, topics: List[Topic]) -> Dict[int, float]:
         """Classify email based on keyword matching"""
-        scores = {}
-        
         # Combine subject and body text
         text_content = f"{email.subject or ''} {email.body_full or email.body_preview or ''}"
-        text_content = text_content.lower()
         
-        # Remove common stop words
-        stop_words = {
-            'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but',
-            'in', 'with', 'to', 'for', 'of', 'as', 'by', 'that', 'this',
-            'it', 'from', 'be', 'are', 'been', 'was', 'were', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would',
-            'should', 'could', 'can', 'may', 'might', 'must', 'shall'
-        }
+        return self._score_keywords(text_content, set(topic.id for topic in topics))
+    
+    def _score_keywords(self, text_content: str, topic_ids, keyword_index=None) -> Dict[int, float]:
+        """Keyword scores for a piece of text, restricted to the given topic ids"""
+        scores = {}
+        text_content = text_content.lower()
         
         # Extract words
-        words = re.findall(r'\\b[a-zA-Z]{2,}\\b', text_content)
-        words = [word for word in words if word not in stop_words]
-        word_count = len(words)
+        words = re.findall(r'\b[a-zA-Z]{2,}\b', text_content)
+        word_count = sum(1 for word in words if word not in KEYWORD_STOP_WORDS)
         
         if word_count == 0:
             return scores
         
-        # Score each topic based on keyword matches
-        for topic in topics:
-            topic_score = 0.0
-            keyword_matches = 0
-            
-            # Get keywords for this topic
-            keywords = TopicKeyword.query.filter_by(topic_id=topic.id).all()
+        # One pass over the text finds every keyword of every topic
+        topic_scores = defaultdict(float)
+        keyword_matches = defaultdict(int)
+        
+        if keyword_index is None:
+            keyword_index = get_keyword_index()
+        
+        for hit in keyword_index.find_hits(text_content):
+            entry = hit.entry
+            if entry.topic_id not in topic_ids:
+                continue
             
-            for keyword_obj in keywords:
-                keyword = keyword_obj.keyword.lower()
+            # Exact match
+            if hit.occurrences:
+                topic_scores[entry.topic_id] += entry.weight
+                keyword_matches[entry.topic_id] += 1
                 
-                # Exact match
-                if keyword in text_content:
-                    topic_score += keyword_obj.weight
-                    keyword_matches += 1
-                    
-                    # Bonus for multiple occurrences
-                    occurrences = text_content.count(keyword)
-                    if occurrences > 1:
-                        topic_score += (occurrences - 1) * keyword_obj.weight * 0.1
-                
-                # Partial match for compound keywords
-                if ' ' in keyword:
-                    keyword_words = keyword.split()
-                    if all(kw in text_content for kw in keyword_words):
-                        topic_score += keyword_obj.weight * 0.7
-                        keyword_matches += 1
+                # Bonus for multiple occurrences
+                if hit.occurrences > 1:
+                    topic_scores[entry.topic_id] += (hit.occurrences - 1) * entry.weight * 0.1
             
-            # Normalize score
-            if keyword_matches > 0:
-                # Factor in keyword density
-                keyword_density = keyword_matches / word_count
-                topic_score *= (1 + keyword_density)
-                
-                # Cap at 1.0
-                scores[topic.id] = min(topic_score / 10.0, 1.0)
+            # Partial match for compound keywords
+            if hit.all_parts_present:
+                topic_scores[entry.topic_id] += entry.weight * 0.7
+                keyword_matches[entry.topic_id] += 1
+        
+        # Normalize score
+        for topic_id, matches in keyword_matches.items():
+            # Factor in keyword density
+            keyword_density = matches / word_count
+            topic_score = topic_scores[topic_id] * (1 + keyword_density)
+            
+            # Cap at 1.0
+            scores[topic_id] = min(topic_score / 10.0, 1.0)
         
         return scores
     
-    def _classify_by_embeddings(self, email: EmailThread, topics: List[Topic]) -> Dict[int, float]:
-        """Classify email based on embedding similarity"""
-        scores = {}
-        
+    def _classify_by_embeddings(self, email: EmailThread, topics: List[Topic],
+                                centroids=None) -> Dict[int, float]:
+        """Classify email based on embedding similarity to topic centroids"""
         if not email.has_embedding or not email.embedding:
-            return scores
+            return {}
         
         try:
-            email_embedding = json.loads(email.embedding)
+            email_embedding = np.asarray(json.loads(email.embedding), dtype=np.float32)
         except json.JSONDecodeError:
-            return scores
-        
-        embeddings_service = get_embeddings_service()
+            return {}
         
-        # For each topic, find similar emails and calculate average similarity
-        for topic in topics:
-            topic_assignments = EmailTopic.query.filter_by(
-                topic_id=topic.id
-            ).join(EmailThread).filter(
-                EmailThread.has_embedding == True
-            ).limit(20).all()  # Limit for performance
-            
-            if not topic_assignments:
-                continue
-            
-            similarities = []
-            
-            for assignment in topic_assignments:
-                other_email = assignment.email
-                if other_email.embedding:
-                    try:
-                        other_embedding = json.loads(other_email.embedding)
-                        similarity = embeddings_service.calculate_similarity(
-                            email_embedding, other_embedding
-                        )
-                        similarities.append(similarity)
-                    except json.JSONDecodeError:
-                        continue
-            
-            if similarities:
-                # Use weighted average (higher confidence assignments get more weight)
-                weighted_sum = sum(
-                    sim * assignment.confidence_score
-                    for sim, assignment in zip(similarities, topic_assignments)
-                )
-                weight_sum = sum(assignment.confidence_score for assignment in topic_assignments)
-                
-                if weight_sum > 0:
-                    avg_similarity = weighted_sum / weight_sum
-                    scores[topic.id] = max(0.0, min(avg_similarity, 1.0))
-        
-        return scores
+        # One product against every topic centroid of the same embedding width
+        topic_ids = set(topic.id for topic in topics)
+        scores = score_against_centroids([email_embedding], centroids)[0]
+        return {topic_id: score for topic_id, score in scores.items() if topic_id in topic_ids}
     
     def _classify_by_context(self, email: EmailThread, topics: List[Topic]) -> Dict[int, float]:
         """Classify email based on contextual information"""
+        sender_affinity = get_sender_affinities(email.customer_id, [email.sender_email]).get(
+            email.sender_email, {}
+        )
+        own_assignments = get_email_assignments([email.id]).get(email.id, {})
+        
+        return self._score_context(
+            email, set(topic.id for topic in topics), sender_affinity, own_assignments
+        )
+    
+    def _score_context(self, email, topic_ids, sender_affinity, own_assignments) -> Dict[int, float]:
+        """Context scores from the sender's topic affinity and the email's own context.
+        
+        sender_affinity maps topic_id -> (assignment_count, confidence_sum) over all of the
+        sender's emails; the email's own assignments (topic_id -> confidence) are taken back
+        out so an email does not vote for itself.
+        """
         scores = {}
         
         # Context factors
@@ -224,72 +217,46 @@ class TopicClassifier:
             'time_context': self._get_time_context_score(email),
             'recipient_pattern': self._get_recipient_pattern_score(email)
         }
-        
-        # Get emails from same sender for pattern analysis
-        sender_emails = EmailThread.query.filter_by(
-            sender_email=email.sender_email,
-            customer_id=email.customer_id
-        ).filter(EmailThread.id != email.id).limit(10).all()
-        
-        # Analyze sender's topic patterns
-        sender_topic_patterns = defaultdict(list)
-        
-        for sender_email in sender_emails:
-            assignments = EmailTopic.query.filter_by(email_id=sender_email.id).all()
-            for assignment in assignments:
-                sender_topic_patterns[assignment.topic_id].append(assignment.confidence_score)
+        context_boost = sum(weight * 0.1 for weight in context_factors.values())  # Small contextual boost
         
         # Score topics based on sender patterns
-        for topic in topics:
-            topic_score = 0.0
+        for topic_id in topic_ids:
+            topic_score = context_boost
             
             # Sender topic affinity
-            if topic.id in sender_topic_patterns:
-                confidences = sender_topic_patterns[topic.id]
-                avg_confidence = sum(confidences) / len(confidences)
-                topic_score += avg_confidence * 0.5
-            
-            # Apply context factors
-            for factor, weight in context_factors.items():
-                topic_score += weight * 0.1  # Small contextual boost
+            count, confidence_sum = sender_affinity.get(topic_id, (0, 0.0))
+            if topic_id in own_assignments:
+                count -= 1
+                confidence_sum -= own_assignments[topic_id]
+            if count > 0:
+                topic_score += (confidence_sum / count) * 0.5
             
             if topic_score > 0:
-                scores[topic.id] = min(topic_score, 1.0)
+                scores[topic_id] = min(topic_score, 1.0)
         
         return scores
     
     def _classify_by_frequency(self, email: EmailThread, topics: List[Topic]) -> Dict[int, float]:
         """Classify email based on topic frequency patterns"""
+        # Assignment counts for the customer's emails of the last 30 days
+        topic_counts = get_recent_topic_counts(email.customer_id)
+        return self._score_frequency(topic_counts, set(topic.id for topic in topics))
+    
+    def _score_frequency(self, topic_counts, topic_ids) -> Dict[int, float]:
+        """Frequency scores from {topic_id: recent assignment count}"""
         scores = {}
         
-        # Get recent emails from same customer
-        recent_emails = EmailThread.query.filter_by(
-            customer_id=email.customer_id
-        ).filter(
-            EmailThread.date >= datetime.now().replace(month=datetime.now().month - 1)
-        ).limit(100).all()
-        
-        # Count topic frequencies
-        topic_frequencies = defaultdict(int)
-        total_assignments = 0
-        
-        for recent_email in recent_emails:
-            assignments = EmailTopic.query.filter_by(email_id=recent_email.id).all()
-            for assignment in assignments:
-                topic_frequencies[assignment.topic_id] += 1
-                total_assignments += 1
-        
+        total_assignments = sum(topic_counts.values())
         if total_assignments == 0:
             return scores
         
         # Score topics based on recent frequency
-        for topic in topics:
-            if topic.id in topic_frequencies:
-                frequency = topic_frequencies[topic.id]
+        for topic_id, frequency in topic_counts.items():
+            if topic_id in topic_ids and frequency:
                 frequency_score = frequency / total_assignments
                 
                 # Apply frequency boost (common topics get slight preference)
-                scores[topic.id] = min(frequency_score * 2.0, 0.5)  # Cap at 0.5
+                scores[topic_id] = min(frequency_score * 2.0, 0.5)  # Cap at 0.5
         
         return scores
     
@@ -378,29 +345,37 @@ class TopicClassifier:
         return 0.1
     
     def auto_classify_emails(self, customer_id: int, limit: int = 50, 
-                           force_reclassify: bool = False) -> Dict:
+                           force_reclassify: bool = False, algorithms: List[str] = None,
+                           chunk_size: int = 200, workers: int = 1,
+                           progress_callback=None, should_cancel=None,
+                           hierarchical: bool = False, level_thresholds=None) -> Dict:
         """
         Automatically classify multiple emails for a customer.
         
         Args:
             customer_id: Customer ID to classify emails for
-            limit: Maximum number of emails to process
+            limit: Maximum number of emails to process (None for no limit)
             force_reclassify: Whether to reclassify already classified emails
+            algorithms: Methods to use (defaults to all of them)
+            chunk_size: Number of emails scored and saved together
+            workers: Number of processes scoring chunks in parallel
+            progress_callback: Called as progress_callback(done, total, results) after each chunk
+            should_cancel: Checked between chunks; processing stops when it returns True
+            hierarchical: Score topics top-down, descending only into children of kept parents
+            level_thresholds: Minimum confidence per topic level for hierarchical scoring
+                (a list indexed by level or a {level: threshold} dict)
         
         Returns:
             Dict with classification results and statistics
         """
-        # Get unclassified emails (or all if force_reclassify)
-        query = EmailThread.query.filter_by(customer_id=customer_id)
-        
-        if not force_reclassify:
-            # Only get emails without topic assignments
-            classified_email_ids = db.session.query(EmailTopic.email_id).distinct().subquery()
-            query = query.filter(~EmailThread.id.in_(classified_email_ids))
+        from services.batch_classifier import BatchTopicClassifier
         
-        emails = query.order_by(desc(EmailThread.date)).limit(limit).all()
+        query = self._emails_to_classify(customer_id, force_reclassify).order_by(desc(EmailThread.date))
+        if limit:
+            query = query.limit(limit)
+        email_ids = [row[0] for row in query.all()]
         
-        if not emails:
+        if not email_ids:
             return {
                 'processed': 0,
                 'classified': 0,
@@ -408,158 +383,42 @@ class TopicClassifier:
                 'error': 'No emails found to classify'
             }
         
-        results = {
-            'processed': 0,
-            'classified': 0,
-            'skipped': 0,
-            'errors': [],
-            'classifications': []
-        }
-        
-        from services.topic_service import get_topic_service
-        topic_service = get_topic_service()
+        # Topics, keywords and exemplars are loaded once and emails are scored in chunks
+        batch_classifier = BatchTopicClassifier(classifier=self, chunk_size=chunk_size)
+        return batch_classifier.classify_emails(
+            customer_id, email_ids, methods=algorithms, workers=workers,
+            progress_callback=progress_callback, should_cancel=should_cancel,
+            hierarchical=hierarchical, level_thresholds=level_thresholds
+        )
+    
+    def count_emails_to_classify(self, customer_id: int, limit: int = 50,
+                                 force_reclassify: bool = False) -> int:
+        """Number of emails auto_classify_emails would process"""
+        count = self._emails_to_classify(customer_id, force_reclassify).count()
+        return min(count, limit) if limit else count
+    
+    def _emails_to_classify(self, customer_id: int, force_reclassify: bool):
+        """Query of the ids of unclassified emails (or all if force_reclassify)"""
+        query = db.session.query(EmailThread.id).filter(EmailThread.customer_id == customer_id)
         
-        # Process each email
-        for email in emails:
-            try:
-                # Classify the email
-                classification_result = self.classify_email(email.id)
-                
-                if 'error' in classification_result:
-                    results['errors'].append(f"Email {email.id}: {classification_result['error']}")
-                    results['skipped'] += 1
-                    continue
-                
-                # Assign confident topics
-                email_classifications = []
-                for topic_data in classification_result['classifications']:
-                    if topic_data['confidence_score'] >= self.min_confidence_threshold:
-                        # Create topic assignment
-                        topic_service.assign_topic_to_email(
-                            email_id=email.id,
-                            topic_id=topic_data['topic_id'],
-                            confidence_score=topic_data['confidence_score'],
-                            classification_method='auto_classification',
-                            assigned_by='system'
-                        )
-                        
-                        email_classifications.append({
-                            'topic_name': topic_data['topic_name'],
-                            'confidence': topic_data['confidence_score']
-                        })
-                
-                results['classifications'].append({
-                    'email_id': email.id,
-                    'subject': email.subject,
-                    'topics': email_classifications
-                })
-                
-                if email_classifications:
-                    results['classified'] += 1
-                else:
-                    results['skipped'] += 1
-                
-                results['processed'] += 1
-                
-            except Exception as e:
-                logger.error(f"Error classifying email {email.id}: {e}")
-                results['errors'].append(f"Email {email.id}: {str(e)}")
-                results['skipped'] += 1
+        if not force_reclassify:
+            # Only get emails without topic assignments; a correlated NOT EXISTS probes the
+            # email_topic index per email instead of materializing every classified id
+            query = query.filter(~exists().where(EmailTopic.email_id == EmailThread.id))
         
-        return results
+        return query
     
     def get_classification_analytics(self, customer_id: int = None) -> Dict:
         """Get analytics about topic classification performance"""
+        from services.classification_analytics import get_classification_analytics
         
-        query = EmailTopic.query
-        if customer_id:
-            query = query.join(EmailThread).filter(EmailThread.customer_id == customer_id)
-        
-        assignments = query.all()
-        
-        analytics = {
-            'total_assignments': len(assignments),
-            'method_breakdown': defaultdict(int),
-            'confidence_distribution': defaultdict(int),
-            'topic_usage': defaultdict(int),
-            'verification_stats': {
-                'verified': 0,
-                'unverified': 0,
-                'verification_rate': 0.0
-            }
-        }
-        
-        # Analyze assignments
-        for assignment in assignments:
-            # Method breakdown
-            analytics['method_breakdown'][assignment.classification_method or 'unknown'] += 1
-            
-            # Confidence distribution
-            confidence_bucket = int(assignment.confidence_score * 10) / 10
-            analytics['confidence_distribution'][confidence_bucket] += 1
-            
-            # Topic usage
-            topic_name = assignment.topic.name if assignment.topic else 'Unknown'
-            analytics['topic_usage'][topic_name] += 1
-            
-            # Verification stats
-            if assignment.is_verified:
-                analytics['verification_stats']['verified'] += 1
-            else:
-                analytics['verification_stats']['unverified'] += 1
-        
-        # Calculate verification rate
-        if analytics['total_assignments'] > 0:
-            analytics['verification_stats']['verification_rate'] = (
-                analytics['verification_stats']['verified'] / analytics['total_assignments']
-            )
-        
-        return analytics
+        return get_classification_analytics(customer_id)
     
     def suggest_new_topics(self, customer_id: int, min_cluster_size: int = 3) -> List[Dict]:
         """Suggest new topics based on unclassified email clusters"""
+        from services.topic_suggestions import suggest_topics
         
-        # Get unclassified emails
-        classified_email_ids = db.session.query(EmailTopic.email_id).distinct().subquery()
-        unclassified_emails = EmailThread.query.filter_by(
-            customer_id=customer_id
-        ).filter(
-            ~EmailThread.id.in_(classified_email_ids)
-        ).all()
-        
-        if len(unclassified_emails) < min_cluster_size:
-            return []
-        
-        # Simple keyword-based clustering
-        suggestions = []
-        
-        # Extract common keywords from subjects
-        subject_words = []
-        for email in unclassified_emails:
-            if email.subject:
-                words = re.findall(r'\\b[a-zA-Z]{3,}\\b', email.subject.lower())
-                subject_words.extend(words)
-        
-        # Find most common words
-        word_counts = Counter(subject_words)
-        common_words = [word for word, count in word_counts.most_common(20) if count >= min_cluster_size]
-        
-        # Create topic suggestions
-        for word in common_words:
-            related_emails = [
-                email for email in unclassified_emails
-                if email.subject and word in email.subject.lower()
-            ]
-            
-            if len(related_emails) >= min_cluster_size:
-                suggestions.append({
-                    'suggested_name': word.title(),
-                    'email_count': len(related_emails),
-                    'sample_subjects': [email.subject for email in related_emails[:3]],
-                    'confidence': min(len(related_emails) / 10.0, 1.0)
-                })
-        
-        return suggestions
+        return suggest_topics(customer_id, min_cluster_size=min_cluster_size)
 
 # Global instance
 _topic_classifier = None
@@ -0,0 +1,142 @@
+"""
+Topic hierarchy closure table.
+TopicClosure holds a row for every (ancestor, descendant) pair of the hierarchy, including each
+topic paired with itself at depth 0. It is kept in step with Topic.parent_id when topics are
+created, moved and deleted, in the same transaction, so ancestors, descendants, full paths and
+subtree email counts are each one query.
+"""
+
+import logging
+from collections import defaultdict
+
+from sqlalchemy import func, or_
+
+from models import db, EmailThread, EmailTopic, Topic, TopicClosure
+
+logger = logging.getLogger(__name__)
+
+
+def add_topic(topic_id, parent_id=None):
+    """Add a new leaf topic under parent_id (or as a root); the caller commits"""
+    rows = [{'ancestor_id': topic_id, 'descendant_id': topic_id, 'depth': 0}]
+    if parent_id is not None:
+        rows.extend(
+            {'ancestor_id': ancestor_id, 'descendant_id': topic_id, 'depth': depth + 1}
+            for ancestor_id, depth in db.session.query(
+                TopicClosure.ancestor_id, TopicClosure.depth
+            ).filter(TopicClosure.descendant_id == parent_id).all()
+        )
+    db.session.bulk_insert_mappings(TopicClosure, rows)
+
+
+def move_subtree(topic_id, new_parent_id):
+    """Re-link a topic and its subtree under new_parent_id (None for a root); the caller commits.
+
+    Raises ValueError if new_parent_id is the topic itself or one of its descendants.
+    """
+    subtree = dict(db.session.query(TopicClosure.descendant_id, TopicClosure.depth).filter(
+        TopicClosure.ancestor_id == topic_id
+    ).all())
+    subtree.setdefault(topic_id, 0)
+    if new_parent_id in subtree:
+        raise ValueError('Cannot move a topic under itself or one of its descendants')
+
+    # Drop the links from outside the subtree, keep those within it
+    TopicClosure.query.filter(
+        TopicClosure.descendant_id.in_(list(subtree)),
+        TopicClosure.ancestor_id.notin_(list(subtree))
+    ).delete(synchronize_session=False)
+
+    if new_parent_id is not None:
+        ancestors = db.session.query(TopicClosure.ancestor_id, TopicClosure.depth).filter(
+            TopicClosure.descendant_id == new_parent_id
+        ).all()
+        db.session.bulk_insert_mappings(TopicClosure, [
+            {
+                'ancestor_id': ancestor_id,
+                'descendant_id': descendant_id,
+                'depth': ancestor_depth + descendant_depth + 1
+            }
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, descendant_depth in subtree.items()
+        ])
+
+    return subtree
+
+
+def remove_topics(topic_ids):
+    """Drop the closure rows of deleted topics; the caller commits"""
+    topic_ids = list(topic_ids)
+    TopicClosure.query.filter(or_(
+        TopicClosure.ancestor_id.in_(topic_ids),
+        TopicClosure.descendant_id.in_(topic_ids)
+    )).delete(synchronize_session=False)
+
+
+def get_ancestor_ids(topic_id):
+    """Ids of a topic's ancestors, nearest first"""
+    return [ancestor_id for (ancestor_id,) in db.session.query(TopicClosure.ancestor_id).filter(
+        TopicClosure.descendant_id == topic_id, TopicClosure.depth > 0
+    ).order_by(TopicClosure.depth).all()]
+
+
+def get_descendant_ids(topic_id, include_self=False):
+    """Ids of a topic's descendants, shallowest first"""
+    query = db.session.query(TopicClosure.descendant_id).filter(TopicClosure.ancestor_id == topic_id)
+    if not include_self:
+        query = query.filter(TopicClosure.depth > 0)
+    return [descendant_id for (descendant_id,) in query.order_by(TopicClosure.depth).all()]
+
+
+def get_full_paths(topic_ids=None):
+    """Get topic_id -> 'Main > Sub > Micro' for the given topics (all when None) in one query"""
+    query = db.session.query(TopicClosure.descendant_id, Topic.name).join(
+        Topic, Topic.id == TopicClosure.ancestor_id
+    )
+    if topic_ids is not None:
+        query = query.filter(TopicClosure.descendant_id.in_(list(topic_ids)))
+
+    names = defaultdict(list)
+    for descendant_id, name in query.order_by(
+        TopicClosure.descendant_id, TopicClosure.depth.desc()
+    ).all():
+        names[descendant_id].append(name)
+    return {topic_id: ' > '.join(path) for topic_id, path in names.items()}
+
+
+def get_subtree_email_counts(topic_ids=None, customer_id=None):
+    """Get topic_id -> number of distinct emails assigned to the topic or any descendant"""
+    query = db.session.query(
+        TopicClosure.ancestor_id, func.count(func.distinct(EmailTopic.email_id))
+    ).join(EmailTopic, EmailTopic.topic_id == TopicClosure.descendant_id)
+
+    if topic_ids is not None:
+        query = query.filter(TopicClosure.ancestor_id.in_(list(topic_ids)))
+    if customer_id is not None:
+        query = query.join(EmailThread, EmailThread.id == EmailTopic.email_id).filter(
+            EmailThread.customer_id == customer_id
+        )
+
+    return dict(query.group_by(TopicClosure.ancestor_id).all())
+
+
+def rebuild_topic_closure():
+    """Recompute the whole closure table from Topic.parent_id and commit"""
+    parents = dict(db.session.query(Topic.id, Topic.parent_id).all())
+
+    rows = []
+    for topic_id in parents:
+        ancestor_id, depth = topic_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append({'ancestor_id': ancestor_id, 'descendant_id': topic_id, 'depth': depth})
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+
+    TopicClosure.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(TopicClosure, rows)
+    db.session.commit()
+
+    logger.info(f"Rebuilt topic closure: {len(rows)} rows for {len(parents)} topics")
+    return len(rows)
@@ -0,0 +1,191 @@
+"""
+Versioned, immutable topic model snapshot shared by the classifiers.
+A snapshot holds the topics with their parent links and customer associations, the compiled
+keyword automaton and the topic centroid matrices. It is built once and swapped atomically
+whenever the model version changes; every topic, keyword, customer association or merge change
+bumps the version in TopicModelState within the same transaction, so all worker processes pick
+the change up.
+"""
+
+import time
+import logging
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Topic, TopicKeyword, TopicModelState, customer_topic
+from services.keyword_automaton import TopicKeywordIndex
+from services.topic_centroids import get_centroid_matrices
+
+logger = logging.getLogger(__name__)
+
+TopicInfo = namedtuple('TopicInfo', ['id', 'name', 'parent_id', 'level', 'color', 'is_active'])
+
+
+class TopicModelSnapshot:
+    """Read-only view of the topic model at one version"""
+
+    def __init__(self, version, topics, keyword_index, centroids, customer_topics=None):
+        self.version = version
+        self.topics = MappingProxyType(topics)  # topic_id -> TopicInfo (active and inactive)
+        self.active_topics = tuple(topic for topic in topics.values() if topic.is_active)
+        self.active_topic_ids = frozenset(topic.id for topic in self.active_topics)
+        self.keyword_index = keyword_index  # Keywords of active topics only
+        self.centroids = centroids  # embedding width -> (topic_ids, centroid matrix)
+        self.built_at = time.monotonic()
+
+        # customer_id -> ids of the topics associated with the customer; topics associated
+        # with no customer are global and belong to every customer's candidate set
+        self.customer_topics = MappingProxyType({
+            customer_id: frozenset(topic_ids)
+            for customer_id, topic_ids in (customer_topics or {}).items()
+        })
+        associated = frozenset().union(*self.customer_topics.values())
+        self.global_topic_ids = frozenset(topic_id for topic_id in topics if topic_id not in associated)
+        self._candidates = {}  # customer_id -> candidate topics, filled on first use
+
+        children = {}
+        for topic in topics.values():
+            children.setdefault(topic.parent_id, []).append(topic.id)
+        self.children = MappingProxyType({
+            parent_id: tuple(child_ids) for parent_id, child_ids in children.items()
+        })
+
+    def __repr__(self):
+        return f'<TopicModelSnapshot v{self.version} topics:{len(self.topics)} keywords:{len(self.keyword_index)}>'
+
+    def topic_name(self, topic_id):
+        topic = self.topics.get(topic_id)
+        return topic.name if topic else None
+
+    def customer_topic_ids(self, customer_id):
+        """Ids of a customer's own and the global topics, active or not (all for None)"""
+        if customer_id is None:
+            return frozenset(self.topics)
+        return self.customer_topics.get(customer_id, frozenset()) | self.global_topic_ids
+
+    def candidate_topics(self, customer_id):
+        """Active topics a customer's emails are classified against, cached per customer"""
+        candidates = self._candidates.get(customer_id)
+        if candidates is None:
+            topic_ids = self.customer_topic_ids(customer_id)
+            candidates = tuple(topic for topic in self.active_topics if topic.id in topic_ids)
+            self._candidates[customer_id] = candidates
+        return candidates
+
+    def ancestor_ids(self, topic_id):
+        """Ids of a topic's ancestors, nearest first"""
+        ancestors = []
+        topic = self.topics.get(topic_id)
+        while topic is not None and topic.parent_id is not None and topic.parent_id not in ancestors:
+            ancestors.append(topic.parent_id)
+            topic = self.topics.get(topic.parent_id)
+        return ancestors
+
+    def with_centroids(self, centroids):
+        """Same model version with refreshed centroid matrices"""
+        snapshot = TopicModelSnapshot.__new__(TopicModelSnapshot)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.centroids = centroids
+        return snapshot
+
+
+def build_topic_model_snapshot(version=None):
+    """Load topics, keywords and centroids from the database into a new snapshot"""
+    if version is None:
+        version = get_model_version()
+
+    topics = {
+        row.id: TopicInfo(row.id, row.name, row.parent_id, row.level or 0, row.color, bool(row.is_active))
+        for row in db.session.query(
+            Topic.id, Topic.name, Topic.parent_id, Topic.level, Topic.color, Topic.is_active
+        ).all()
+    }
+
+    keyword_rows = db.session.query(
+        TopicKeyword.id, TopicKeyword.topic_id, TopicKeyword.keyword, TopicKeyword.weight
+    ).join(Topic, Topic.id == TopicKeyword.topic_id).filter(Topic.is_active == True).all()
+
+    customer_topics = {}
+    for customer_id, topic_id in db.session.query(
+        customer_topic.c.customer_id, customer_topic.c.topic_id
+    ).all():
+        customer_topics.setdefault(customer_id, set()).add(topic_id)
+
+    snapshot = TopicModelSnapshot(
+        version=version,
+        topics=topics,
+        keyword_index=TopicKeywordIndex(keyword_rows),
+        centroids=get_centroid_matrices(),
+        customer_topics=customer_topics
+    )
+    logger.info(f"Built topic model snapshot v{version}: {len(topics)} topics, {len(snapshot.keyword_index)} keywords")
+    return snapshot
+
+
+def get_model_version():
+    """Current topic model version as committed in the database"""
+    return db.session.query(TopicModelState.version).filter(TopicModelState.id == 1).scalar() or 1
+
+
+def bump_model_version():
+    """Move the topic model to a new version; the caller commits.
+
+    Call alongside any change to topics, keywords or the hierarchy. This process drops its
+    snapshot as soon as the transaction commits, other processes notice within
+    _version_check_interval seconds.
+    """
+    updated = TopicModelState.query.filter(TopicModelState.id == 1).update(
+        {'version': TopicModelState.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(TopicModelState(id=1, version=2))
+
+    # Dropping the snapshot before the commit would let another thread rebuild it from the
+    # old committed version and keep that for a whole check interval
+    db.session.info['topic_model_bumped'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_snapshot_after_commit(session):
+    """Mark this process's snapshot stale once a version bump is committed"""
+    global _stale
+    if session.info.pop('topic_model_bumped', False):
+        _stale = True
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_bump(session):
+    session.info.pop('topic_model_bumped', None)
+
+
+# Process-wide snapshot; replaced (never mutated) when the version changes
+_snapshot_lock = Lock()
+_snapshot = None
+_stale = True
+_version_checked_at = 0.0
+_version_check_interval = 5
+
+
+def get_topic_model_snapshot():
+    """Get the shared snapshot, rebuilding it if the model version has moved on"""
+    global _snapshot, _stale, _version_checked_at
+
+    with _snapshot_lock:
+        now = time.monotonic()
+        if _snapshot is None or _stale or now - _version_checked_at >= _version_check_interval:
+            _stale = False
+            _version_checked_at = now
+            version = get_model_version()
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = build_topic_model_snapshot(version)
+
+        # Centroids move with every assignment rather than with the model version
+        centroids = get_centroid_matrices()
+        if centroids is not _snapshot.centroids:
+            _snapshot = _snapshot.with_centroids(centroids)
+
+        return _snapshot
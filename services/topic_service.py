@@ -8,7 +8,8 @@ import re
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
-from sqlalchemy import and_, or_, func, desc
+from sqlalchemy import and_, or_, func, desc, case, exists, literal, select
+from sqlalchemy.orm import aliased
 from models import (
     db,
     Topic,
@@ -19,9 +20,23 @@ from models import (
     Customer,
     customer_topic,
 )
+from services.topic_model import bump_model_version, get_topic_model_snapshot
+from services import (
+    classification_analytics,
+    topic_aggregates,
+    topic_centroids,
+    topic_closure,
+    topic_similarity,
+)
+from services.cache import TTLCache
+from services.upsert import upsert_rows
 
 logger = logging.getLogger(__name__)
 
+# (customer_id, include_inactive, model version) -> serialized topic hierarchy; the
+# customer email counts in it are invalidated on assignment changes
+_hierarchy_cache = TTLCache(ttl=300)
+
 
 class TopicService:
     """Service for managing topic hierarchy and classification"""
@@ -40,8 +55,13 @@ class TopicService:
         color=None,
         created_by=None,
         keywords=None,
+        customer_id=None,
     ):
-        """Create a new topic in the hierarchy"""
+        """Create a new topic in the hierarchy.
+
+        With customer_id the topic is associated with that customer; without it the topic is
+        global and becomes a candidate for every customer.
+        """
 
         # Auto-determine level if not provided
         if level is None:
@@ -55,18 +75,7 @@ class TopicService:
                     level = 0
 
         # Validate level limits
-        if level == 0 and self.get_topic_count(level=0) >= self.max_main_topics:
-            raise ValueError(
-                "Maximum main topics ({}) reached".format(self.max_main_topics)
-            )
-        elif level == 1 and self.get_topic_count(level=1) >= self.max_sub_topics:
-            raise ValueError(
-                "Maximum sub topics ({}) reached".format(self.max_sub_topics)
-            )
-        elif level == 2 and self.get_topic_count(level=2) >= self.max_micro_topics:
-            raise ValueError(
-                "Maximum micro topics ({}) reached".format(self.max_micro_topics)
-            )
+        self._check_level_limits({level: 1})
 
         # Create topic
         topic = Topic(
@@ -81,52 +90,185 @@ class TopicService:
 
         db.session.add(topic)
         db.session.flush()  # Get the ID
+        topic_closure.add_topic(topic.id, parent_id)
+        if customer_id is not None:
+            db.session.execute(
+                customer_topic.insert().values(customer_id=customer_id, topic_id=topic.id)
+            )
 
         # Add keywords if provided
         if keywords:
             for keyword in keywords:
                 self.add_keyword_to_topic(topic.id, keyword, created_by=created_by)
 
+        bump_model_version()
         db.session.commit()
         logger.info(f"Created topic: {name} (Level {level})")
         return topic
 
+    def move_topic(self, topic_id: int, new_parent_id: int = None) -> Optional[Topic]:
+        """Move a topic and its subtree under a new parent (None for a main topic)"""
+
+        topic = Topic.query.get(topic_id)
+        if not topic:
+            return None
+
+        parent = None
+        if new_parent_id is not None:
+            parent = Topic.query.get(new_parent_id)
+            if not parent:
+                raise ValueError("Parent topic {} not found".format(new_parent_id))
+
+        self._check_move_limits(topic, parent)
+        self._move_subtree(topic, parent)
+        bump_model_version()
+        db.session.commit()
+
+        logger.info(f"Moved topic {topic_id} under {new_parent_id}")
+        return topic
+
+    def _check_level_limits(self, added: Dict[int, int]) -> None:
+        """Raise ValueError if adding {level: topic count} active topics exceeds a level's limit"""
+
+        limits = {
+            0: ("main", self.max_main_topics),
+            1: ("sub", self.max_sub_topics),
+            2: ("micro", self.max_micro_topics),
+        }
+        for level, count in added.items():
+            if level not in limits or not count:
+                continue
+            name, limit = limits[level]
+            if self.get_topic_count(level=level) + count > limit:
+                raise ValueError("Maximum {} topics ({}) reached".format(name, limit))
+
+    def _check_move_limits(self, topic: Topic, parent: Optional[Topic]) -> None:
+        """Check the level limits for the active topics a move shifts to another level"""
+
+        subtree_ids = set(topic_closure.get_descendant_ids(topic.id, include_self=True))
+        subtree_ids.add(topic.id)
+        if parent is not None and parent.id in subtree_ids:
+            return  # Rejected by topic_closure.move_subtree
+
+        new_level = (parent.level or 0) + 1 if parent else 0
+        level_delta = new_level - (topic.level or 0)
+        if not level_delta:
+            return
+
+        moved = db.session.query(Topic.level, func.count(Topic.id)).filter(
+            Topic.id.in_(list(subtree_ids)), Topic.is_active == True
+        ).group_by(Topic.level)
+        self._check_level_limits(
+            {(level or 0) + level_delta: count for level, count in moved.all()}
+        )
+
+    def _move_subtree(self, topic: Topic, parent: Optional[Topic]) -> None:
+        """Re-link a topic under parent and shift its subtree's levels; no commit"""
+
+        new_parent_id = parent.id if parent else None
+        subtree = topic_closure.move_subtree(topic.id, new_parent_id)
+
+        # The whole subtree shifts by the same number of levels
+        new_level = (parent.level or 0) + 1 if parent else 0
+        level_delta = new_level - (topic.level or 0)
+        if level_delta:
+            Topic.query.filter(Topic.id.in_(list(subtree))).update(
+                {"level": Topic.level + level_delta}, synchronize_session=False
+            )
+
+        topic.parent_id = new_parent_id
+        topic.updated_at = datetime.utcnow()
+
     def get_topic_hierarchy(
         self, customer_id: int = None, include_inactive: bool = False
     ) -> List[Dict]:
-        """Get the complete topic hierarchy for a customer"""
+        """Get the complete topic hierarchy for a customer.
 
-        query = Topic.query
+        Topics and the customer's email counts are read in two queries and the
+        tree is assembled in memory. The result is cached per customer and topic
+        model version and is shared between callers, so treat it as read-only.
+        """
+
+        cache_key = (
+            customer_id,
+            include_inactive,
+            get_topic_model_snapshot().version,
+        )
+        hierarchy = _hierarchy_cache.get(cache_key)
+        if hierarchy is not None:
+            return hierarchy
+
+        query = db.session.query(
+            Topic.id,
+            Topic.name,
+            Topic.description,
+            Topic.parent_id,
+            Topic.level,
+            Topic.color,
+            Topic.email_count,
+            Topic.is_active,
+            Topic.auto_generated,
+            Topic.confidence_score,
+            Topic.created_at,
+            Topic.updated_at,
+        )
 
         if not include_inactive:
             query = query.filter(Topic.is_active == True)
 
+        customer_counts = None
         if customer_id:
-            # Filter by customer association
-            query = query.join(customer_topic).filter(
-                customer_topic.c.customer_id == customer_id
+            # The customer's own and the global topics
+            query = query.filter(
+                Topic.id.in_(
+                    get_topic_model_snapshot().customer_topic_ids(customer_id)
+                )
+            )
+            customer_counts = dict(
+                db.session.query(EmailTopic.topic_id, func.count(EmailTopic.id))
+                .join(EmailThread, EmailThread.id == EmailTopic.email_id)
+                .filter(EmailThread.customer_id == customer_id)
+                .group_by(EmailTopic.topic_id)
+                .all()
             )
 
         # Get all topics ordered by level and name
-        topics = query.order_by(Topic.level, Topic.name).all()
+        rows = query.order_by(Topic.level, Topic.name).all()
 
         # Build hierarchy
         hierarchy = []
         topic_map = {}
 
-        for topic in topics:
-            topic_dict = topic.to_dict()
-            topic_map[topic.id] = topic_dict
+        for row in rows:
+            parent = topic_map.get(row.parent_id)
+            topic_dict = {
+                "id": row.id,
+                "name": row.name,
+                "description": row.description,
+                "level": row.level,
+                "color": row.color,
+                "email_count": row.email_count,
+                "is_active": row.is_active,
+                "auto_generated": row.auto_generated,
+                "confidence_score": row.confidence_score,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                "parent_id": row.parent_id,
+                "full_path": (
+                    parent["full_path"] + " > " + row.name if parent else row.name
+                ),
+                "children": [],
+            }
+            if customer_counts is not None:
+                topic_dict["customer_email_count"] = customer_counts.get(row.id, 0)
+            topic_map[row.id] = topic_dict
 
-            if topic.parent_id is None:
+            if row.parent_id is None:
                 hierarchy.append(topic_dict)
-            else:
-                parent = topic_map.get(topic.parent_id)
-                if parent:
-                    if "children" not in parent:
-                        parent["children"] = []
-                    parent["children"].append(topic_dict)
+            elif parent:
+                parent["children"].append(topic_dict)
 
+        _hierarchy_cache.set(cache_key, hierarchy)
         return hierarchy
 
     def get_topics_by_level(
@@ -140,12 +282,28 @@ class TopicService:
             query = query.filter(Topic.parent_id == parent_id)
 
         if customer_id:
-            query = query.join(customer_topic).filter(
-                customer_topic.c.customer_id == customer_id
+            query = query.filter(
+                Topic.id.in_(
+                    get_topic_model_snapshot().customer_topic_ids(customer_id)
+                )
             )
 
         return query.order_by(Topic.name).all()
 
+    def get_topic_level_counts(self, customer_id: int = None) -> Dict[int, int]:
+        """Get level -> number of active topics, from the customer's candidate set"""
+
+        snapshot = get_topic_model_snapshot()
+        if customer_id:
+            topics = snapshot.candidate_topics(customer_id)
+        else:
+            topics = snapshot.active_topics
+
+        counts = {0: 0, 1: 0, 2: 0}
+        for topic in topics:
+            counts[topic.level] = counts.get(topic.level, 0) + 1
+        return counts
+
     def get_topic_count(self, level: int = None, parent_id: int = None) -> int:
         """Get count of topics at a specific level or under a parent"""
 
@@ -166,19 +324,30 @@ class TopicService:
         confidence_score: float = 1.0,
         classification_method: str = "manual",
         assigned_by: str = None,
+        model_version: int = None,
     ) -> EmailTopic:
         """Assign a topic to an email with confidence scoring"""
 
+        if model_version is None:
+            model_version = get_topic_model_snapshot().version
+
         # Check if assignment already exists
         existing = EmailTopic.query.filter_by(
             email_id=email_id, topic_id=topic_id
         ).first()
         if existing:
             # Update existing assignment
+            self._record_membership_changes(
+                [(email_id, topic_id, existing.confidence_score, confidence_score)]
+            )
             existing.confidence_score = confidence_score
             existing.classification_method = classification_method
+            existing.model_version = model_version
             existing.assigned_by = assigned_by
             existing.assigned_at = datetime.utcnow()
+            Topic.query.filter(Topic.id == topic_id).update(
+                {"last_used": existing.assigned_at}, synchronize_session=False
+            )
             db.session.commit()
             return existing
 
@@ -188,16 +357,19 @@ class TopicService:
             topic_id=topic_id,
             confidence_score=confidence_score,
             classification_method=classification_method,
+            model_version=model_version,
             assigned_by=assigned_by,
+            assigned_at=datetime.utcnow(),
         )
 
         db.session.add(assignment)
+        self._record_membership_changes([(email_id, topic_id, None, confidence_score)])
 
         # Update topic email count
         topic = Topic.query.get(topic_id)
         if topic:
-            topic.email_count = Topic.query.get(topic_id).email_assignments.count() + 1
-            topic.last_used = datetime.utcnow()
+            topic.email_count = (topic.email_count or 0) + 1
+            topic.last_used = assignment.assigned_at
 
         db.session.commit()
         logger.info(
@@ -205,6 +377,114 @@ class TopicService:
         )
         return assignment
 
+    def bulk_assign(
+        self,
+        assignments,
+        assigned_by: str = None,
+        model_version: int = None,
+        chunk_size: int = 100,
+        embeddings: Dict = None,
+    ) -> Dict[str, int]:
+        """Assign many topics at once.
+
+        assignments is an iterable of (email_id, topic_id, confidence, method)
+        tuples. Each chunk is written with one INSERT ... ON CONFLICT DO UPDATE and
+        one grouped UPDATE of Topic.email_count, then committed. embeddings
+        (email_id -> vector) saves reloading them for the topic centroid update.
+        """
+        if model_version is None:
+            model_version = get_topic_model_snapshot().version
+
+        # Later tuples for the same email and topic win
+        pending = {}
+        for email_id, topic_id, confidence, method in assignments:
+            pending[(email_id, topic_id)] = (confidence, method)
+        pending = list(pending.items())
+
+        totals = {"inserted": 0, "updated": 0}
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start : start + chunk_size]
+            counts = self._bulk_assign_chunk(
+                chunk, assigned_by, model_version, embeddings
+            )
+            db.session.commit()
+            totals["inserted"] += counts["inserted"]
+            totals["updated"] += counts["updated"]
+
+        if totals["inserted"] or totals["updated"]:
+            logger.info(
+                f"Bulk assigned {totals['inserted']} new and "
+                f"{totals['updated']} updated topic assignments"
+            )
+        return totals
+
+    def _bulk_assign_chunk(self, chunk, assigned_by, model_version, embeddings):
+        """Upsert one chunk of ((email_id, topic_id), (confidence, method)) items"""
+        now = datetime.utcnow()
+        email_ids = set(email_id for (email_id, _), _ in chunk)
+        existing = {
+            (email_id, topic_id): confidence
+            for email_id, topic_id, confidence in db.session.query(
+                EmailTopic.email_id, EmailTopic.topic_id, EmailTopic.confidence_score
+            )
+            .filter(EmailTopic.email_id.in_(email_ids))
+            .all()
+        }
+
+        rows = []
+        membership_changes = []
+        new_per_topic = {}
+        for (email_id, topic_id), (confidence, method) in chunk:
+            rows.append(
+                {
+                    "email_id": email_id,
+                    "topic_id": topic_id,
+                    "confidence_score": confidence,
+                    "classification_method": method,
+                    "model_version": model_version,
+                    "assigned_by": assigned_by,
+                    "assigned_at": now,
+                    "is_verified": False,
+                }
+            )
+            if (email_id, topic_id) in existing:
+                old_confidence = existing[(email_id, topic_id)]
+            else:
+                old_confidence = None
+                new_per_topic[topic_id] = new_per_topic.get(topic_id, 0) + 1
+            membership_changes.append((email_id, topic_id, old_confidence, confidence))
+
+        upsert_rows(
+            EmailTopic,
+            rows,
+            index_elements=["email_id", "topic_id"],
+            update_columns=[
+                "confidence_score",
+                "classification_method",
+                "model_version",
+                "assigned_by",
+                "assigned_at",
+            ],
+        )
+
+        # One grouped UPDATE of the counts (as deltas) instead of a COUNT per topic
+        touched_topic_ids = set(topic_id for (_, topic_id), _ in chunk)
+        values = {"last_used": now}
+        if new_per_topic:
+            values["email_count"] = func.coalesce(Topic.email_count, 0) + case(
+                new_per_topic, value=Topic.id, else_=0
+            )
+        Topic.query.filter(Topic.id.in_(touched_topic_ids)).update(
+            values, synchronize_session=False
+        )
+
+        self._record_membership_changes(membership_changes, embeddings=embeddings)
+
+        return {
+            "inserted": sum(new_per_topic.values()),
+            "updated": len(chunk) - sum(new_per_topic.values()),
+        }
+
     def remove_topic_from_email(self, email_id: int, topic_id: int) -> bool:
         """Remove a topic assignment from an email"""
 
@@ -213,11 +493,14 @@ class TopicService:
         ).first()
         if assignment:
             db.session.delete(assignment)
+            self._record_membership_changes(
+                [(email_id, topic_id, assignment.confidence_score, None)]
+            )
 
             # Update topic email count
             topic = Topic.query.get(topic_id)
             if topic:
-                topic.email_count = max(0, topic.email_count - 1)
+                topic.email_count = max(0, (topic.email_count or 0) - 1)
 
             db.session.commit()
             logger.info(f"Removed topic {topic_id} from email {email_id}")
@@ -225,6 +508,13 @@ class TopicService:
 
         return False
 
+    def _record_membership_changes(self, changes, embeddings: Dict = None) -> None:
+        """Keep topic centroids, aggregates and cached hierarchies in step"""
+        topic_centroids.record_assignment_changes(changes, embeddings=embeddings)
+        customer_ids = topic_aggregates.record_assignment_changes(changes)
+        classification_analytics.invalidate_classification_analytics(customer_ids)
+        _hierarchy_cache.invalidate()
+
     def get_email_topics(self, email_id: int) -> List[Dict]:
         """Get all topics assigned to an email"""
 
@@ -264,24 +554,24 @@ class TopicService:
         )
         text_content = text_content.lower()
 
-        # Get all active topics with keywords
-        topics_with_keywords = (
-            db.session.query(Topic, TopicKeyword)
-            .join(TopicKeyword)
-            .filter(Topic.is_active == True)
-            .all()
-        )
-
-        # Score each topic
+        # Match every active topic keyword in a single pass over the text
         topic_scores = {}
-        for topic, keyword in topics_with_keywords:
-            if topic.id not in topic_scores:
-                topic_scores[topic.id] = {"topic": topic, "score": 0.0, "matches": []}
-
-            # Simple keyword matching
-            if keyword.keyword.lower() in text_content:
-                topic_scores[topic.id]["score"] += keyword.weight
-                topic_scores[topic.id]["matches"].append(keyword.keyword)
+        snapshot = get_topic_model_snapshot()
+        candidate_ids = snapshot.customer_topic_ids(email.customer_id)
+        for hit in snapshot.keyword_index.find_hits(text_content):
+            if not hit.occurrences or hit.entry.topic_id not in candidate_ids:
+                continue
+
+            topic_id = hit.entry.topic_id
+            if topic_id not in topic_scores:
+                topic_scores[topic_id] = {
+                    "topic_id": topic_id,
+                    "score": 0.0,
+                    "matches": [],
+                }
+
+            topic_scores[topic_id]["score"] += hit.entry.weight
+            topic_scores[topic_id]["matches"].append(hit.entry.keyword)
 
         # Create assignments for topics with scores above threshold
         assignments = []
@@ -293,10 +583,11 @@ class TopicService:
 
                 assignment = self.assign_topic_to_email(
                     email_id=email_id,
-                    topic_id=topic_data["topic"].id,
+                    topic_id=topic_data["topic_id"],
                     confidence_score=confidence,
                     classification_method="keyword",
                     assigned_by="system",
+                    model_version=snapshot.version,
                 )
                 assignments.append(assignment)
 
@@ -362,6 +653,7 @@ class TopicService:
         ).first()
         if existing:
             existing.weight = weight
+            bump_model_version()
             db.session.commit()
             return existing
 
@@ -371,6 +663,7 @@ class TopicService:
         )
 
         db.session.add(topic_keyword)
+        bump_model_version()
         db.session.commit()
 
         logger.info(f"Added keyword '{keyword}' to topic {topic_id}")
@@ -384,6 +677,7 @@ class TopicService:
         ).first()
         if topic_keyword:
             db.session.delete(topic_keyword)
+            bump_model_version()
             db.session.commit()
             logger.info(f"Removed keyword '{keyword}' from topic {topic_id}")
             return True
@@ -436,72 +730,168 @@ class TopicService:
 
     def get_similar_topics(self, topic_id: int, threshold: float = 0.3) -> List[Dict]:
         """Get topics similar to the given topic"""
-
-        similarities = (
-            TopicSimilarity.query.filter(
-                or_(
-                    TopicSimilarity.topic1_id == topic_id,
-                    TopicSimilarity.topic2_id == topic_id,
-                ),
-                TopicSimilarity.similarity_score >= threshold,
-            )
-            .order_by(desc(TopicSimilarity.similarity_score))
-            .all()
-        )
-
-        results = []
-        for sim in similarities:
-            other_topic_id = (
-                sim.topic2_id if sim.topic1_id == topic_id else sim.topic1_id
-            )
-            other_topic = Topic.query.get(other_topic_id)
-
-            if other_topic:
-                results.append(
-                    {
-                        "topic": other_topic.to_dict(),
-                        "similarity_score": sim.similarity_score,
-                        "calculation_method": sim.calculation_method,
-                    }
-                )
-
-        return results
+        return topic_similarity.get_similar_topics(topic_id, threshold)
 
     def merge_topics(
         self, source_topic_id: int, target_topic_id: int, merged_by: str = None
     ) -> bool:
-        """Merge one topic into another"""
+        """Merge one topic into another in a single transaction.
+
+        Emails assigned to both topics keep one assignment with the higher
+        confidence, and keywords present in both keep the higher weight. The
+        source's children move under the target and the source is deactivated.
+        Every step is a set-based statement, so the cost does not grow with one
+        query per assignment.
+        """
 
         source_topic = Topic.query.get(source_topic_id)
         target_topic = Topic.query.get(target_topic_id)
 
         if not source_topic or not target_topic:
             return False
+        if source_topic_id == target_topic_id:
+            raise ValueError("Cannot merge a topic into itself")
+        if target_topic_id in topic_closure.get_descendant_ids(source_topic_id):
+            raise ValueError("Cannot merge a topic into one of its descendants")
+
+        source_rows = aliased(EmailTopic)
+        target_rows = aliased(EmailTopic)
+
+        # Emails assigned to both topics; the target's assignment is kept
+        conflicts = (
+            db.session.query(func.count(target_rows.id))
+            .join(
+                source_rows,
+                and_(
+                    source_rows.email_id == target_rows.email_id,
+                    source_rows.topic_id == source_topic_id,
+                ),
+            )
+            .filter(target_rows.topic_id == target_topic_id)
+            .scalar()
+        )
+
+        # Centroids read the shared emails' embeddings, so they merge before the assignments
+        topic_centroids.merge_centroids(source_topic_id, target_topic_id)
 
-        # Move all email assignments
-        EmailTopic.query.filter_by(topic_id=source_topic_id).update(
-            {"topic_id": target_topic_id}
+        if conflicts:
+            # Correlated on the target row's email_id
+            same_email = and_(
+                source_rows.topic_id == source_topic_id,
+                source_rows.email_id == EmailTopic.email_id,
+            )
+            source_confidence = (
+                select(source_rows.confidence_score).where(same_email).scalar_subquery()
+            )
+            EmailTopic.query.filter(
+                EmailTopic.topic_id == target_topic_id,
+                source_confidence > func.coalesce(EmailTopic.confidence_score, 0.0),
+            ).update({"confidence_score": source_confidence}, synchronize_session=False)
+            EmailTopic.query.filter(
+                EmailTopic.topic_id == target_topic_id,
+                exists().where(same_email, source_rows.is_verified == True),
+            ).update({"is_verified": True}, synchronize_session=False)
+
+            EmailTopic.query.filter(
+                EmailTopic.topic_id == source_topic_id,
+                EmailTopic.email_id.in_(
+                    db.session.query(target_rows.email_id).filter(
+                        target_rows.topic_id == target_topic_id
+                    )
+                ),
+            ).delete(synchronize_session=False)
+
+        # Move the remaining email assignments
+        moved = EmailTopic.query.filter(EmailTopic.topic_id == source_topic_id).update(
+            {"topic_id": target_topic_id}, synchronize_session=False
         )
 
-        # Move all keywords
-        TopicKeyword.query.filter_by(topic_id=source_topic_id).update(
-            {"topic_id": target_topic_id}
+        # Recomputed in SQL from the merged assignments
+        topic_aggregates.merge_topic_aggregates(source_topic_id, target_topic_id)
+
+        self._merge_keywords(source_topic_id, target_topic_id)
+
+        # Children of the source move under the target
+        for child in Topic.query.filter(Topic.parent_id == source_topic_id).all():
+            self._move_subtree(child, target_topic)
+
+        # Customers of the source get the target
+        db.session.execute(
+            customer_topic.insert().from_select(
+                ["customer_id", "topic_id"],
+                db.session.query(
+                    customer_topic.c.customer_id, literal(target_topic_id)
+                ).filter(
+                    customer_topic.c.topic_id == source_topic_id,
+                    customer_topic.c.customer_id.notin_(
+                        db.session.query(customer_topic.c.customer_id).filter(
+                            customer_topic.c.topic_id == target_topic_id
+                        )
+                    ),
+                ),
+            )
         )
 
-        # Update target topic email count
-        target_topic.email_count = EmailTopic.query.filter_by(
-            topic_id=target_topic_id
-        ).count()
+        TopicSimilarity.query.filter(
+            or_(
+                TopicSimilarity.topic1_id == source_topic_id,
+                TopicSimilarity.topic2_id == source_topic_id,
+            )
+        ).delete(synchronize_session=False)
+
+        # Move the email counts along with the assignments
+        target_topic.email_count = (target_topic.email_count or 0) + moved
+        last_used = [
+            used for used in (target_topic.last_used, source_topic.last_used) if used
+        ]
+        if last_used:
+            target_topic.last_used = max(last_used)
+        target_topic.updated_at = datetime.utcnow()
 
         # Deactivate source topic
+        source_topic.email_count = 0
         source_topic.is_active = False
         source_topic.updated_at = datetime.utcnow()
 
+        bump_model_version()
         db.session.commit()
+        topic_similarity.invalidate_similar_topics()
+        classification_analytics.invalidate_classification_analytics()
+        _hierarchy_cache.invalidate()
 
-        logger.info(f"Merged topic {source_topic_id} into {target_topic_id}")
+        logger.info(
+            f"Merged topic {source_topic_id} into {target_topic_id} "
+            f"({moved} assignments moved, {conflicts} duplicates resolved)"
+        )
         return True
 
+    def _merge_keywords(self, source_topic_id: int, target_topic_id: int) -> None:
+        """Move a topic's keywords to another; duplicates keep the higher weight"""
+
+        target_keywords = {
+            keyword.keyword: keyword
+            for keyword in TopicKeyword.query.filter_by(topic_id=target_topic_id).all()
+        }
+
+        for keyword in TopicKeyword.query.filter_by(topic_id=source_topic_id).all():
+            existing = target_keywords.get(keyword.keyword)
+            if existing is None:
+                keyword.topic_id = target_topic_id
+                continue
+
+            existing.weight = max(existing.weight or 0.0, keyword.weight or 0.0)
+            existing.match_count = (existing.match_count or 0) + (
+                keyword.match_count or 0
+            )
+            last_matched = [
+                matched
+                for matched in (existing.last_matched, keyword.last_matched)
+                if matched
+            ]
+            if last_matched:
+                existing.last_matched = max(last_matched)
+            db.session.delete(keyword)
+
     def delete_topic(self, topic_id: int, force: bool = False) -> bool:
         """Delete a topic and its relationships"""
 
@@ -518,6 +908,9 @@ class TopicService:
         # Delete all relationships
         EmailTopic.query.filter_by(topic_id=topic_id).delete()
         TopicKeyword.query.filter_by(topic_id=topic_id).delete()
+        topic_centroids.delete_centroids([topic_id])
+        topic_aggregates.delete_topic_aggregates([topic_id])
+        topic_closure.remove_topics([topic_id])
         TopicSimilarity.query.filter(
             or_(
                 TopicSimilarity.topic1_id == topic_id,
@@ -532,37 +925,62 @@ class TopicService:
 
         # Delete topic
         db.session.delete(topic)
+        bump_model_version()
         db.session.commit()
+        topic_similarity.invalidate_similar_topics()
+        classification_analytics.invalidate_classification_analytics()
 
         logger.info(f"Deleted topic {topic_id}")
         return True
 
-    def update_topic_statistics(self, topic_id: int = None) -> None:
-        """Update email counts and last used dates for topics"""
+    def update_topic_statistics(self, topic_id: int = None) -> int:
+        """Reconcile cached email counts and last used dates with EmailTopic.
 
+        Assignment changes keep both up to date as deltas; this is the periodic
+        repair. It runs one GROUP BY over EmailTopic and bulk updates only the
+        topics that drifted. Returns the number of topics repaired.
+        """
+
+        stats_query = db.session.query(
+            EmailTopic.topic_id,
+            func.count(EmailTopic.id),
+            func.max(EmailTopic.assigned_at),
+        ).group_by(EmailTopic.topic_id)
+        topics_query = db.session.query(Topic.id, Topic.email_count, Topic.last_used)
         if topic_id:
-            topics = [Topic.query.get(topic_id)]
-        else:
-            topics = Topic.query.all()
+            stats_query = stats_query.filter(EmailTopic.topic_id == topic_id)
+            topics_query = topics_query.filter(Topic.id == topic_id)
 
-        for topic in topics:
-            if topic:
-                # Update email count
-                topic.email_count = EmailTopic.query.filter_by(
-                    topic_id=topic.id
-                ).count()
-
-                # Update last used
-                last_assignment = (
-                    EmailTopic.query.filter_by(topic_id=topic.id)
-                    .order_by(desc(EmailTopic.assigned_at))
-                    .first()
-                )
+        stats = {
+            stats_topic_id: (count, last_assigned)
+            for stats_topic_id, count, last_assigned in stats_query.all()
+        }
 
-                if last_assignment:
-                    topic.last_used = last_assignment.assigned_at
+        repairs = []
+        for row_topic_id, email_count, last_used in topics_query.all():
+            count, last_assigned = stats.get(row_topic_id, (0, None))
+            # Assignments stamp last_used with their assigned_at, so only an older
+            # date is drift; removals do not make a topic unused
+            stale = last_assigned is not None and (
+                last_used is None or last_used < last_assigned
+            )
+            if email_count != count or stale:
+                repairs.append(
+                    {
+                        "id": row_topic_id,
+                        "email_count": count,
+                        "last_used": last_assigned if stale else last_used,
+                    }
+                )
 
+        if repairs:
+            db.session.bulk_update_mappings(Topic, repairs)
         db.session.commit()
+        _hierarchy_cache.invalidate()
+
+        if repairs:
+            logger.info(f"Repaired statistics of {len(repairs)} topics")
+        return len(repairs)
 
     def _generate_color_for_level(self, level: int) -> str:
         """Generate appropriate color for topic level"""
@@ -631,6 +1049,7 @@ class TopicService:
             db.session.add(similarity)
 
         db.session.commit()
+        topic_similarity.invalidate_similar_topics()
 
 
 # Global instance
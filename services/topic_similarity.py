@@ -0,0 +1,221 @@
+"""
+All-pairs topic similarity.
+Computes email co-occurrence Jaccard, keyword Jaccard and centroid cosine similarity for every
+pair of active topics with matrix products, then replaces the TopicSimilarity table with the
+top-k neighbours of each topic in one transaction.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from sqlalchemy import case, or_
+
+from models import db, EmailTopic, Topic, TopicKeyword, TopicSimilarity
+from services.cache import TTLCache
+from services.topic_closure import get_full_paths
+from services.topic_centroids import get_centroid_matrices
+from services.topic_model import get_topic_model_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Emails per block of the topic x email incidence matrix
+INCIDENCE_BLOCK_SIZE = 5000
+
+# (topic_id, threshold) -> similar topics; cleared whenever similarities are written
+_similar_topics_cache = TTLCache(ttl=60)
+
+
+def _jaccard(intersections, sizes):
+    """Jaccard matrix from pairwise intersection counts and per-topic set sizes"""
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(unions > 0, intersections / unions, 0.0)
+
+
+def cooccurrence_similarity(topic_index):
+    """Jaccard similarity of the topics' email sets.
+
+    The topic x email incidence matrix is streamed in blocks of INCIDENCE_BLOCK_SIZE emails and
+    each block adds its A @ A.T to the intersection counts, so memory stays bounded by the
+    block rather than the number of emails.
+    """
+    size = len(topic_index)
+    intersections = np.zeros((size, size), dtype=np.float64)
+    block = np.zeros((size, INCIDENCE_BLOCK_SIZE), dtype=np.float32)
+    columns = {}
+
+    def flush():
+        used = block[:, :len(columns)]
+        intersections[:] += used @ used.T
+        block[:] = 0.0
+        columns.clear()
+
+    rows = db.session.query(EmailTopic.email_id, EmailTopic.topic_id).filter(
+        EmailTopic.topic_id.in_(list(topic_index))
+    ).order_by(EmailTopic.email_id).yield_per(INCIDENCE_BLOCK_SIZE)
+
+    for email_id, topic_id in rows:
+        if email_id not in columns:
+            if len(columns) == INCIDENCE_BLOCK_SIZE:
+                flush()
+            columns[email_id] = len(columns)
+        block[topic_index[topic_id], columns[email_id]] = 1.0
+    if columns:
+        flush()
+
+    return _jaccard(intersections, np.diag(intersections).copy())
+
+
+def keyword_similarity(topic_index):
+    """Jaccard similarity of the topics' keyword sets"""
+    keyword_index = {}
+    cells = []
+    for topic_id, keyword in db.session.query(TopicKeyword.topic_id, TopicKeyword.keyword).filter(
+        TopicKeyword.topic_id.in_(list(topic_index))
+    ).all():
+        column = keyword_index.setdefault(keyword.lower(), len(keyword_index))
+        cells.append((topic_index[topic_id], column))
+
+    incidence = np.zeros((len(topic_index), max(len(keyword_index), 1)), dtype=np.float32)
+    for row, column in cells:
+        incidence[row, column] = 1.0
+
+    intersections = incidence @ incidence.T
+    return _jaccard(intersections, np.diag(intersections).copy())
+
+
+def centroid_similarity(topic_index, matrices=None):
+    """Cosine similarity of the topics' embedding centroids (0 where a topic has none)"""
+    if matrices is None:
+        matrices = get_centroid_matrices()
+
+    size = len(topic_index)
+    similarity = np.zeros((size, size), dtype=np.float32)
+    for topic_ids, matrix in matrices.values():
+        positions = [topic_index.get(topic_id) for topic_id in topic_ids]
+        keep = [index for index, position in enumerate(positions) if position is not None]
+        if not keep:
+            continue
+
+        vectors = matrix[keep]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        positions = np.asarray([positions[index] for index in keep])
+
+        # A topic with centroids of several widths keeps its best match
+        block = np.clip(vectors @ vectors.T, 0.0, 1.0)
+        current = similarity[np.ix_(positions, positions)]
+        similarity[np.ix_(positions, positions)] = np.maximum(current, block)
+
+    return similarity
+
+
+SIMILARITY_METHODS = {
+    'cooccurrence': cooccurrence_similarity,
+    'keyword': keyword_similarity,
+    'embedding': centroid_similarity,
+}
+
+
+def rebuild_topic_similarities(top_k=10, min_score=0.1, methods=None):
+    """Recompute similarities between all active topics and store each topic's top_k neighbours.
+
+    A pair's score is the highest of its method scores and calculation_method names the method
+    that produced it. Replaces the TopicSimilarity table and commits; returns the pairs written.
+    """
+    if methods is None:
+        methods = list(SIMILARITY_METHODS)
+
+    topic_ids = sorted(get_topic_model_snapshot().active_topic_ids)
+    topic_index = {topic_id: index for index, topic_id in enumerate(topic_ids)}
+    size = len(topic_ids)
+
+    scores = np.zeros((size, size), dtype=np.float32)
+    best_method = np.full((size, size), -1, dtype=np.int8)
+    for method_index, method in enumerate(methods):
+        method_scores = SIMILARITY_METHODS[method](topic_index).astype(np.float32)
+        better = method_scores > scores
+        scores[better] = method_scores[better]
+        best_method[better] = method_index
+    np.fill_diagonal(scores, 0.0)
+
+    pairs = {}
+    if size > 1:
+        k = min(top_k, size - 1)
+        neighbours = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row in range(size):
+            for column in neighbours[row]:
+                if scores[row, column] > 0 and scores[row, column] >= min_score:
+                    pairs[(min(row, column), max(row, column))] = (
+                        float(scores[row, column]), methods[best_method[row, column]]
+                    )
+
+    now = datetime.utcnow()
+    TopicSimilarity.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(TopicSimilarity, [
+        {
+            'topic1_id': topic_ids[row],
+            'topic2_id': topic_ids[column],
+            'similarity_score': score,
+            'calculation_method': method,
+            'calculated_at': now
+        }
+        for (row, column), (score, method) in pairs.items()
+    ])
+    db.session.commit()
+    invalidate_similar_topics()
+
+    logger.info(f"Stored {len(pairs)} topic similarities for {size} topics (top {top_k}, >= {min_score})")
+    return len(pairs)
+
+
+def get_similar_topics(topic_id, threshold=0.3):
+    """Get the stored neighbours of a topic, best first.
+
+    One joined query for the neighbours, plus one each for their full paths and children, which
+    are the same hierarchy fields Topic.to_dict() gives.
+    """
+    cache_key = (topic_id, threshold)
+    results = _similar_topics_cache.get(cache_key)
+    if results is not None:
+        return results
+
+    other_topic_id = case(
+        (TopicSimilarity.topic1_id == topic_id, TopicSimilarity.topic2_id),
+        else_=TopicSimilarity.topic1_id
+    )
+    rows = db.session.query(
+        Topic, TopicSimilarity.similarity_score, TopicSimilarity.calculation_method
+    ).join(Topic, Topic.id == other_topic_id).filter(
+        or_(TopicSimilarity.topic1_id == topic_id, TopicSimilarity.topic2_id == topic_id),
+        TopicSimilarity.similarity_score >= threshold
+    ).order_by(TopicSimilarity.similarity_score.desc()).all()
+
+    topic_ids = [topic.id for topic, _, _ in rows]
+    full_paths = get_full_paths(topic_ids) if topic_ids else {}
+    children = {}
+    if topic_ids:
+        for child in Topic.query.filter(Topic.parent_id.in_(topic_ids)).order_by(Topic.id).all():
+            children.setdefault(child.parent_id, []).append(child.to_dict(include_hierarchy=False))
+
+    results = []
+    for topic, similarity_score, calculation_method in rows:
+        topic_dict = topic.to_dict(include_hierarchy=False)
+        topic_dict['parent_id'] = topic.parent_id
+        topic_dict['full_path'] = full_paths.get(topic.id, topic.name)
+        topic_dict['children'] = children.get(topic.id, [])
+        results.append({
+            'topic': topic_dict,
+            'similarity_score': similarity_score,
+            'calculation_method': calculation_method
+        })
+
+    _similar_topics_cache.set(cache_key, results)
+    return results
+
+
+def invalidate_similar_topics():
+    """Drop cached neighbour lists after similarities or topics change"""
+    _similar_topics_cache.invalidate()
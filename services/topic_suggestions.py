@@ -0,0 +1,154 @@
+"""
+Topic suggestions from n-gram statistics.
+A customer's emails are streamed once. Unigram and bigram document frequencies are counted
+separately for unclassified emails (the foreground) and classified ones (the background), and
+an inverted index from term to unclassified email ids is built in the same pass. Terms that
+are distinctly over-represented among unclassified emails, by log-likelihood against the
+background, become candidate topics together with the emails that support them.
+"""
+
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+
+from sqlalchemy import exists, func
+
+from models import db, EmailThread, EmailTopic
+from services.topic_classifier import KEYWORD_STOP_WORDS
+from services.topic_model import get_topic_model_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Mail boilerplate that says nothing about an email's topic
+SUGGESTION_STOP_WORDS = KEYWORD_STOP_WORDS | {
+    're', 'fw', 'fwd', 'you', 'your', 'our', 'we', 'not', 'all', 'any', 'are', 'can', 'get',
+    'please', 'thanks', 'thank', 'regards', 'hi', 'hello', 'dear', 'sent', 'email', 'message',
+    'com', 'www', 'http', 'https', 'just', 'also', 'about', 'what', 'when', 'there', 'here',
+    'more', 'into', 'out', 'let', 'know', 'if', 'so', 'me', 'my', 'us', 'they', 'them', 'their'
+}
+
+TOKEN_PATTERN = re.compile(r'\b[a-z][a-z0-9]{2,}\b')
+
+# Only the start of a body is read; topics show up early and long threads repeat themselves
+MAX_BODY_CHARS = 2000
+
+# Candidates sharing more than this fraction of their emails with a better one are dropped
+MAX_SUPPORT_OVERLAP = 0.8
+
+
+def extract_terms(text):
+    """Distinct unigrams and bigrams of a text, without stop words"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    terms = set()
+    previous = None
+    for token in tokens:
+        if token in SUGGESTION_STOP_WORDS:
+            previous = None
+            continue
+        terms.add(token)
+        if previous is not None:
+            terms.add(previous + ' ' + token)
+        previous = token
+    return terms
+
+
+def log_likelihood(foreground_count, background_count, foreground_size, background_size):
+    """Dunning log-likelihood (G2) of a term's document frequency in two corpora"""
+    total = foreground_size + background_size
+    combined = foreground_count + background_count
+    expected_foreground = foreground_size * combined / total
+    expected_background = background_size * combined / total
+
+    score = 0.0
+    if foreground_count:
+        score += foreground_count * math.log(foreground_count / expected_foreground)
+    if background_count:
+        score += background_count * math.log(background_count / expected_background)
+    return 2.0 * score
+
+
+def _known_terms():
+    """Existing topic names and keywords, which need no suggestion"""
+    snapshot = get_topic_model_snapshot()
+    known = set(' '.join(topic.name.lower().split()) for topic in snapshot.topics.values())
+    known.update(' '.join(entry.keyword.lower().split()) for entry in snapshot.keyword_index.entries)
+    return known
+
+
+def suggest_topics(customer_id, min_cluster_size=3, max_suggestions=20, batch_size=500):
+    """Suggest new topics from terms that are distinctive for a customer's unclassified emails"""
+    body = func.substr(
+        func.coalesce(EmailThread.body_full, EmailThread.body_preview, ''), 1, MAX_BODY_CHARS
+    )
+    rows = db.session.query(
+        EmailThread.id,
+        EmailThread.subject,
+        body,
+        exists().where(EmailTopic.email_id == EmailThread.id).label('classified')
+    ).filter(EmailThread.customer_id == customer_id).yield_per(batch_size)
+
+    foreground = Counter()
+    background = Counter()
+    postings = defaultdict(list)  # term -> unclassified email ids
+    subjects = {}
+    foreground_size = background_size = 0
+
+    for email_id, subject, body_text, classified in rows:
+        terms = extract_terms('{} {}'.format(subject or '', body_text or ''))
+        if classified:
+            background_size += 1
+            background.update(terms)
+            continue
+
+        foreground_size += 1
+        foreground.update(terms)
+        subjects[email_id] = subject
+        for term in terms:
+            postings[term].append(email_id)
+
+    if foreground_size < min_cluster_size:
+        return []
+
+    known = _known_terms()
+    candidates = []
+    for term, count in foreground.items():
+        if count < min_cluster_size or term in known:
+            continue
+        if background_size:
+            # Only terms over-represented among unclassified emails
+            if count / foreground_size <= background[term] / background_size:
+                continue
+            score = log_likelihood(count, background[term], foreground_size, background_size)
+        else:
+            # Nothing classified yet: prefer terms shared by a cluster, not by every email
+            score = count * math.log(foreground_size / count)
+        if score > 0:
+            candidates.append((score, term))
+    candidates.sort(reverse=True)
+
+    suggestions = []
+    selected = []
+    for score, term in candidates:
+        support = set(postings[term])
+        if any(len(support & chosen) > MAX_SUPPORT_OVERLAP * min(len(support), len(chosen))
+               for chosen in selected):
+            continue
+
+        selected.append(support)
+        email_ids = postings[term]
+        suggestions.append({
+            'suggested_name': term.title(),
+            'term': term,
+            'email_count': len(email_ids),
+            'email_ids': email_ids,
+            'sample_subjects': [subjects[email_id] for email_id in email_ids[:3]],
+            'score': round(score, 3),
+            'confidence': min(len(email_ids) / 10.0, 1.0)
+        })
+        if len(suggestions) >= max_suggestions:
+            break
+
+    logger.info(f"Suggested {len(suggestions)} topics for customer {customer_id} from "
+                f"{foreground_size} unclassified and {background_size} classified emails")
+    return suggestions
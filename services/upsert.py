@@ -0,0 +1,63 @@
+"""
+Dialect-aware bulk upsert.
+SQLite and PostgreSQL both support INSERT ... ON CONFLICT DO UPDATE, which writes a whole chunk
+of rows in one statement; other databases fall back to a lookup followed by bulk insert/update.
+"""
+
+import logging
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def _dialect_insert(dialect_name):
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    return None
+
+
+def upsert_rows(model, rows, index_elements, update_columns):
+    """Insert rows (dicts) into model's table, updating update_columns on a unique conflict.
+
+    index_elements are the columns of the unique constraint. Rows must not repeat a key.
+    Runs in the current transaction; the caller commits.
+    """
+    if not rows:
+        return
+
+    insert = _dialect_insert(db.session.get_bind().dialect.name)
+    if insert is not None:
+        statement = insert(model.__table__).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+        db.session.execute(statement)
+        return
+
+    # Generic fallback: one lookup for the chunk, then bulk insert/update
+    key_columns = [getattr(model, column) for column in index_elements]
+    existing = {}
+    for row in db.session.query(model.id, *key_columns).filter(
+        key_columns[0].in_(set(row[index_elements[0]] for row in rows))
+    ).all():
+        existing[tuple(row[1:])] = row[0]
+
+    inserts = []
+    updates = []
+    for row in rows:
+        row_id = existing.get(tuple(row[column] for column in index_elements))
+        if row_id is None:
+            inserts.append(row)
+        else:
+            updates.append(dict({column: row[column] for column in update_columns}, id=row_id))
+
+    if inserts:
+        db.session.bulk_insert_mappings(model, inserts)
+    if updates:
+        db.session.bulk_update_mappings(model, updates)